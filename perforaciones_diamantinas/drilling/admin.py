@@ -138,7 +138,7 @@ class UnidadMedidaAdmin(admin.ModelAdmin):
 @admin.register(Turno)
 class TurnoAdmin(admin.ModelAdmin):
     list_display = ['id', 'get_sondajes_display', 'fecha', 'maquina', 'tipo_turno']
-    list_filter = ['fecha', 'tipo_turno', 'sondajes__contrato']
+    list_filter = ['fecha', 'tipo_turno', 'contrato']
     search_fields = ['sondajes__nombre_sondaje', 'maquina__nombre']
     date_hierarchy = 'fecha'
     ordering = ['-fecha']
@@ -234,3 +234,25 @@ try:
         raw_id_fields = ['turno', 'abastecimiento']
 except:
     pass
+
+@admin.register(HorometroMovimiento)
+class HorometroMovimientoAdmin(admin.ModelAdmin):
+    list_display = ['maquina', 'fecha', 'horas', 'tipo', 'turno', 'created_at']
+    list_filter = ['tipo', 'maquina']
+    date_hierarchy = 'fecha'
+    ordering = ['-fecha', '-id']
+    raw_id_fields = ['maquina', 'turno']
+
+@admin.register(StockBalance)
+class StockBalanceAdmin(admin.ModelAdmin):
+    list_display = ['abastecimiento', 'contrato', 'cantidad_consumida', 'cantidad_disponible', 'valor_disponible', 'updated_at']
+    list_filter = ['contrato']
+    raw_id_fields = ['abastecimiento']
+    readonly_fields = ['contrato', 'precio_unitario', 'cantidad_consumida', 'cantidad_disponible', 'valor_disponible']
+
+@admin.register(ImportacionAbastecimiento)
+class ImportacionAbastecimientoAdmin(admin.ModelAdmin):
+    list_display = ['nombre_archivo', 'usuario', 'contrato', 'estado', 'filas_leidas', 'creados', 'omitidos', 'created_at', 'finalizado_at']
+    list_filter = ['estado', 'contrato']
+    ordering = ['-created_at']
+    readonly_fields = ['previa', 'worker', 'filas_leidas', 'total_filas', 'creados', 'omitidos', 'eliminados', 'errores', 'resultado', 'iniciado_at', 'finalizado_at']
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class DrillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'drilling'
+
+    def ready(self):
+        from .utils import form_options, reference_cache
+        reference_cache.conectar_senales()
+        form_options.conectar_senales()
@@ -1,7 +1,58 @@
 from django import forms
 from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
 from .models import *
 
+
+class AutocompleteSelect(forms.Select):
+    """Select que solo renderiza la opción seleccionada.
+
+    Las demás opciones se buscan en el servidor (`url`, respuesta
+    {'results': [{'id', 'text'}], 'more'}), por lo que el formulario no carga
+    el queryset completo. La validación sigue usando el queryset del campo.
+    El campo de búsqueda y la carga de opciones los agrega
+    `static/js/autocomplete.js`, incluido en base.html.
+    """
+
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = str(self.url)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        seleccionados = self._valores_validos(value)
+        opciones = [self.create_option(name, '', '---------', not seleccionados, 0, attrs=attrs)]
+        if seleccionados:
+            campo = self.choices.field
+            clave = campo.to_field_name or 'pk'
+            queryset = self.choices.queryset.filter(**{f'{clave}__in': seleccionados})
+            for index, obj in enumerate(queryset, start=1):
+                opciones.append(self.create_option(
+                    name, campo.prepare_value(obj), campo.label_from_instance(obj), True, index, attrs=attrs,
+                ))
+        return [(None, opciones, 0)]
+
+    def _valores_validos(self, value):
+        # Al re-renderizar un formulario inválido `value` trae los datos crudos
+        # del POST: descartar lo que no es una clave válida en vez de fallar la consulta
+        modelo = self.choices.queryset.model
+        to_field_name = self.choices.field.to_field_name
+        campo = modelo._meta.get_field(to_field_name) if to_field_name else modelo._meta.pk
+        validos = []
+        for v in value:
+            if v in ('', None):
+                continue
+            try:
+                validos.append(campo.to_python(v))
+            except ValidationError:
+                continue
+        return validos
+
+
 class TrabajadorForm(forms.ModelForm):
     class Meta:
         model = Trabajador
@@ -37,6 +88,32 @@ class MaquinaForm(forms.ModelForm):
             'horometro': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0'}),
         }
 
+class MaquinaUpdateForm(MaquinaForm):
+    """Edición de máquina sin escribir el saldo del horómetro.
+
+    `horometro` no es el campo del modelo: la corrección se aplica como ajuste
+    (diferencia contra `horometro_mostrado`, el valor con que se renderizó el
+    formulario) mediante `HorometroMovimiento.registrar`, así las horas que un
+    turno sume mientras el formulario está abierto no se pierden.
+    """
+    horometro = forms.DecimalField(
+        max_digits=10, decimal_places=2, min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0'}),
+    )
+    horometro_mostrado = forms.DecimalField(max_digits=10, decimal_places=2, widget=forms.HiddenInput)
+
+    class Meta(MaquinaForm.Meta):
+        fields = ['nombre', 'tipo', 'estado']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['horometro'].initial = self.instance.horometro
+        self.fields['horometro_mostrado'].initial = self.instance.horometro
+
+    def ajuste_horometro(self):
+        """Horas a sumar al saldo actual (0 si el usuario no corrigió el horómetro)."""
+        return self.cleaned_data['horometro'] - self.cleaned_data['horometro_mostrado']
+
 class SondajeForm(forms.ModelForm):
     class Meta:
         model = Sondaje
@@ -154,8 +231,8 @@ class ConsumoStockForm(forms.ModelForm):
             'metros_inicio', 'metros_fin', 'estado_final', 'observaciones'
         ]
         widgets = {
-            'turno': forms.Select(attrs={'class': 'form-select'}),
-            'abastecimiento': forms.Select(attrs={'class': 'form-select'}),
+            'turno': AutocompleteSelect(reverse_lazy('api-turno-autocomplete'), attrs={'class': 'form-select'}),
+            'abastecimiento': AutocompleteSelect(reverse_lazy('api-abastecimiento-autocomplete'), attrs={'class': 'form-select'}),
             'cantidad_consumida': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0.01'}),
             'serie_utilizada': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Serie del producto utilizado'}),
             'metros_inicio': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0'}),
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from drilling.models import Contrato
+from drilling.utils.benchmark import ESCENARIOS, BancoPruebas, cargar_base, comparar_con_base, guardar_base
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la latencia (p50/p95/p99) y las consultas SQL de los flujos principales con el cliente de '
+        'pruebas de Django y compara contra una línea base JSON. Sin cambios en la BD (todo se revierte).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contrato', type=str, default=None,
+                            help='Nombre del contrato a usar (por defecto el que tiene más turnos)')
+        parser.add_argument('--escenarios', type=str, default=','.join(ESCENARIOS),
+                            help='Escenarios separados por coma')
+        parser.add_argument('--iteraciones', type=int, default=20, help='Requests medidos por escenario')
+        parser.add_argument('--calentamiento', type=int, default=2, help='Requests previos no medidos')
+        parser.add_argument('--filas-importacion', type=int, default=200, help='Filas del Excel importado')
+        parser.add_argument('--baseline', type=str, default=None,
+                            help='JSON de línea base; falla si hay regresiones')
+        parser.add_argument('--guardar-baseline', type=str, default=None,
+                            help='Guardar los resultados como nueva línea base en este archivo')
+        parser.add_argument('--tolerancia', type=float, default=0.25,
+                            help='Aumento de p95 tolerado frente a la base (fracción)')
+
+    def handle(self, *args, **options):
+        escenarios = [e.strip() for e in options['escenarios'].split(',') if e.strip()]
+        desconocidos = set(escenarios) - set(ESCENARIOS)
+        if desconocidos:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+        if options['iteraciones'] < 1:
+            raise CommandError('--iteraciones debe ser mayor que cero')
+
+        if options['contrato']:
+            contrato = Contrato.objects.filter(nombre_contrato=options['contrato']).first()
+            if contrato is None:
+                raise CommandError(f"Contrato '{options['contrato']}' no existe")
+        else:
+            contrato = Contrato.objects.annotate(n=Count('turnos')).order_by('-n', 'pk').first()
+            if contrato is None:
+                raise CommandError('No hay contratos: ejecute generate_synthetic_data primero')
+        base = cargar_base(options['baseline']) if options['baseline'] else None
+
+        self.stdout.write(f'Contrato: {contrato.nombre_contrato} ({options["iteraciones"]} iteraciones)')
+        self.stdout.write(f'{"escenario":<20} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"consultas":>10}')
+
+        def mostrar(nombre, r):
+            self.stdout.write(f'{nombre:<20} {r["p50_ms"]:>9} {r["p95_ms"]:>9} {r["p99_ms"]:>9} {r["consultas"]:>10}')
+
+        banco = BancoPruebas(
+            contrato, iteraciones=options['iteraciones'], calentamiento=options['calentamiento'],
+            filas_importacion=options['filas_importacion'],
+        )
+        try:
+            resultados = banco.ejecutar(escenarios, log=mostrar)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['guardar_baseline']:
+            guardar_base(resultados, options['guardar_baseline'], options['iteraciones'])
+            self.stdout.write(f'Línea base guardada en {options["guardar_baseline"]}')
+
+        if base is not None:
+            regresiones = comparar_con_base(resultados, base, options['tolerancia'])
+            for regresion in regresiones:
+                self.stdout.write(self.style.ERROR(regresion))
+            if regresiones:
+                raise CommandError(f'{len(regresiones)} regresiones respecto de {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('Sin regresiones respecto de la línea base'))
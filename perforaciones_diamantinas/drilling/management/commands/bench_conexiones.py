@@ -0,0 +1,95 @@
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, RequestFactory
+from django.urls import reverse
+
+from drilling.models import CustomUser
+from drilling.utils.benchmark import percentil
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara la latencia de una vista autenticada simple abriendo una conexión por request '
+        '(CONN_MAX_AGE=0) frente a conexiones persistentes con health checks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Requests por escenario')
+        parser.add_argument('--username', type=str, default=None, help='Usuario existente a utilizar')
+        parser.add_argument('--conn-max-age', type=int, default=None,
+                            help='CONN_MAX_AGE del escenario persistente (por defecto el de settings o 300)')
+
+    def handle(self, *args, **options):
+        n = options['requests']
+        if options['username']:
+            user = CustomUser.objects.filter(username=options['username']).first()
+        else:
+            user = CustomUser.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError('No hay usuarios en la base de datos')
+
+        # Sesión real del usuario: la vista recorre sesión, auth y middleware como en producción
+        cliente = Client()
+        cliente.force_login(user)
+        cookie = cliente.cookies[settings.SESSION_COOKIE_NAME]
+        host = next((h for h in settings.ALLOWED_HOSTS if h and not h.startswith('.') and h != '*'), 'localhost')
+        environ = RequestFactory()._base_environ(
+            PATH_INFO=reverse('api-turno-autocomplete'),
+            QUERY_STRING='limit=1',
+            REQUEST_METHOD='GET',
+            HTTP_HOST=host,
+            HTTP_COOKIE=f'{settings.SESSION_COOKIE_NAME}={cookie.value}',
+        )
+
+        configurado = connection.settings_dict.get('CONN_MAX_AGE') or 300
+        escenarios = [
+            ('Conexión por request', 0, False),
+            ('Persistente + health checks', options['conn_max_age'] or configurado, True),
+        ]
+        original = {k: connection.settings_dict.get(k) for k in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        aperturas = []
+
+        def contar(sender, connection, **kwargs):
+            aperturas.append(connection.alias)
+
+        handler = WSGIHandler()
+        connection_created.connect(contar)
+        resultados = []
+        try:
+            for nombre, max_age, health_checks in escenarios:
+                connections.close_all()
+                connection.settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+                aperturas.clear()
+                tiempos = []
+                for _ in range(n):
+                    inicio = time.perf_counter()
+                    # Ciclo completo del handler: request_started/request_finished
+                    # cierran o reutilizan la conexión según CONN_MAX_AGE
+                    respuesta = handler(dict(environ), lambda status, headers: None)
+                    b''.join(respuesta)
+                    respuesta.close()
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+                    if respuesta.status_code != 200:
+                        raise CommandError(f'La vista respondió {respuesta.status_code}')
+                resultados.append((nombre, max_age, tiempos, len(aperturas)))
+        finally:
+            connection_created.disconnect(contar)
+            connections.close_all()
+            connection.settings_dict.update(original)
+            cliente.logout()
+
+        self.stdout.write(f'{n} requests GET {environ["PATH_INFO"]} como {user.username} ({connection.vendor})')
+        for nombre, max_age, tiempos, abiertas in resultados:
+            self.stdout.write(
+                f'{nombre:<30} CONN_MAX_AGE={max_age:<5} p50={percentil(tiempos, 50):.1f} ms '
+                f'p95={percentil(tiempos, 95):.1f} ms conexiones abiertas={abiertas}'
+            )
+        base, persistente = percentil(resultados[0][2], 50), percentil(resultados[1][2], 50)
+        self.stdout.write(self.style.SUCCESS(
+            f'p50: {base:.1f} ms -> {persistente:.1f} ms (ahorro de {base - persistente:.1f} ms por request)'
+        ))
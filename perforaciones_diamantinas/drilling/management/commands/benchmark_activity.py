@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from drilling.middleware import ContractSecurityMiddleware
+from drilling.models import CustomUser
+from drilling.utils.activity_tracker import activity_tracker
+
+
+class LegacyActivityMiddleware:
+    """Comportamiento anterior: un UPDATE de last_activity en cada request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.user.is_authenticated:
+            request.user.last_activity = timezone.now()
+            request.user.save(update_fields=['last_activity'])
+        return self.get_response(request)
+
+
+class Command(BaseCommand):
+    help = 'Compara la latencia por request del registro de last_activity (UPDATE por request vs. tracker agrupado)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests simulados por escenario')
+        parser.add_argument('--username', type=str, default=None, help='Usuario existente a utilizar')
+
+    def handle(self, *args, **options):
+        n = options['requests']
+        if options['username']:
+            user = CustomUser.objects.filter(username=options['username']).first()
+        else:
+            user = CustomUser.objects.order_by('pk').first()
+        if user is None:
+            self.stdout.write(self.style.ERROR('No hay usuarios en la base de datos'))
+            return
+
+        factory = RequestFactory()
+        escenarios = [
+            ('UPDATE por request', LegacyActivityMiddleware(lambda request: HttpResponse())),
+            ('Tracker agrupado', ContractSecurityMiddleware(lambda request: HttpResponse())),
+        ]
+
+        # Todo corre en una transacción que se revierte: el last_activity del usuario queda como estaba
+        with transaction.atomic():
+            resultados = self._medir(user, n, factory, escenarios)
+            transaction.set_rollback(True)
+
+        for nombre, tiempos, queries in resultados:
+            media = sum(tiempos) / len(tiempos) * 1000
+            p95 = tiempos[max(int(len(tiempos) * 0.95) - 1, 0)] * 1000
+            self.stdout.write(f'{nombre:<20} media={media:.3f} ms  p95={p95:.3f} ms  escrituras={queries}')
+
+        base = sum(resultados[0][1])
+        nuevo = sum(resultados[1][1])
+        if base > 0:
+            self.stdout.write(self.style.SUCCESS(f'Reducción de latencia media: {(1 - nuevo / base) * 100:.1f}%'))
+
+    def _medir(self, user, n, factory, escenarios):
+        resultados = []
+        for nombre, middleware in escenarios:
+            # Partir siempre de un last_activity vencido para medir también la primera escritura
+            CustomUser.objects.filter(pk=user.pk).update(last_activity=None)
+            tiempos = []
+            with CaptureQueriesContext(connection) as ctx:
+                for _ in range(n):
+                    request = factory.get('/')
+                    # AuthenticationMiddleware carga el usuario en cada request
+                    request.user = CustomUser.objects.get(pk=user.pk)
+                    inicio = time.perf_counter()
+                    middleware(request)
+                    tiempos.append(time.perf_counter() - inicio)
+                activity_tracker.flush()
+            # Descontar el SELECT del usuario que simula AuthenticationMiddleware
+            queries = len(ctx.captured_queries) - n
+            tiempos.sort()
+            resultados.append((nombre, tiempos, queries))
+        return resultados
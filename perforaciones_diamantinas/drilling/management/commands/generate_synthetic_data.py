@@ -0,0 +1,61 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drilling.utils.synthetic_data import GeneradorDatosSinteticos
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera contratos sintéticos con máquinas, trabajadores, abastecimientos y años de turnos '
+        'completos para pruebas de carga. Misma semilla y misma --hasta producen los mismos datos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contratos', type=int, default=2, help='Contratos a crear')
+        parser.add_argument('--maquinas', type=int, default=4, help='Máquinas por contrato')
+        parser.add_argument('--trabajadores', type=int, default=40, help='Trabajadores por contrato')
+        parser.add_argument('--dias', type=int, default=365, help='Días de turnos hacia atrás desde --hasta')
+        parser.add_argument('--turnos-por-dia', type=int, default=2, help='Turnos por máquina y día (tipos de turno)')
+        parser.add_argument('--abastecimientos', type=int, default=30, help='Líneas de abastecimiento por contrato y mes')
+        parser.add_argument('--hasta', type=date.fromisoformat, default=None, help='Último día (AAAA-MM-DD, por defecto hoy)')
+        parser.add_argument('--seed', type=int, default=42, help='Semilla del generador aleatorio')
+        parser.add_argument('--prefijo', type=str, default='SINT', help='Prefijo de los nombres de contrato')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Filas por INSERT de bulk_create')
+        parser.add_argument('--dias-por-bloque', type=int, default=30, help='Días de turnos por transacción')
+
+    def handle(self, *args, **options):
+        for opcion in ('contratos', 'maquinas', 'dias', 'turnos_por_dia', 'batch_size', 'dias_por_bloque'):
+            if options[opcion] < 1:
+                raise CommandError(f'--{opcion.replace("_", "-")} debe ser mayor que cero')
+        if options['trabajadores'] < 3:
+            raise CommandError('--trabajadores debe ser al menos 3 (una cuadrilla por turno)')
+
+        generador = GeneradorDatosSinteticos(
+            seed=options['seed'],
+            contratos=options['contratos'],
+            maquinas=options['maquinas'],
+            trabajadores=options['trabajadores'],
+            dias=options['dias'],
+            turnos_por_dia=options['turnos_por_dia'],
+            abastecimientos_por_mes=options['abastecimientos'],
+            prefijo=options['prefijo'],
+            hasta=options['hasta'],
+            batch_size=options['batch_size'],
+            dias_por_bloque=options['dias_por_bloque'],
+            log=self.stdout.write if options['verbosity'] > 0 else None,
+        )
+        inicio = time.perf_counter()
+        try:
+            conteos = generador.generar()
+        except ValueError as e:
+            raise CommandError(str(e))
+        duracion = time.perf_counter() - inicio
+
+        for modelo, filas in conteos.items():
+            self.stdout.write(f'{modelo:<22} {filas:>10}')
+        total = sum(conteos.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} filas en {duracion:.1f} s ({total / max(duracion, 0.001):.0f} filas/s)'
+        ))
@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from drilling.models import ImportacionAbastecimiento
+from drilling.utils.import_queue import nombre_worker, procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Worker de importaciones de abastecimiento encoladas (varios workers pueden correr en paralelo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Procesar las pendientes y terminar')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Segundos de espera cuando la cola está vacía')
+        parser.add_argument('--stale-minutes', type=int, default=5,
+                            help='Reencolar importaciones EN_PROCESO sin latido de su worker hace más de N minutos')
+        parser.add_argument('--preview-hours', type=int, default=24,
+                            help='Descartar vistas previas no confirmadas con más de N horas')
+
+    def handle(self, *args, **options):
+        alias = getattr(settings, 'REFERENCE_DATA_CACHE', 'default')
+        if isinstance(caches[alias], LocMemCache):
+            # Las invalidaciones de tablas de referencia del worker no llegarían a la web
+            raise CommandError(
+                f"La caché '{alias}' es en memoria del proceso: configure CACHE_URL con una caché "
+                'compartida (filecache, dbcache, redis) para correr el worker'
+            )
+        worker = nombre_worker()
+        self.stdout.write(f'Worker {worker} iniciado')
+        try:
+            while True:
+                liberadas = ImportacionAbastecimiento.liberar_colgadas(timedelta(minutes=options['stale_minutes']))
+                if liberadas:
+                    self.stdout.write(self.style.WARNING(f'{liberadas} importaciones colgadas reencoladas'))
+                descartadas = ImportacionAbastecimiento.descartar_previas(timedelta(hours=options['preview_hours']))
+                if descartadas:
+                    self.stdout.write(f'{descartadas} vistas previas vencidas descartadas')
+                procesadas = procesar_pendientes(worker)
+                if procesadas:
+                    self.stdout.write(self.style.SUCCESS(f'{procesadas} importaciones procesadas'))
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Worker detenido')
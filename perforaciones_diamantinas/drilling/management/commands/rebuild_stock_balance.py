@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drilling.models import Abastecimiento, Contrato
+from drilling.utils.stock import reconstruir_balances, verificar_balances
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye (o solo verifica con --verify) los saldos de StockBalance desde el historial de consumos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Solo comparar saldos con el historial, sin escribir')
+        parser.add_argument('--contrato', type=str, default=None, help='Nombre del contrato a procesar (todos por defecto)')
+
+    def handle(self, *args, **options):
+        queryset = Abastecimiento.objects.all()
+        if options['contrato']:
+            try:
+                contrato = Contrato.objects.get(nombre_contrato=options['contrato'])
+            except Contrato.DoesNotExist:
+                raise CommandError(f"Contrato '{options['contrato']}' no existe")
+            queryset = queryset.filter(contrato=contrato)
+
+        diferencias = verificar_balances(queryset)
+        for pk, esperado, registrado in diferencias[:50]:
+            registrado = 'sin saldo' if registrado is None else registrado
+            self.stdout.write(f'Abastecimiento {pk}: esperado={esperado} registrado={registrado}')
+        if len(diferencias) > 50:
+            self.stdout.write(f'... y {len(diferencias) - 50} diferencias más')
+
+        if options['verify']:
+            if diferencias:
+                raise CommandError(f'{len(diferencias)} saldos no coinciden con el historial')
+            self.stdout.write(self.style.SUCCESS('Todos los saldos coinciden con el historial'))
+            return
+
+        total = reconstruir_balances(queryset)
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} saldos reconstruidos ({len(diferencias)} corregidos)'
+        ))
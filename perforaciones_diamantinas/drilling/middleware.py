@@ -1,7 +1,15 @@
-from django.utils import timezone
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from .utils.activity_tracker import activity_tracker
+from .utils.request_metrics import instrumentar_plantillas, medir_request, presupuesto_consultas, request_metrics
+
+logger = logging.getLogger(__name__)
+
 class ContractSecurityMiddleware:
     """Middleware para seguridad por contrato"""
     
@@ -9,14 +17,59 @@ class ContractSecurityMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
-        # Actualizar última actividad del usuario
+        # Registrar última actividad del usuario. El tracker agrupa las
+        # escrituras (como máximo una por usuario y ventana) en un bulk UPDATE.
         if request.user.is_authenticated:
-            request.user.last_activity = timezone.now()
-            request.user.save(update_fields=['last_activity'])
+            activity_tracker.touch(request.user)
         
         response = self.get_response(request)
+        # Escribir marcas pendientes de cualquier usuario si ya venció el intervalo
+        activity_tracker.flush_if_due()
+        return response
+
+class RequestMetricsMiddleware:
+    """Consultas SQL, tiempo de BD, de plantillas y total por nombre de URL.
+
+    Acumula las cifras en `request_metrics` (página de métricas para
+    administradores) y registra un warning cuando una vista supera su
+    presupuesto de consultas (QUERY_BUDGETS / QUERY_BUDGET_DEFAULT). El
+    encabezado Server-Timing solo se envía a usuarios staff o administradores
+    del sistema, salvo REQUEST_METRICS_SERVER_TIMING (todas las respuestas).
+
+    Debe ir primero en MIDDLEWARE para medir también lo que hacen los demás
+    middlewares, como el guardado de la sesión.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrumentar_plantillas()
+
+    def __call__(self, request):
+        with medir_request() as medicion:
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        vista = match.view_name if match else '(sin ruta)'
+        if request_metrics.registrar(vista, medicion):
+            logger.warning(
+                '%s %s (%s): %s consultas, presupuesto %s',
+                request.method, request.path, vista, medicion.consultas, presupuesto_consultas(vista),
+            )
+        if self._mostrar_server_timing(request):
+            response['Server-Timing'] = medicion.server_timing()
         return response
 
+    @staticmethod
+    def _mostrar_server_timing(request):
+        if getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', False):
+            return True
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return False
+        return user.is_staff or user.can_manage_all_contracts()
+
 class LoginRequiredMiddleware:
     """Middleware para requerir login en todas las URLs excepto login"""
     
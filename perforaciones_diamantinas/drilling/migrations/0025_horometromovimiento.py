@@ -0,0 +1,73 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:01
+
+import datetime
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_libro_horometro(apps, schema_editor):
+    """Reconstruir el libro a partir de los turnos existentes.
+
+    Cada TurnoMaquina con horas genera un movimiento TURNO en la fecha del
+    turno; la diferencia con el horómetro actual de la máquina queda como
+    saldo de APERTURA en la fecha del primer turno, de modo que la suma del
+    libro coincide con `Maquina.horometro`.
+    """
+    Maquina = apps.get_model('drilling', 'Maquina')
+    TurnoMaquina = apps.get_model('drilling', 'TurnoMaquina')
+    HorometroMovimiento = apps.get_model('drilling', 'HorometroMovimiento')
+
+    movimientos = []
+    horas_por_maquina = {}
+    primera_fecha = {}
+    for tm in TurnoMaquina.objects.select_related('turno').exclude(horas_trabajadas_calc=0).iterator():
+        turno = tm.turno
+        movimientos.append(HorometroMovimiento(
+            maquina_id=turno.maquina_id, turno_id=turno.id, fecha=turno.fecha,
+            horas=tm.horas_trabajadas_calc, tipo='TURNO',
+        ))
+        horas_por_maquina[turno.maquina_id] = horas_por_maquina.get(turno.maquina_id, Decimal('0')) + tm.horas_trabajadas_calc
+        if turno.maquina_id not in primera_fecha or turno.fecha < primera_fecha[turno.maquina_id]:
+            primera_fecha[turno.maquina_id] = turno.fecha
+
+    hoy = datetime.date.today()
+    for maquina in Maquina.objects.all().only('id', 'horometro'):
+        apertura = (maquina.horometro or Decimal('0')) - horas_por_maquina.get(maquina.id, Decimal('0'))
+        if apertura:
+            movimientos.append(HorometroMovimiento(
+                maquina_id=maquina.id, fecha=primera_fecha.get(maquina.id, hoy),
+                horas=apertura, tipo='APERTURA',
+            ))
+
+    HorometroMovimiento.objects.bulk_create(movimientos, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0024_turnomaquina_horometro_fin_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HorometroMovimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('horas', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('tipo', models.CharField(choices=[('APERTURA', 'Saldo de apertura'), ('TURNO', 'Turno'), ('AJUSTE', 'Ajuste manual')], default='TURNO', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('maquina', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos_horometro', to='drilling.maquina')),
+                ('turno', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_horometro', to='drilling.turno')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de horómetro',
+                'verbose_name_plural': 'Movimientos de horómetro',
+                'db_table': 'horometro_movimiento',
+                'indexes': [models.Index(fields=['maquina', 'fecha'], include=('horas',), name='horometro_mov_maq_fecha_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_libro_horometro, migrations.RunPython.noop),
+    ]
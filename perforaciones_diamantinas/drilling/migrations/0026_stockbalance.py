@@ -0,0 +1,56 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:05
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def poblar_balances(apps, schema_editor):
+    """Crear el saldo de cada abastecimiento a partir de sus consumos."""
+    Abastecimiento = apps.get_model('drilling', 'Abastecimiento')
+    StockBalance = apps.get_model('drilling', 'StockBalance')
+
+    cero = models.Value(Decimal('0'), output_field=models.DecimalField(max_digits=10, decimal_places=2))
+    balances = []
+    for a in Abastecimiento.objects.annotate(
+        consumido=Coalesce(models.Sum('consumostock__cantidad_consumida'), cero)
+    ).iterator():
+        disponible = a.cantidad - a.consumido
+        balances.append(StockBalance(
+            abastecimiento_id=a.id, contrato_id=a.contrato_id,
+            precio_unitario=a.precio_unitario, cantidad_consumida=a.consumido,
+            cantidad_disponible=disponible,
+            valor_disponible=(disponible * a.precio_unitario).quantize(Decimal('0.01')),
+        ))
+    StockBalance.objects.bulk_create(balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0025_horometromovimiento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('abastecimiento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='drilling.abastecimiento')),
+                ('precio_unitario', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cantidad_consumida', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cantidad_disponible', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('valor_disponible', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('contrato', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances_stock', to='drilling.contrato')),
+            ],
+            options={
+                'verbose_name': 'Saldo de stock',
+                'verbose_name_plural': 'Saldos de stock',
+                'db_table': 'stock_balance',
+                'indexes': [models.Index(fields=['contrato', 'cantidad_disponible'], name='stock_bal_contrato_disp_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_balances, migrations.RunPython.noop),
+    ]
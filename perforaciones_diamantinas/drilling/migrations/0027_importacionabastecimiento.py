@@ -0,0 +1,47 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0026_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportacionAbastecimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.FileField(upload_to='importaciones/%Y/%m/')),
+                ('nombre_archivo', models.CharField(max_length=255)),
+                ('reemplazar_existentes', models.BooleanField(default=True)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En proceso'), ('COMPLETADO', 'Completado'), ('ERROR', 'Error')], default='PENDIENTE', max_length=20)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('filas_leidas', models.PositiveIntegerField(default=0)),
+                ('total_filas', models.PositiveIntegerField(blank=True, null=True)),
+                ('creados', models.PositiveIntegerField(default=0)),
+                ('omitidos', models.PositiveIntegerField(default=0)),
+                ('eliminados', models.PositiveIntegerField(default=0)),
+                ('errores', models.JSONField(blank=True, default=list)),
+                ('resultado', models.JSONField(blank=True, default=dict)),
+                ('mensaje', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('iniciado_at', models.DateTimeField(blank=True, null=True)),
+                ('finalizado_at', models.DateTimeField(blank=True, null=True)),
+                ('contrato', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='importaciones', to='drilling.contrato')),
+                ('usuario', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='importaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Importación de abastecimiento',
+                'verbose_name_plural': 'Importaciones de abastecimiento',
+                'db_table': 'importacion_abastecimiento',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['estado', 'created_at'], name='importacion_estado_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:19
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def _sha1(texto):
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+
+def asignar_claves(apps, schema_editor):
+    """Asignar clave natural y hash de contenido a los registros ya importados.
+
+    Misma representación que AbastecimientoExcelImporter: las repeticiones de
+    una clave se numeran en orden de inserción (pk), igual que en el archivo.
+    """
+    Abastecimiento = apps.get_model('drilling', 'Abastecimiento')
+
+    repeticiones = {}
+    pendientes = []
+    for a in Abastecimiento.objects.order_by('pk').iterator():
+        base = f'{a.contrato_id}|{a.mes}|{a.codigo_producto}|{a.serie or ""}|{a.numero_guia}'
+        n = repeticiones.get(base, 0)
+        repeticiones[base] = n + 1
+        a.clave_natural = _sha1(f'{base}|{n}')
+        a.contenido_hash = _sha1('|'.join([
+            a.fecha.isoformat(), a.descripcion, a.familia, str(a.unidad_medida_id),
+            str(a.cantidad), str(a.precio_unitario),
+            '' if a.tipo_complemento_id is None else str(a.tipo_complemento_id),
+            '' if a.tipo_aditivo_id is None else str(a.tipo_aditivo_id),
+            a.observaciones,
+        ]))
+        pendientes.append(a)
+        if len(pendientes) >= 1000:
+            Abastecimiento.objects.bulk_update(pendientes, ['clave_natural', 'contenido_hash'])
+            pendientes = []
+    if pendientes:
+        Abastecimiento.objects.bulk_update(pendientes, ['clave_natural', 'contenido_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0027_importacionabastecimiento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='abastecimiento',
+            name='clave_natural',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='abastecimiento',
+            name='contenido_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.RunPython(asignar_claves, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='abastecimiento',
+            constraint=models.UniqueConstraint(fields=('contrato', 'clave_natural'), name='abastecimiento_clave_natural_uniq'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0028_abastecimiento_clave_natural'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacionabastecimiento',
+            name='previa',
+            field=models.FileField(blank=True, upload_to='importaciones/previas/'),
+        ),
+        migrations.AlterField(
+            model_name='importacionabastecimiento',
+            name='estado',
+            field=models.CharField(choices=[('PREVIA', 'Vista previa'), ('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En proceso'), ('COMPLETADO', 'Completado'), ('ERROR', 'Error')], default='PENDIENTE', max_length=20),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0029_importacion_vista_previa'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='abastecimiento',
+            index=models.Index(fields=['contrato', 'fecha', 'id'], name='abastecimie_contrat_09c69d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consumostock',
+            index=models.Index(fields=['created_at', 'id'], name='consumo_sto_created_325aa5_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0030_indices_paginacion_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacionabastecimiento',
+            name='solo_validar',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drilling', '0031_importacion_solo_validar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacionabastecimiento',
+            name='latido_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
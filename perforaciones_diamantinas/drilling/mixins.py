@@ -23,4 +23,21 @@ class SystemAdminRequiredMixin(LoginRequiredMixin):
     def dispatch(self, request, *args, **kwargs):
         if not request.user.can_manage_all_contracts():
             raise PermissionDenied("Necesita permisos de administrador del sistema")
-        return super().dispatch(request, *args, **kwargs)
\ No newline at end of file
+        return super().dispatch(request, *args, **kwargs)
+
+
+class KeysetPaginationMixin:
+    """Paginación por cursor para ListView (sin COUNT(*) ni OFFSET).
+
+    Usa `paginate_by` como tamaño de página y ordena por `keyset_ordering`,
+    que debe ser único (terminar en 'id'). `keyset_count` agrega el total en
+    `page_obj.count`: 'exacto', 'estimado' o None para no contar.
+    """
+    keyset_ordering = ('-fecha', '-id')
+    keyset_count = None
+
+    def paginate_queryset(self, queryset, page_size):
+        from .utils.keyset_pagination import paginar_keyset
+
+        page = paginar_keyset(self.request, queryset, page_size, self.keyset_ordering, self.keyset_count)
+        return None, page, page.object_list, page.has_other_pages()
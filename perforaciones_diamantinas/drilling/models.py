@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 from decimal import Decimal
@@ -432,6 +434,13 @@ class Maquina(models.Model):
     def __str__(self):
         return f"{self.nombre} - {self.contrato.nombre_contrato}"
 
+    def horometro_al(self, fecha):
+        """Horómetro acumulado de la máquina al final del día `fecha`"""
+        total = self.movimientos_horometro.filter(fecha__lte=fecha).aggregate(
+            total=models.Sum('horas')
+        )['total']
+        return total or Decimal('0')
+
 class Trabajador(models.Model):
     CARGO_CHOICES = [
         ('RESIDENTE', 'Residente'),
@@ -470,6 +479,34 @@ class Trabajador(models.Model):
     def __str__(self):
         return f"{self.nombres} {self.apellidos or ''} - {self.get_cargo_display()}"
 
+class ContratoQuerySet(models.QuerySet):
+    """Filtrado por contrato a través de la FK directa (indexada).
+
+    `campo_contrato` es el camino hasta el contrato: 'contrato' en Turno,
+    'turno__contrato' en los modelos hijos del turno. Evita el JOIN por
+    `sondajes__contrato`, que además repite el turno por cada sondaje.
+    """
+    campo_contrato = 'contrato'
+
+    def for_contract(self, contrato):
+        """Registros de `contrato` (instancia o pk) o de varios (QuerySet o lista)."""
+        if isinstance(contrato, (models.QuerySet, list, tuple, set)):
+            return self.filter(**{f'{self.campo_contrato}__in': contrato})
+        return self.filter(**{self.campo_contrato: contrato})
+
+    def for_user(self, user):
+        """Todo para el admin del sistema; para el resto, solo su contrato."""
+        if user.can_manage_all_contracts():
+            return self.all()
+        if user.contrato_id is None:
+            return self.none()
+        return self.for_contract(user.contrato_id)
+
+
+class TurnoHijoQuerySet(ContratoQuerySet):
+    campo_contrato = 'turno__contrato'
+
+
 class Turno(models.Model):
     ESTADO_CHOICES = [
         ('BORRADOR', 'Borrador'),
@@ -490,6 +527,8 @@ class Turno(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ContratoQuerySet.as_manager()
+
     class Meta:
         db_table = 'turnos'
         verbose_name = 'Turno'
@@ -529,6 +568,22 @@ class Turno(models.Model):
             pass
         return f"Turno {self.id} - {self.fecha}"
 
+def horas_entre(hora_inicio, hora_fin):
+    """Horas decimales entre dos `time`; si fin < inicio el tramo cruza medianoche.
+
+    Retorna Decimal('0') cuando falta alguno de los dos valores.
+    """
+    from datetime import datetime, timedelta
+
+    if not hora_inicio or not hora_fin:
+        return Decimal('0')
+    inicio = datetime.combine(datetime.today(), hora_inicio)
+    fin = datetime.combine(datetime.today(), hora_fin)
+    if fin < inicio:
+        fin += timedelta(days=1)
+    diff = fin - inicio
+    return Decimal(str(diff.total_seconds() / 3600))
+
 class TurnoTrabajador(models.Model):
     FUNCION_CHOICES = [
         ('PERFORISTA', 'Perforista'),
@@ -585,6 +640,8 @@ class TurnoAvance(models.Model):
     metros_perforados = models.DecimalField(max_digits=8, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TurnoHijoQuerySet.as_manager()
+
     class Meta:
         db_table = 'turno_avance'
 
@@ -610,39 +667,79 @@ class TurnoMaquina(models.Model):
     class Meta:
         db_table = 'turno_maquina'
 
-    def save(self, *args, **kwargs):
-        from datetime import datetime, timedelta
+    def calcular_horas(self):
+        """Calcular `horas_trabajadas_calc` sin guardar.
 
-        # Priorizar cálculo a partir de lecturas de horómetro (si se proporcionaron)
-        try:
-            if self.horometro_inicio is not None and self.horometro_fin is not None:
-                # Horómetro representa un contador; la diferencia es la cantidad a sumar
-                try:
-                    self.horas_trabajadas_calc = Decimal(self.horometro_fin) - Decimal(self.horometro_inicio)
-                except Exception:
-                    self.horas_trabajadas_calc = Decimal('0')
-                return super().save(*args, **kwargs)
-        except Exception:
-            # Caer a cálculo por tiempo si algo falla
-            pass
-
-        # Si no hay lecturas de horómetro completas, intentar calcular desde times
-        if not self.hora_inicio or not self.hora_fin:
+        Prioriza las lecturas de horómetro (contador) y, si no están completas,
+        usa la diferencia entre hora_inicio y hora_fin.
+        """
+        if self.horometro_inicio is not None and self.horometro_fin is not None:
+            # Horómetro representa un contador; la diferencia es la cantidad a sumar
             try:
-                self.horas_trabajadas_calc = Decimal('0')
+                self.horas_trabajadas_calc = Decimal(self.horometro_fin) - Decimal(self.horometro_inicio)
             except Exception:
-                self.horas_trabajadas_calc = 0
-            return super().save(*args, **kwargs)
-
-        # Ambos tiempos presentes, calcular horas trabajadas (horas decimales)
-        inicio = datetime.combine(datetime.today(), self.hora_inicio)
-        fin = datetime.combine(datetime.today(), self.hora_fin)
-        if fin < inicio:
-            fin += timedelta(days=1)
-        diff = fin - inicio
-        self.horas_trabajadas_calc = Decimal(str(diff.total_seconds() / 3600))
+                self.horas_trabajadas_calc = Decimal('0')
+            return self.horas_trabajadas_calc
+
+        self.horas_trabajadas_calc = horas_entre(self.hora_inicio, self.hora_fin)
+        return self.horas_trabajadas_calc
+
+    def save(self, *args, **kwargs):
+        self.calcular_horas()
         super().save(*args, **kwargs)
 
+class HorometroMovimiento(models.Model):
+    """Libro (append-only) de movimientos del horómetro de cada máquina.
+
+    `Maquina.horometro` es el saldo materializado: cada movimiento se aplica
+    con un incremento `F('horometro') + horas`, sin leer-modificar-escribir
+    en Python. El índice (maquina, fecha) permite obtener el horómetro a una
+    fecha dada (ver `Maquina.horometro_al`).
+    """
+    TIPO_CHOICES = [
+        ('APERTURA', 'Saldo de apertura'),
+        ('TURNO', 'Turno'),
+        ('AJUSTE', 'Ajuste manual'),
+    ]
+
+    maquina = models.ForeignKey(Maquina, on_delete=models.CASCADE, related_name='movimientos_horometro')
+    turno = models.ForeignKey('Turno', on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_horometro')
+    fecha = models.DateField()
+    horas = models.DecimalField(max_digits=10, decimal_places=2)
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, default='TURNO')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'horometro_movimiento'
+        verbose_name = 'Movimiento de horómetro'
+        verbose_name_plural = 'Movimientos de horómetro'
+        indexes = [
+            models.Index(fields=['maquina', 'fecha'], include=['horas'], name='horometro_mov_maq_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.maquina_id} {self.fecha} {self.horas:+}"
+
+    @classmethod
+    def registrar(cls, movimientos):
+        """Insertar `movimientos` en bloque y aplicarlos a `Maquina.horometro`.
+
+        Se emite un INSERT bulk y un UPDATE atómico por máquina afectada, por lo
+        que dos turnos guardados en paralelo para la misma máquina no pierden
+        horas. Debe llamarse dentro de la transacción que guarda el turno.
+        """
+        movimientos = [m for m in movimientos if m.horas]
+        if not movimientos:
+            return []
+        cls.objects.bulk_create(movimientos)
+        por_maquina = {}
+        for m in movimientos:
+            por_maquina[m.maquina_id] = por_maquina.get(m.maquina_id, Decimal('0')) + m.horas
+        for maquina_id, horas in por_maquina.items():
+            if horas:
+                Maquina.objects.filter(pk=maquina_id).update(horometro=models.F('horometro') + horas)
+        return movimientos
+
 class TurnoComplemento(models.Model):
     turno = models.ForeignKey(Turno, on_delete=models.CASCADE, related_name='complementos')
     sondaje = models.ForeignKey(Sondaje, on_delete=models.PROTECT, null=True, blank=True, related_name='complementos_turno')
@@ -664,9 +761,13 @@ class TurnoComplemento(models.Model):
                     f'Sondaje contrato: {self.sondaje.contrato}, Turno contrato: {self.turno.contrato}'
                 )
 
+    def calcular_metros(self):
+        self.metros_turno_calc = self.metros_fin - self.metros_inicio
+        return self.metros_turno_calc
+
     def save(self, *args, **kwargs):
         self.full_clean()
-        self.metros_turno_calc = self.metros_fin - self.metros_inicio
+        self.calcular_metros()
         super().save(*args, **kwargs)
 
 class TurnoAditivo(models.Model):
@@ -707,8 +808,12 @@ class TurnoCorrida(models.Model):
         db_table = 'turno_corrida'
         unique_together = ['turno', 'corrida_numero']
 
-    def save(self, *args, **kwargs):
+    def calcular_total(self):
         self.total_calc = self.hasta - self.desde
+        return self.total_calc
+
+    def save(self, *args, **kwargs):
+        self.calcular_total()
         super().save(*args, **kwargs)
 
 class TurnoActividad(models.Model):
@@ -722,25 +827,13 @@ class TurnoActividad(models.Model):
     class Meta:
         db_table = 'turno_actividad'
 
-    def save(self, *args, **kwargs):
-        from datetime import datetime, timedelta
-
-        # Manejar casos donde las horas no estén completas
-        if not self.hora_inicio or not self.hora_fin:
-            try:
-                self.tiempo_calc = Decimal('0')
-            except Exception:
-                self.tiempo_calc = 0
-            return super().save(*args, **kwargs)
-
-        inicio = datetime.combine(datetime.today(), self.hora_inicio)
-        fin = datetime.combine(datetime.today(), self.hora_fin)
+    def calcular_tiempo(self):
+        # Si las horas no están completas el tiempo es 0
+        self.tiempo_calc = horas_entre(self.hora_inicio, self.hora_fin)
+        return self.tiempo_calc
 
-        if fin < inicio:
-            fin += timedelta(days=1)
-
-        diff = fin - inicio
-        self.tiempo_calc = Decimal(str(diff.total_seconds() / 3600))
+    def save(self, *args, **kwargs):
+        self.calcular_tiempo()
         super().save(*args, **kwargs)
 
 class Abastecimiento(models.Model):
@@ -766,6 +859,11 @@ class Abastecimiento(models.Model):
     tipo_aditivo = models.ForeignKey(TipoAditivo, on_delete=models.PROTECT, null=True, blank=True)
     numero_guia = models.CharField(max_length=50, blank=True)
     observaciones = models.TextField(blank=True)
+    # Hash de (contrato, mes, código, serie, guía, n.º de repetición) asignado al importar:
+    # permite reimportar un mes actualizando en lugar de borrar y reinsertar
+    clave_natural = models.CharField(max_length=40, null=True, blank=True, editable=False)
+    # Hash del contenido importado, para omitir filas sin cambios
+    contenido_hash = models.CharField(max_length=40, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -773,14 +871,138 @@ class Abastecimiento(models.Model):
         verbose_name = 'Abastecimiento'
         verbose_name_plural = 'Abastecimientos'
         ordering = ['-fecha', '-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['contrato', 'clave_natural'], name='abastecimiento_clave_natural_uniq'),
+        ]
+        indexes = [
+            # Paginación por cursor del listado: (fecha, id) dentro del contrato
+            models.Index(fields=['contrato', 'fecha', 'id']),
+        ]
 
     def save(self, *args, **kwargs):
         self.total = self.cantidad * self.precio_unitario
-        super().save(*args, **kwargs)
+        nuevo = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if nuevo:
+                # Línea recién creada (alta manual o importación): sin consumos aún
+                StockBalance.objects.create(**StockBalance._valores(self, Decimal('0')))
+            else:
+                StockBalance.sincronizar(self)
 
     def __str__(self):
         return f"{self.contrato.nombre_contrato} - {self.descripcion[:50]} ({self.fecha})"
 
+class StockBalance(models.Model):
+    """Saldo materializado de cada línea de abastecimiento.
+
+    Se mantiene en la misma transacción que las escrituras de Abastecimiento y
+    ConsumoStock (incrementos con F(), sin releer el historial de consumos),
+    por lo que consultar el stock es una lectura por clave o por el índice
+    (contrato, cantidad_disponible). `manage.py rebuild_stock_balance`
+    reconstruye y verifica los saldos desde el historial.
+    """
+    abastecimiento = models.OneToOneField(Abastecimiento, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    contrato = models.ForeignKey(Contrato, on_delete=models.CASCADE, related_name='balances_stock')
+    precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
+    cantidad_consumida = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cantidad_disponible = models.DecimalField(max_digits=12, decimal_places=2)
+    valor_disponible = models.DecimalField(max_digits=14, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stock_balance'
+        verbose_name = 'Saldo de stock'
+        verbose_name_plural = 'Saldos de stock'
+        indexes = [
+            models.Index(fields=['contrato', 'cantidad_disponible'], name='stock_bal_contrato_disp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.abastecimiento_id}: {self.cantidad_disponible}"
+
+    @classmethod
+    def sincronizar(cls, abastecimiento):
+        """Recalcular el saldo tras crear o editar `abastecimiento`.
+
+        Conserva la cantidad consumida registrada y ajusta disponible y valor
+        a la nueva cantidad/precio. Si la línea aún no tiene saldo se crea a
+        partir de sus consumos.
+        """
+        disponible = models.Value(abastecimiento.cantidad) - models.F('cantidad_consumida')
+
+        def actualizar():
+            return cls.objects.filter(pk=abastecimiento.pk).update(
+                contrato_id=abastecimiento.contrato_id,
+                precio_unitario=abastecimiento.precio_unitario,
+                cantidad_disponible=disponible,
+                valor_disponible=disponible * abastecimiento.precio_unitario,
+                updated_at=timezone.now(),
+            )
+
+        if not actualizar():
+            consumido = ConsumoStock.objects.filter(abastecimiento=abastecimiento).aggregate(
+                total=models.Sum('cantidad_consumida')
+            )['total'] or Decimal('0')
+            # ON CONFLICT DO NOTHING: si otra transacción lo creó en paralelo no
+            # falla, y el UPDATE siguiente le aplica la cantidad/precio vigentes
+            cls.objects.bulk_create([cls(**cls._valores(abastecimiento, consumido))], ignore_conflicts=True)
+            actualizar()
+
+    @classmethod
+    def aplicar_consumo(cls, abastecimiento_id, cantidad):
+        """Descontar `cantidad` (negativa para devolver) del saldo de la línea."""
+        if not cantidad:
+            return
+        actualizados = cls.objects.filter(pk=abastecimiento_id).update(
+            cantidad_consumida=models.F('cantidad_consumida') + cantidad,
+            cantidad_disponible=models.F('cantidad_disponible') - cantidad,
+            valor_disponible=(models.F('cantidad_disponible') - cantidad) * models.F('precio_unitario'),
+            updated_at=timezone.now(),
+        )
+        if not actualizados:
+            # Línea sin saldo (p. ej. previa a la tabla): crearlo desde el historial
+            abastecimiento = Abastecimiento.objects.filter(pk=abastecimiento_id).first()
+            if abastecimiento is not None:
+                cls.sincronizar(abastecimiento)
+
+    @classmethod
+    def sincronizar_lote(cls, abastecimiento_ids):
+        """Versión en bloque de `sincronizar` para líneas actualizadas con bulk_create/update.
+
+        Un único UPDATE con subconsultas correlacionadas a Abastecimiento.
+        """
+        linea = Abastecimiento.objects.filter(pk=models.OuterRef('pk'))
+        cantidad = models.Subquery(linea.values('cantidad'))
+        precio = models.Subquery(linea.values('precio_unitario'))
+        return cls.objects.filter(pk__in=abastecimiento_ids).update(
+            contrato_id=models.Subquery(linea.values('contrato_id')),
+            precio_unitario=precio,
+            cantidad_disponible=cantidad - models.F('cantidad_consumida'),
+            valor_disponible=(cantidad - models.F('cantidad_consumida')) * precio,
+            updated_at=timezone.now(),
+        )
+
+    @classmethod
+    def crear_iniciales(cls, abastecimientos):
+        """Crear en bloque el saldo de líneas recién insertadas (sin consumos).
+
+        Para abastecimientos creados con bulk_create, que no pasan por save().
+        """
+        return cls.objects.bulk_create([cls(**cls._valores(a, Decimal('0'))) for a in abastecimientos])
+
+    @staticmethod
+    def _valores(abastecimiento, consumido):
+        disponible = abastecimiento.cantidad - consumido
+        return {
+            'abastecimiento_id': abastecimiento.pk,
+            'contrato_id': abastecimiento.contrato_id,
+            'precio_unitario': abastecimiento.precio_unitario,
+            'cantidad_consumida': consumido,
+            'cantidad_disponible': disponible,
+            'valor_disponible': (disponible * abastecimiento.precio_unitario).quantize(Decimal('0.01')),
+        }
+
 class ConsumoStock(models.Model):
     turno = models.ForeignKey(Turno, on_delete=models.CASCADE, related_name='consumos')
     abastecimiento = models.ForeignKey(Abastecimiento, on_delete=models.PROTECT)
@@ -800,12 +1022,215 @@ class ConsumoStock(models.Model):
     observaciones = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TurnoHijoQuerySet.as_manager()
+
     class Meta:
         db_table = 'consumo_stock'
         verbose_name = 'Consumo de Stock'
         verbose_name_plural = 'Consumos de Stock'
+        indexes = [
+            # Paginación por cursor del listado: (created_at, id)
+            models.Index(fields=['created_at', 'id']),
+        ]
 
-    def save(self, *args, **kwargs):
+    def calcular_metros(self):
         if self.metros_inicio and self.metros_fin:
             self.metros_utilizados = self.metros_fin - self.metros_inicio
-        super().save(*args, **kwargs)
\ No newline at end of file
+        return self.metros_utilizados
+
+    def save(self, *args, **kwargs):
+        self.calcular_metros()
+        with transaction.atomic():
+            anterior = None
+            if self.pk:
+                anterior = ConsumoStock.objects.filter(pk=self.pk).values_list(
+                    'abastecimiento_id', 'cantidad_consumida'
+                ).first()
+            super().save(*args, **kwargs)
+            # Aplicar solo la diferencia con lo ya descontado del saldo
+            if anterior and anterior[0] != self.abastecimiento_id:
+                StockBalance.aplicar_consumo(anterior[0], -anterior[1])
+                anterior = None
+            StockBalance.aplicar_consumo(
+                self.abastecimiento_id,
+                self.cantidad_consumida - (anterior[1] if anterior else 0),
+            )
+
+
+@receiver(post_delete, sender=ConsumoStock)
+def devolver_stock_consumo(sender, instance, **kwargs):
+    """Reintegrar el consumo al saldo, también en borrados en cascada (p. ej. al eliminar el turno)."""
+    StockBalance.aplicar_consumo(instance.abastecimiento_id, -instance.cantidad_consumida)
+
+
+class ImportacionAbastecimiento(models.Model):
+    """Importación de planilla de abastecimiento encolada para un worker.
+
+    La vista solo guarda el archivo y crea el registro; `manage.py
+    procesar_importaciones` toma las pendientes (ver `reclamar`) y actualiza
+    el avance en cada bloque confirmado, que la página consulta por JSON.
+
+    Una vista previa se encola con `solo_validar`: el worker valida el
+    archivo, guarda las filas validadas en `previa` (JSON lines) y la deja en
+    PREVIA; al confirmarla pasa a PENDIENTE y el worker importa esas filas
+    sin volver a leer el archivo.
+
+    Mientras procesa, el worker actualiza `latido_at` desde un hilo aparte
+    (ver `import_queue.procesar_pendientes`), aunque un bloque tarde: solo las
+    importaciones sin latido reciente se consideran abandonadas.
+    """
+    ESTADO_CHOICES = [
+        ('PREVIA', 'Vista previa'),
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En proceso'),
+        ('COMPLETADO', 'Completado'),
+        ('ERROR', 'Error'),
+    ]
+
+    archivo = models.FileField(upload_to='importaciones/%Y/%m/')
+    previa = models.FileField(upload_to='importaciones/previas/', blank=True)
+    nombre_archivo = models.CharField(max_length=255)
+    usuario = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='importaciones')
+    contrato = models.ForeignKey(Contrato, on_delete=models.SET_NULL, null=True, blank=True, related_name='importaciones')
+    reemplazar_existentes = models.BooleanField(default=True)
+    solo_validar = models.BooleanField(default=False)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='PENDIENTE')
+    worker = models.CharField(max_length=100, blank=True)
+    filas_leidas = models.PositiveIntegerField(default=0)
+    total_filas = models.PositiveIntegerField(null=True, blank=True)
+    creados = models.PositiveIntegerField(default=0)
+    omitidos = models.PositiveIntegerField(default=0)
+    eliminados = models.PositiveIntegerField(default=0)
+    errores = models.JSONField(default=list, blank=True)
+    resultado = models.JSONField(default=dict, blank=True)
+    mensaje = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    iniciado_at = models.DateTimeField(null=True, blank=True)
+    latido_at = models.DateTimeField(null=True, blank=True)
+    finalizado_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'importacion_abastecimiento'
+        verbose_name = 'Importación de abastecimiento'
+        verbose_name_plural = 'Importaciones de abastecimiento'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['estado', 'created_at'], name='importacion_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre_archivo} ({self.get_estado_display()})"
+
+    @classmethod
+    def reclamar(cls, worker):
+        """Tomar la importación pendiente más antigua para `worker`, o None.
+
+        Las importaciones de un mismo contrato se ejecutan de a una (ambas
+        podrían reemplazar el mismo mes); las de contratos distintos pueden
+        procesarse en paralelo por varios workers. Una importación sin
+        contrato (administrador del sistema) puede tocar cualquiera, así que
+        corre sola: espera a que terminen las demás y, mientras espera o
+        corre, no se reclaman importaciones más nuevas. El paso a EN_PROCESO
+        es un UPDATE condicional, así que dos workers nunca toman la misma.
+        """
+        en_proceso = cls.objects.filter(estado='EN_PROCESO')
+        if en_proceso.filter(contrato__isnull=True).exists():
+            return None
+        ocupados = en_proceso.filter(contrato__isnull=False).values('contrato_id')
+        candidatos = cls.objects.filter(estado='PENDIENTE').exclude(
+            contrato_id__in=ocupados
+        ).order_by('created_at', 'pk').values_list('pk', 'contrato_id')[:20]
+        contratos_vistos = set()
+        for pk, contrato_id in candidatos:
+            if contrato_id in contratos_vistos:
+                continue
+            contratos_vistos.add(contrato_id)
+            with transaction.atomic():
+                if contrato_id is None:
+                    # Bloquear todos los contratos: ningún otro worker reclama mientras se verifica
+                    list(Contrato.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+                    conflicto = cls.objects.filter(estado='EN_PROCESO')
+                else:
+                    # Serializar con otros workers que reclamen el mismo contrato
+                    list(Contrato.objects.select_for_update().filter(pk=contrato_id))
+                    conflicto = cls.objects.filter(
+                        models.Q(contrato_id=contrato_id) | models.Q(contrato__isnull=True), estado='EN_PROCESO',
+                    )
+                if conflicto.exists():
+                    if contrato_id is None:
+                        # No adelantar importaciones más nuevas a la del administrador
+                        return None
+                    continue
+                ahora = timezone.now()
+                tomado = cls.objects.filter(pk=pk, estado='PENDIENTE').update(
+                    estado='EN_PROCESO', worker=worker, iniciado_at=ahora, latido_at=ahora, updated_at=ahora,
+                )
+            if tomado:
+                return cls.objects.get(pk=pk)
+        return None
+
+    @classmethod
+    def latir(cls, pk, worker):
+        """Registrar que `worker` sigue procesando la importación `pk`."""
+        return cls.objects.filter(pk=pk, worker=worker, estado='EN_PROCESO').update(latido_at=timezone.now())
+
+    @classmethod
+    def liberar_colgadas(cls, antiguedad):
+        """Devolver a PENDIENTE las importaciones EN_PROCESO sin latido hace más de `antiguedad` (timedelta).
+
+        Un worker vivo late aunque un bloque tarde, así que solo se reencolan
+        las de workers que terminaron abruptamente; reimportar es seguro
+        porque el importador reemplaza por (mes, contrato).
+        """
+        limite = timezone.now() - antiguedad
+        return cls.objects.filter(
+            models.Q(latido_at__lt=limite) | models.Q(latido_at__isnull=True, updated_at__lt=limite),
+            estado='EN_PROCESO',
+        ).update(estado='PENDIENTE', worker='', latido_at=None, updated_at=timezone.now())
+
+    @classmethod
+    def descartar_previas(cls, antiguedad):
+        """Borrar las vistas previas no confirmadas con más de `antiguedad` (timedelta), con sus archivos."""
+        vencidas = list(cls.objects.filter(estado='PREVIA', created_at__lt=timezone.now() - antiguedad))
+        for importacion in vencidas:
+            importacion.archivo.delete(save=False)
+            importacion.previa.delete(save=False)
+            importacion.delete()
+        return len(vencidas)
+
+    def confirmar(self):
+        """Encolar una vista previa. Retorna False si ya no estaba en PREVIA (p. ej. doble envío)."""
+        confirmada = type(self).objects.filter(pk=self.pk, estado='PREVIA').update(
+            estado='PENDIENTE', solo_validar=False, updated_at=timezone.now(),
+        )
+        if confirmada:
+            self.estado = 'PENDIENTE'
+            self.solo_validar = False
+        return bool(confirmada)
+
+    def progreso(self):
+        """Estado serializable para el endpoint de consulta."""
+        porcentaje = None
+        if self.estado == 'COMPLETADO':
+            porcentaje = 100
+        elif self.total_filas:
+            porcentaje = min(int(self.filas_leidas * 100 / self.total_filas), 99)
+        return {
+            'id': self.pk,
+            'archivo': self.nombre_archivo,
+            'estado': self.estado,
+            'estado_display': self.get_estado_display(),
+            'filas_leidas': self.filas_leidas,
+            'total_filas': self.total_filas,
+            'porcentaje': porcentaje,
+            'creados': self.creados,
+            'omitidos': self.omitidos,
+            'eliminados': self.eliminados,
+            'resultado': self.resultado,
+            'errores': self.errores,
+            'mensaje': self.mensaje,
+            'solo_validar': self.solo_validar,
+            # Una vista previa termina al quedar en PREVIA (lista para confirmar)
+            'terminado': self.estado in ('PREVIA', 'COMPLETADO', 'ERROR'),
+        }
@@ -0,0 +1,87 @@
+// Autocompletado de los <select data-autocomplete-url> (forms.AutocompleteSelect).
+// El servidor solo renderiza la opción elegida; este script agrega un campo de
+// búsqueda sobre cada select y carga las opciones desde la URL indicada
+// (respuesta {'results': [{'id', 'text'}], 'more'}).
+(function () {
+    'use strict';
+
+    const LIMITE = 20;
+    const ESPERA_MS = 250;
+
+    function etiqueta(item) {
+        if (item.disponible !== undefined) {
+            return `${item.text} (disp. ${item.disponible} ${item.unidad || ''})`.trim();
+        }
+        return item.text;
+    }
+
+    function cargarOpciones(select, resultados, more) {
+        const actual = select.value;
+        const seleccionada = select.selectedOptions[0];
+        const vacia = select.querySelector('option[value=""]');
+        select.innerHTML = '';
+        if (vacia) {
+            select.appendChild(vacia);
+        }
+        // Conservar la opción elegida aunque no esté entre los resultados
+        if (actual && seleccionada && !resultados.some((r) => String(r.id) === actual)) {
+            select.appendChild(seleccionada);
+        }
+        resultados.forEach((item) => {
+            select.appendChild(new Option(etiqueta(item), item.id, false, String(item.id) === actual));
+        });
+        if (more) {
+            const aviso = new Option('Hay más resultados: refine la búsqueda…', '', false, false);
+            aviso.disabled = true;
+            select.appendChild(aviso);
+        }
+        select.value = actual;
+    }
+
+    function iniciar(select) {
+        const url = select.dataset.autocompleteUrl;
+        const buscador = document.createElement('input');
+        buscador.type = 'search';
+        buscador.className = 'form-control form-control-sm mb-1';
+        buscador.placeholder = 'Buscar…';
+        buscador.setAttribute('aria-label', 'Buscar opciones');
+        select.parentNode.insertBefore(buscador, select);
+
+        let temporizador = null;
+        let controlador = null;
+
+        async function buscar() {
+            if (controlador) {
+                controlador.abort();
+            }
+            controlador = new AbortController();
+            const params = new URLSearchParams({ q: buscador.value.trim(), limit: LIMITE });
+            try {
+                const respuesta = await fetch(`${url}?${params}`, {
+                    credentials: 'same-origin',
+                    headers: { Accept: 'application/json' },
+                    signal: controlador.signal,
+                });
+                if (!respuesta.ok) {
+                    return;
+                }
+                const datos = await respuesta.json();
+                cargarOpciones(select, datos.results || [], datos.more);
+            } catch (error) {
+                if (error.name !== 'AbortError') {
+                    console.error('Error al buscar opciones', error);
+                }
+            }
+        }
+
+        buscador.addEventListener('input', () => {
+            clearTimeout(temporizador);
+            temporizador = setTimeout(buscar, ESPERA_MS);
+        });
+        buscar();
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('select[data-autocomplete-url]').forEach(iniciar);
+    });
+})();
@@ -8,7 +8,15 @@ from django.urls import reverse
 from django.utils import timezone
 from .models import *
 import json
-from datetime import timedelta
+from datetime import time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from .utils.activity_tracker import activity_tracker
+
+
+def tearDownModule():
+    # Las marcas que dejan los requests del Client no deben sobrevivir a la BD de test
+    activity_tracker.descartar()
 
 
 class TurnoStateTests(TestCase):
@@ -82,11 +90,12 @@ class TurnoStateTests(TestCase):
         # Create a turno in BORRADOR using a different date to avoid collisions
         fecha_nueva = self.base_date + timedelta(days=1)
         turno = Turno.objects.create(
-            sondaje=self.sondaje,
+            contrato=self.contrato,
             maquina=self.maquina,
             tipo_turno=self.tipo_turno,
             fecha=fecha_nueva,
         )
+        TurnoSondaje.objects.create(turno=turno, sondaje=self.sondaje)
 
         c = Client()
         # normal user (operator) cannot approve
@@ -106,11 +115,12 @@ class TurnoStateTests(TestCase):
 
         # admin can approve (create another turno)
         turno2 = Turno.objects.create(
-            sondaje=self.sondaje,
+            contrato=self.contrato,
             maquina=self.maquina,
             tipo_turno=self.tipo_turno,
             fecha=fecha_nueva + timedelta(days=1),
         )
+        TurnoSondaje.objects.create(turno=turno2, sondaje=self.sondaje)
         c.force_login(self.admin)
         r = c.post(reverse('turno-approve', args=[turno2.id]), follow=True)
         turno2.refresh_from_db()
@@ -150,3 +160,1880 @@ class TurnoStateTests(TestCase):
             msgs = [str(m) for m in response.context['messages']]
         self.assertTrue(any('Faltan horas al turno' in m for m in msgs), f"Messages did not contain expected text. Got: {msgs}")
 
+
+
+class ActivityTrackerTests(TestCase):
+    def setUp(self):
+        from .utils.activity_tracker import ActivityTracker
+        self.user = CustomUser.objects.create_user(username='act', password='pass', role='OPERADOR')
+        self.tracker = ActivityTracker(window=300, flush_interval=60, batch_size=100, use_timer=False)
+        self.addCleanup(activity_tracker.descartar)
+
+    def test_touch_coalesces_writes_within_window(self):
+        now = timezone.now()
+        self.assertTrue(self.tracker.touch(self.user, now=now))
+        # Una segunda visita dentro de la ventana no vuelve a encolar
+        self.assertFalse(self.tracker.touch(self.user, now=now + timedelta(seconds=30)))
+        self.assertEqual(self.tracker.pending_count(), 1)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.tracker.flush(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_activity, now)
+        self.assertTrue(self.user.is_active_recently())
+
+    def test_flush_interval_triggers_single_bulk_update(self):
+        other = CustomUser.objects.create_user(username='act2', password='pass', role='OPERADOR')
+        now = timezone.now()
+        self.tracker.touch(self.user, now=now)
+        with self.assertNumQueries(1):
+            self.tracker.touch(other, now=now + timedelta(seconds=61))
+        self.assertEqual(self.tracker.pending_count(), 0)
+        self.assertEqual(CustomUser.objects.filter(last_activity__isnull=False).count(), 2)
+
+    def test_flush_if_due_writes_pending_without_new_touch(self):
+        now = timezone.now()
+        self.tracker.touch(self.user, now=now)
+        self.assertEqual(self.tracker.flush_if_due(now=now + timedelta(seconds=30)), 0)
+        # Sin nuevas visitas de nadie: el intervalo vencido basta para escribir
+        with self.assertNumQueries(1):
+            self.assertEqual(self.tracker.flush_if_due(now=now + timedelta(seconds=60)), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_activity, now)
+
+    def test_touch_schedules_timed_flush_when_idle(self):
+        from unittest import mock
+        from .utils.activity_tracker import ActivityTracker
+        tracker = ActivityTracker(window=300, flush_interval=60, batch_size=100, use_timer=True)
+        now = timezone.now()
+        tracker.touch(self.user, now=now)
+        timer = tracker._timer
+        self.addCleanup(timer.cancel)
+        self.assertTrue(timer.daemon)
+        self.assertEqual(timer.interval, 60)
+        timer.cancel()
+
+        # Lo que ejecuta el hilo al vencer (sin cerrar la conexión del test)
+        with mock.patch('drilling.utils.activity_tracker.connections'):
+            tracker._timed_flush()
+        self.assertIsNone(tracker._timer)
+        self.assertEqual(tracker.pending_count(), 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_activity, now)
+
+    def test_timer_only_runs_after_iniciar(self):
+        from unittest import mock
+        from .utils.activity_tracker import ActivityTracker
+        tracker = ActivityTracker(window=300, flush_interval=60, batch_size=100)
+        tracker.touch(self.user, now=timezone.now())
+        # Sin iniciar (tests, comandos): ni timer ni flush al salir
+        self.assertIsNone(tracker._timer)
+
+        with mock.patch('drilling.utils.activity_tracker.atexit.register') as register:
+            tracker.iniciar()
+            tracker.iniciar()
+        register.assert_called_once_with(tracker.flush)
+        tracker.touch(CustomUser.objects.create_user(username='act3', password='pass', role='OPERADOR'))
+        self.assertIsNotNone(tracker._timer)
+        tracker.descartar()
+        self.assertIsNone(tracker._timer)
+        self.assertEqual(tracker.pending_count(), 0)
+
+    def test_middleware_skips_update_when_activity_is_recent(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        CustomUser.objects.filter(pk=self.user.pk).update(last_activity=timezone.now())
+        c = Client()
+        c.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            c.get(reverse('login'))
+        updates = [q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE') and CustomUser._meta.db_table in q['sql']]
+        self.assertEqual(updates, [])
+
+
+class TurnoPersistenceTests(TestCase):
+    def setUp(self):
+        self.contrato = Contrato.objects.create(
+            nombre_contrato='CT-BULK',
+            cliente=Cliente.objects.create(nombre='C-BULK'),
+            duracion_turno=8,
+        )
+        self.tipo_turno = TipoTurno.objects.create(nombre='Noche')
+        self.tipo_actividad = TipoActividad.objects.create(nombre='Perforación')
+        self.tipo_complemento = TipoComplemento.objects.create(nombre='Broca HQ', categoria='BROCA')
+        self.unidad = UnidadMedida.objects.create(nombre='Kilogramos', simbolo='kg')
+        self.tipo_aditivo = TipoAditivo.objects.create(
+            nombre='Bentonita', categoria='BENTONITA', unidad_medida_default=self.unidad
+        )
+        self.maquina = Maquina.objects.create(contrato=self.contrato, nombre='Maq-B', tipo='T1')
+        self.sondaje = Sondaje.objects.create(
+            contrato=self.contrato, nombre_sondaje='SB1', fecha_inicio=timezone.now().date(),
+            profundidad=100, inclinacion=0, cota_collar=1000,
+        )
+        self.trabajadores = [
+            Trabajador.objects.create(contrato=self.contrato, nombres=f'T{i}', cargo='AYUDANTE', dni=f'1000000{i}')
+            for i in range(6)
+        ]
+
+    def _payload(self, n):
+        return {
+            'trabajadores': [
+                {'trabajador_id': t.dni, 'funcion': 'AYUDANTE', 'observaciones': ''}
+                for t in self.trabajadores[:n]
+            ],
+            'complementos': [
+                {'tipo_complemento_id': self.tipo_complemento.id, 'codigo_serie': f'S{i}',
+                 'metros_inicio': 10.0 * i, 'metros_fin': 10.0 * i + 5.5, 'sondaje_id': self.sondaje.id}
+                for i in range(n)
+            ],
+            'aditivos': [
+                {'tipo_aditivo_id': self.tipo_aditivo.id, 'cantidad_usada': 2.5,
+                 'unidad_medida_id': self.unidad.id, 'sondaje_id': None}
+                for _ in range(n)
+            ],
+            'actividades': [
+                {'actividad_id': self.tipo_actividad.id, 'hora_inicio': time(8 + i, 0),
+                 'hora_fin': time(9 + i, 0), 'observaciones': ''}
+                for i in range(n)
+            ],
+            'corridas': [
+                {'corrida_numero': i + 1, 'desde': 1.5 * i, 'hasta': 1.5 * i + 1.5, 'longitud_testigo': 1.4,
+                 'pct_recuperacion': 93.3, 'pct_retorno_agua': 80, 'litologia': 'Andesita'}
+                for i in range(n * 5)
+            ],
+        }
+
+    def _guardar(self, fecha, n):
+        from .utils.turno_persistence import TurnoPersistence
+        return TurnoPersistence(self.contrato, 8).guardar(
+            maquina=self.maquina, tipo_turno=self.tipo_turno, fecha=fecha,
+            sondajes=[self.sondaje], metrajes=['12.50'], **self._payload(n),
+        )
+
+    def test_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        hoy = timezone.now().date()
+        with CaptureQueriesContext(connection) as small:
+            self._guardar(hoy, 2)
+        with CaptureQueriesContext(connection) as large:
+            self._guardar(hoy + timedelta(days=1), 6)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_calculated_fields_and_children(self):
+        turno = self._guardar(timezone.now().date(), 6)
+        self.assertEqual(turno.estado, 'BORRADOR')  # 6 horas < 8 horas de contrato
+        self.assertEqual(turno.trabajadores_turno.count(), 6)
+        self.assertEqual(turno.corridas.count(), 30)
+        self.assertEqual(turno.turno_sondajes.get().metros_turno, Decimal('12.50'))
+        self.assertEqual(turno.avance.metros_perforados, Decimal('12.50'))
+        self.assertEqual(
+            set(turno.complementos.values_list('metros_turno_calc', flat=True)), {Decimal('5.50')}
+        )
+        self.assertEqual(
+            set(turno.actividades.values_list('tiempo_calc', flat=True)), {Decimal('1.00')}
+        )
+        self.assertEqual(
+            set(turno.corridas.values_list('total_calc', flat=True)), {Decimal('1.50')}
+        )
+
+    def test_sondaje_from_other_contract_is_rejected(self):
+        from django.core.exceptions import ValidationError
+        otro = Contrato.objects.create(nombre_contrato='CT-OTRO', cliente=self.contrato.cliente)
+        ajeno = Sondaje.objects.create(
+            contrato=otro, nombre_sondaje='SX', fecha_inicio=timezone.now().date(),
+            profundidad=100, inclinacion=0, cota_collar=1000,
+        )
+        payload = self._payload(1)
+        payload['complementos'][0]['sondaje_id'] = ajeno.id
+        from .utils.turno_persistence import TurnoPersistence
+        with self.assertRaises(ValidationError):
+            TurnoPersistence(self.contrato, 8).guardar(
+                maquina=self.maquina, tipo_turno=self.tipo_turno, fecha=timezone.now().date(),
+                sondajes=[self.sondaje], **payload,
+            )
+        self.assertEqual(Turno.objects.count(), 0)
+
+    def test_edit_only_writes_changed_rows(self):
+        from .utils.turno_persistence import TurnoPersistence
+        hoy = timezone.now().date()
+        payload = self._payload(3)
+        maquina_estado = {'horometro_inicio': Decimal('100'), 'horometro_fin': Decimal('105')}
+        turno = TurnoPersistence(self.contrato, 8).guardar(
+            maquina=self.maquina, tipo_turno=self.tipo_turno, fecha=hoy, sondajes=[self.sondaje],
+            metrajes=['12.50'], maquina_estado=maquina_estado, **payload,
+        )
+        self.maquina.refresh_from_db()
+        self.assertEqual(self.maquina.horometro, Decimal('5.00'))
+        ids_antes = set(turno.actividades.values_list('id', flat=True))
+
+        # Cambiar solo la hora de fin de una actividad y el horómetro final
+        payload['actividades'][1]['hora_fin'] = time(10, 30)
+        maquina_estado['horometro_fin'] = Decimal('106')
+        service = TurnoPersistence(self.contrato, 8)
+        service.guardar(
+            turno=turno, maquina=self.maquina, tipo_turno=self.tipo_turno, fecha=hoy,
+            sondajes=[self.sondaje], metrajes=['12.50'], maquina_estado=maquina_estado, **payload,
+        )
+        self.assertEqual(service.cambios[TurnoActividad], (0, 1, 0))
+        self.assertEqual(service.cambios[TurnoMaquina], (0, 1, 0))
+        for model in (TurnoSondaje, TurnoTrabajador, TurnoComplemento, TurnoAditivo, TurnoCorrida, TurnoAvance):
+            self.assertEqual(service.cambios[model], (0, 0, 0), model.__name__)
+        self.assertEqual(set(turno.actividades.values_list('id', flat=True)), ids_antes)
+        self.assertEqual(
+            turno.actividades.get(hora_fin=time(10, 30)).tiempo_calc, Decimal('1.50')
+        )
+        # El horómetro solo se mueve por la diferencia (+1 hora)
+        self.maquina.refresh_from_db()
+        self.assertEqual(self.maquina.horometro, Decimal('6.00'))
+
+        # Quitar una corrida y un trabajador genera solo DELETE en esas tablas
+        payload['corridas'].pop()
+        payload['trabajadores'].pop(0)
+        service = TurnoPersistence(self.contrato, 8)
+        service.guardar(
+            turno=turno, maquina=self.maquina, tipo_turno=self.tipo_turno, fecha=hoy,
+            sondajes=[self.sondaje], metrajes=['12.50'], maquina_estado=maquina_estado, **payload,
+        )
+        self.assertEqual(service.cambios[TurnoCorrida], (0, 0, 1))
+        self.assertEqual(service.cambios[TurnoTrabajador], (0, 0, 1))
+        self.assertEqual(service.cambios[TurnoActividad], (0, 0, 0))
+
+    def test_horometro_ledger_and_as_of_lookup(self):
+        from .utils.turno_persistence import TurnoPersistence
+        hoy = timezone.now().date()
+        ayer = hoy - timedelta(days=1)
+        for fecha, fin in ((ayer, '104'), (hoy, '110')):
+            TurnoPersistence(self.contrato, 8).guardar(
+                maquina=self.maquina, tipo_turno=self.tipo_turno, fecha=fecha, sondajes=[self.sondaje],
+                maquina_estado={'horometro_inicio': Decimal('100'), 'horometro_fin': Decimal(fin)},
+            )
+        self.maquina.refresh_from_db()
+        self.assertEqual(self.maquina.horometro, Decimal('14.00'))
+        self.assertEqual(self.maquina.horometro_al(ayer), Decimal('4.00'))
+        self.assertEqual(self.maquina.horometro_al(hoy), self.maquina.horometro)
+        self.assertEqual(HorometroMovimiento.objects.filter(maquina=self.maquina).count(), 2)
+
+        # Mover el turno de ayer a otra máquina revierte las horas en la original
+        otra = Maquina.objects.create(contrato=self.contrato, nombre='Maq-C', tipo='T1')
+        turno = Turno.objects.get(fecha=ayer)
+        TurnoPersistence(self.contrato, 8).guardar(
+            turno=turno, maquina=otra, tipo_turno=self.tipo_turno, fecha=ayer, sondajes=[self.sondaje],
+            maquina_estado={'horometro_inicio': Decimal('100'), 'horometro_fin': Decimal('104')},
+        )
+        self.maquina.refresh_from_db()
+        otra.refresh_from_db()
+        self.assertEqual(self.maquina.horometro, Decimal('10.00'))
+        self.assertEqual(otra.horometro, Decimal('4.00'))
+        self.assertEqual(self.maquina.horometro_al(ayer), Decimal('0'))
+
+    def test_maquina_edit_keeps_hours_added_by_concurrent_shift(self):
+        from .utils.turno_persistence import TurnoPersistence
+        Maquina.objects.filter(pk=self.maquina.pk).update(horometro=Decimal('100'))
+        admin = CustomUser.objects.create_user(
+            username='adm-horo', password='pass', role='ADMIN_SISTEMA', is_system_admin=True
+        )
+        c = Client()
+        c.force_login(admin)
+        url = reverse('maquina-update', args=[self.maquina.pk])
+        form = c.get(url).context['form']
+        self.assertEqual(form['horometro_mostrado'].value(), Decimal('100.00'))
+        datos = {'nombre': 'Maq-B2', 'tipo': 'T1', 'estado': self.maquina.estado, 'horometro_mostrado': '100.00'}
+
+        # Un turno suma 5 horas mientras el formulario está abierto
+        TurnoPersistence(self.contrato, 8).guardar(
+            maquina=self.maquina, tipo_turno=self.tipo_turno, fecha=timezone.now().date(), sondajes=[self.sondaje],
+            maquina_estado={'horometro_inicio': Decimal('100'), 'horometro_fin': Decimal('105')},
+        )
+
+        # Sin corregir el horómetro: se guardan los demás campos y el saldo queda intacto
+        c.post(url, {**datos, 'horometro': '100.00'})
+        self.maquina.refresh_from_db()
+        self.assertEqual(self.maquina.nombre, 'Maq-B2')
+        self.assertEqual(self.maquina.horometro, Decimal('105.00'))
+        self.assertFalse(HorometroMovimiento.objects.filter(maquina=self.maquina, tipo='AJUSTE').exists())
+
+        # Corregir de 100 a 110 registra +10 sobre el saldo vigente
+        c.post(url, {**datos, 'horometro': '110.00'})
+        self.maquina.refresh_from_db()
+        self.assertEqual(self.maquina.horometro, Decimal('115.00'))
+        ajuste = HorometroMovimiento.objects.get(maquina=self.maquina, tipo='AJUSTE')
+        self.assertEqual(ajuste.horas, Decimal('10.00'))
+
+
+class StockCriticoTests(TestCase):
+    def setUp(self):
+        self.contrato = Contrato.objects.create(
+            nombre_contrato='CT-STOCK', cliente=Cliente.objects.create(nombre='C-STOCK'),
+        )
+        self.unidad = UnidadMedida.objects.create(nombre='Unidades', simbolo='und')
+        self.maquina = Maquina.objects.create(contrato=self.contrato, nombre='Maq-S', tipo='T1')
+        self.turno = Turno.objects.create(
+            contrato=self.contrato, maquina=self.maquina,
+            tipo_turno=TipoTurno.objects.create(nombre='Día'), fecha=timezone.now().date(),
+        )
+
+    def _abastecer(self, n, cantidad):
+        return [
+            Abastecimiento.objects.create(
+                mes='ENERO', fecha=timezone.now().date(), contrato=self.contrato,
+                descripcion=f'Item {cantidad}-{i}', familia='CONSUMIBLES', unidad_medida=self.unidad,
+                cantidad=Decimal(cantidad), precio_unitario=Decimal('10'),
+            )
+            for i in range(n)
+        ]
+
+    def test_covers_every_supply_line_in_one_query(self):
+        from .utils.stock import stock_critico
+        self._abastecer(12, '100')
+        criticos = self._abastecer(3, '20')
+        for a in criticos:
+            ConsumoStock.objects.create(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('17'))
+        ConsumoStock.objects.create(turno=self.turno, abastecimiento=criticos[0], cantidad_consumida=Decimal('2'))
+
+        with self.assertNumQueries(1):
+            resultado = stock_critico(self.contrato, umbral=5, limite=10)
+            [r.unidad_medida.simbolo for r in resultado]
+        self.assertEqual([r.pk for r in resultado][0], criticos[0].pk)
+        self.assertEqual({r.pk for r in resultado}, {a.pk for a in criticos})
+        self.assertEqual(resultado[0].disponible, Decimal('1'))
+        self.assertEqual(len(stock_critico(self.contrato, umbral=5, limite=2)), 2)
+
+    def test_balance_follows_consumption_writes(self):
+        a, b = self._abastecer(2, '50')
+        consumo = ConsumoStock.objects.create(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('8'))
+        a.balance.refresh_from_db()
+        self.assertEqual((a.balance.cantidad_consumida, a.balance.cantidad_disponible), (Decimal('8'), Decimal('42')))
+        self.assertEqual(a.balance.valor_disponible, Decimal('420'))
+
+        consumo.cantidad_consumida = Decimal('5')
+        consumo.save()
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('45'))
+
+        # Mover el consumo a otra línea devuelve el stock a la original
+        consumo.abastecimiento = b
+        consumo.save()
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('50'))
+        self.assertEqual(StockBalance.objects.get(pk=b.pk).cantidad_disponible, Decimal('45'))
+
+        # El borrado en cascada del turno también reintegra el stock
+        self.turno.delete()
+        self.assertEqual(StockBalance.objects.get(pk=b.pk).cantidad_consumida, Decimal('0'))
+
+    def test_rebuild_and_verify(self):
+        from .utils.stock import reconstruir_balances, verificar_balances
+        a, = self._abastecer(1, '30')
+        ConsumoStock.objects.create(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('10'))
+        self.assertEqual(verificar_balances(), [])
+
+        StockBalance.objects.filter(pk=a.pk).update(cantidad_disponible=Decimal('99'))
+        self.assertEqual(verificar_balances(), [(a.pk, Decimal('20'), Decimal('99'))])
+        self.assertEqual(reconstruir_balances(), 1)
+        self.assertEqual(verificar_balances(), [])
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('20'))
+
+        # Una línea sin saldo se crea en la misma pasada
+        StockBalance.objects.filter(pk=a.pk).delete()
+        self.assertEqual(reconstruir_balances(), 1)
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_consumida, Decimal('10'))
+
+    def test_reserve_creates_missing_balance_tolerating_concurrent_insert(self):
+        from unittest import mock
+        from .utils import stock
+        a, = self._abastecer(1, '10')
+        ConsumoStock.objects.create(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('3'))
+        StockBalance.objects.filter(pk=a.pk).delete()
+
+        # Otra transacción crea el saldo entre el SELECT FOR UPDATE y el INSERT
+        crear = stock._crear_faltantes
+
+        def crear_en_paralelo(abastecimientos, **kwargs):
+            crear(abastecimientos, **kwargs)
+            crear(abastecimientos, **kwargs)
+
+        with mock.patch.object(stock, '_crear_faltantes', crear_en_paralelo):
+            stock.reservar_stock([ConsumoStock(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('7'))])
+        balance = StockBalance.objects.get(pk=a.pk)
+        self.assertEqual((balance.cantidad_consumida, balance.cantidad_disponible), (Decimal('10'), Decimal('0')))
+
+    def test_reserve_batch_in_one_transaction(self):
+        from .utils.stock import reservar_stock
+        a, b = self._abastecer(2, '10')
+        lineas = [
+            ConsumoStock(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('4')),
+            ConsumoStock(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('6')),
+            ConsumoStock(turno=self.turno, abastecimiento=b, cantidad_consumida=Decimal('1'),
+                         metros_inicio=Decimal('10'), metros_fin=Decimal('25')),
+        ]
+        # SAVEPOINT + SELECT FOR UPDATE + INSERT + UPDATE + RELEASE
+        with self.assertNumQueries(5):
+            creados = reservar_stock(lineas)
+        self.assertEqual(len(creados), 3)
+        self.assertEqual(creados[2].metros_utilizados, Decimal('15'))
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('0'))
+        self.assertEqual(StockBalance.objects.get(pk=b.pk).valor_disponible, Decimal('90'))
+
+    def test_reserve_rejects_whole_batch_when_short(self):
+        from .utils.stock import reservar_stock
+        a, b = self._abastecer(2, '10')
+        with self.assertRaises(ValidationError):
+            reservar_stock([
+                ConsumoStock(turno=self.turno, abastecimiento=b, cantidad_consumida=Decimal('2')),
+                ConsumoStock(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('6')),
+                ConsumoStock(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('5')),
+            ])
+        self.assertFalse(ConsumoStock.objects.exists())
+        self.assertEqual(StockBalance.objects.get(pk=b.pk).cantidad_disponible, Decimal('10'))
+
+    def test_edit_checks_stock_under_lock(self):
+        from .utils.stock import actualizar_consumo
+        a, b = self._abastecer(2, '10')
+        consumo = ConsumoStock.objects.create(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('4'))
+        ConsumoStock.objects.create(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('5'))
+
+        # Subir de 4 a 6 necesita 2 más y solo queda 1
+        consumo.cantidad_consumida = Decimal('6')
+        with self.assertRaises(ValidationError):
+            actualizar_consumo(consumo)
+        self.assertEqual(ConsumoStock.objects.get(pk=consumo.pk).cantidad_consumida, Decimal('4'))
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('1'))
+
+        consumo.cantidad_consumida = Decimal('5')
+        actualizar_consumo(consumo)
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('0'))
+
+        # Mover a otra línea exige la cantidad completa en la nueva
+        ConsumoStock.objects.create(turno=self.turno, abastecimiento=b, cantidad_consumida=Decimal('8'))
+        consumo.abastecimiento = b
+        with self.assertRaises(ValidationError):
+            actualizar_consumo(consumo)
+        consumo.cantidad_consumida = Decimal('2')
+        actualizar_consumo(consumo)
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('5'))
+        self.assertEqual(StockBalance.objects.get(pk=b.pk).cantidad_disponible, Decimal('0'))
+
+    def test_edit_view_reports_insufficient_stock(self):
+        a, = self._abastecer(1, '10')
+        consumo = ConsumoStock.objects.create(turno=self.turno, abastecimiento=a, cantidad_consumida=Decimal('4'))
+        usuario = CustomUser.objects.create_user(
+            username='bodega-ed', password='pass', role='SUPERVISOR', contrato=self.contrato
+        )
+        datos = {
+            'turno': self.turno.pk, 'abastecimiento': a.pk, 'cantidad_consumida': '11',
+            'estado_final': 'OPTIMO',
+        }
+        # Sin renderizar la plantilla: solo interesa el error del formulario
+        from django.test import RequestFactory
+        from .views import ConsumoStockUpdateView
+        request = RequestFactory().post(reverse('consumo-update', args=[consumo.pk]), datos)
+        request.user = usuario
+        response = ConsumoStockUpdateView.as_view()(request, pk=consumo.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('cantidad_consumida', response.context_data['form'].errors)
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('6'))
+
+        c = Client()
+        c.force_login(usuario)
+        datos['cantidad_consumida'] = '10'
+        self.assertEqual(c.post(reverse('consumo-update', args=[consumo.pk]), datos).status_code, 302)
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('0'))
+
+    def test_autocomplete_endpoints_search_and_limit(self):
+        from .forms import ConsumoStockForm
+        usuario = CustomUser.objects.create_user(
+            username='bodega', password='pass', role='SUPERVISOR', contrato=self.contrato
+        )
+        c = Client()
+        c.force_login(usuario)
+        a, b, agotado = self._abastecer(3, '10')
+        ConsumoStock.objects.create(turno=self.turno, abastecimiento=agotado, cantidad_consumida=Decimal('10'))
+
+        data = c.get(reverse('api-abastecimiento-autocomplete'), {'q': 'item', 'limit': 1}).json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertTrue(data['more'])
+        data = c.get(reverse('api-abastecimiento-autocomplete'), {'q': 'item'}).json()
+        self.assertEqual({r['id'] for r in data['results']}, {a.pk, b.pk})
+        self.assertFalse(data['more'])
+
+        data = c.get(reverse('api-turno-autocomplete'), {'q': 'maq-s'}).json()
+        self.assertEqual([r['id'] for r in data['results']], [self.turno.pk])
+        self.assertEqual(c.get(reverse('api-turno-autocomplete'), {'q': 'otra'}).json()['results'], [])
+
+        # El select solo renderiza la opción elegida, no todo el queryset
+        html = str(ConsumoStockForm(initial={'abastecimiento': b.pk})['abastecimiento'])
+        self.assertIn(f'value="{b.pk}" selected', html)
+        self.assertNotIn(f'value="{a.pk}"', html)
+        self.assertIn('data-autocomplete-url', html)
+
+        # Re-renderizar un formulario inválido con datos crudos no debe fallar
+        form = ConsumoStockForm(data={'turno': 'abc', 'abastecimiento': b.pk, 'cantidad_consumida': '1'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('turno', form.errors)
+        html = str(form['turno'])
+        self.assertIn('value="" selected', html)
+        self.assertIn(f'value="{b.pk}" selected', str(form['abastecimiento']))
+
+        # Las páginas cargan el script que completa esos selects
+        from django.contrib.staticfiles import finders
+        self.assertIsNotNone(finders.find('js/autocomplete.js'))
+        self.assertContains(c.get(reverse('dashboard')), 'js/autocomplete.js')
+
+
+class AbastecimientoImporterTests(TestCase):
+    def setUp(self):
+        self.contrato = Contrato.objects.create(
+            nombre_contrato='CT-IMP', cliente=Cliente.objects.create(nombre='C-IMP'),
+        )
+        self.admin = CustomUser.objects.create_user(
+            username='admin-imp', password='pass', role='ADMIN_SISTEMA', is_system_admin=True
+        )
+
+    def _excel(self, filas):
+        import io
+        import pandas as pd
+        columnas = ['MES', 'FECHA', 'CONTRATO', 'DESCRIPCION', 'FAMILIA', 'CANT', 'PRECIO', 'UNIDAD', 'TIPO_COMPLEMENTO']
+        columnas += sorted({c for fila in filas for c in fila} - set(columnas))
+        archivo = io.BytesIO()
+        pd.DataFrame(filas, columns=columnas).to_excel(archivo, index=False)
+        archivo.seek(0)
+        return archivo
+
+    def _fila(self, i, **extra):
+        fila = {
+            'MES': 'enero', 'FECHA': '2025-01-15', 'CONTRATO': 'CT-IMP', 'DESCRIPCION': f'Item {i}',
+            'FAMILIA': 'PRODUCTOS_DIAMANTADOS', 'CANT': 2, 'PRECIO': 10.5, 'UNIDAD': 'und',
+            'TIPO_COMPLEMENTO': 'Broca HQ',
+        }
+        fila.update(extra)
+        return fila
+
+    def test_bulk_import_reports_invalid_rows(self):
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        filas = [self._fila(i) for i in range(30)]
+        filas[3]['CANT'] = None
+        filas[7]['CONTRATO'] = 'NO-EXISTE'
+        filas[9]['PRECIO'] = 'abc'
+
+        resultado = AbastecimientoExcelImporter(self.admin, batch_size=10).process_excel(self._excel(filas))
+        self.assertTrue(resultado['success'], resultado.get('error'))
+        self.assertEqual(resultado['success_count'], 27)
+        self.assertEqual(resultado['skip_count'], 3)
+        self.assertEqual(resultado['errors'], [
+            'Fila 5: Faltan datos requeridos (MES, DESCRIPCION, CANT)',
+            "Fila 9: Contrato 'NO-EXISTE' no existe",
+            'Fila 11: Precio inválido',
+        ])
+        self.assertEqual(resultado['meses_procesados'], ['ENERO'])
+
+        # Tablas de referencia creadas una sola vez; total y saldo calculados
+        self.assertEqual(UnidadMedida.objects.filter(nombre='und').count(), 1)
+        self.assertEqual(TipoComplemento.objects.filter(nombre='Broca HQ').count(), 1)
+        a = Abastecimiento.objects.get(descripcion='Item 0')
+        self.assertEqual(a.total, Decimal('21.00'))
+        self.assertEqual(a.tipo_complemento.nombre, 'Broca HQ')
+        self.assertEqual(a.balance.cantidad_disponible, Decimal('2'))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .utils.excel_importer import AbastecimientoExcelImporter
+
+        def consultas(n):
+            with CaptureQueriesContext(connection) as ctx:
+                AbastecimientoExcelImporter(self.admin, batch_size=1000).process_excel(
+                    self._excel([self._fila(i) for i in range(n)])
+                )
+            return len(ctx.captured_queries)
+
+        consultas(5)  # crea unidad y tipo de complemento
+        # 50 filas caben en un INSERT incluso con el límite de parámetros de SQLite
+        self.assertEqual(consultas(5), consultas(50))
+        # El reemplazo por mes deja solo la última importación
+        self.assertEqual(Abastecimiento.objects.count(), 50)
+        self.assertEqual(StockBalance.objects.count(), 50)
+
+    def test_streams_blocks_and_replaces_each_month_once(self):
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        AbastecimientoExcelImporter(self.admin).process_excel(self._excel([self._fila('viejo')]))
+
+        avance = []
+        filas = [self._fila(i, MES='enero' if i < 12 else 'febrero') for i in range(25)]
+        importador = AbastecimientoExcelImporter(self.admin, chunk_size=10)
+        resultado = importador.process_excel(
+            self._excel(filas), progress=lambda leidas, total: avance.append((leidas, total))
+        )
+        self.assertTrue(resultado['success'], resultado.get('error'))
+        self.assertEqual(avance, [(10, 25), (20, 25), (25, 25)])
+        # ENERO aparece en dos bloques pero solo se reemplaza al verlo por primera vez
+        self.assertEqual(resultado['deleted_count'], 1)
+        self.assertEqual(Abastecimiento.objects.filter(mes='ENERO').count(), 12)
+        self.assertEqual(Abastecimiento.objects.filter(mes='FEBRERO').count(), 13)
+
+    def test_replace_checks_every_month_before_deleting(self):
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        filas = [self._fila(i, MES='enero' if i < 12 else 'febrero') for i in range(25)]
+        AbastecimientoExcelImporter(self.admin).process_excel(self._excel(filas))
+        enero = set(Abastecimiento.objects.filter(mes='ENERO').values_list('pk', flat=True))
+
+        # Un consumo en FEBRERO (último bloque) impide el reemplazo: ENERO no se toca
+        turno = Turno.objects.create(
+            contrato=self.contrato, maquina=Maquina.objects.create(contrato=self.contrato, nombre='M', tipo='T'),
+            tipo_turno=TipoTurno.objects.create(nombre='Día'), fecha=timezone.now().date(),
+        )
+        ConsumoStock.objects.create(
+            turno=turno, abastecimiento=Abastecimiento.objects.filter(mes='FEBRERO').first(),
+            cantidad_consumida=Decimal('1'),
+        )
+        resultado = AbastecimientoExcelImporter(self.admin, chunk_size=10).process_excel(self._excel(filas))
+        self.assertFalse(resultado['success'])
+        self.assertIn('FEBRERO (CT-IMP)', resultado['error'])
+        self.assertNotIn('pares_incompletos', resultado)
+        self.assertEqual(set(Abastecimiento.objects.filter(mes='ENERO').values_list('pk', flat=True)), enero)
+
+    def test_failed_replace_reports_committed_months(self):
+        from unittest import mock
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        filas = [self._fila(i, MES='enero' if i < 12 else 'febrero') for i in range(25)]
+        importador = AbastecimientoExcelImporter(self.admin, chunk_size=10)
+        insertar = importador._insertar
+        llamadas = []
+
+        def fallar_tercer_bloque(validas, upsert=False):
+            llamadas.append(len(validas))
+            if len(llamadas) == 3:
+                raise RuntimeError('conexión perdida')
+            return insertar(validas, upsert=upsert)
+
+        with mock.patch.object(importador, '_insertar', side_effect=fallar_tercer_bloque):
+            resultado = importador.process_excel(self._excel(filas))
+        self.assertFalse(resultado['success'])
+        # Bloques: 10 de ENERO | 2 de ENERO + 8 de FEBRERO | 5 de FEBRERO (revertido)
+        self.assertEqual(resultado['pares_completos'], ['ENERO (CT-IMP)'])
+        self.assertEqual(resultado['pares_incompletos'], ['FEBRERO (CT-IMP)'])
+        self.assertEqual(Abastecimiento.objects.filter(mes='FEBRERO').count(), 8)
+
+    def test_csv_export_with_semicolons(self):
+        import io
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        # Configuración regional con ';': coma decimal, punto de miles y códigos con ceros
+        contenido = (
+            'MES;FECHA;CONTRATO;CODIGO;GUIA;DESCRIPCION;FAMILIA;CANT;PRECIO;UNIDAD\n'
+            'marzo;2025-03-01;CT-IMP;00123;0045;Bentonita;ADITIVOS_PERFORACION;4;12,5;saco\n'
+            'marzo;2025-03-02;CT-IMP;;;Sin cantidad;CONSUMIBLES;;1;und\n'
+            'marzo;2025-03-03;CT-IMP;007;;Corona;CONSUMIBLES;1.234,50;2;und\n'
+        ).encode('utf-8')
+        archivo = io.BytesIO(contenido)
+        archivo.name = 'export.csv'
+        resultado = AbastecimientoExcelImporter(self.admin).process_excel(archivo)
+        self.assertTrue(resultado['success'], resultado.get('error'))
+        self.assertEqual(resultado['success_count'], 2)
+        self.assertEqual(resultado['errors'], ['Fila 3: Faltan datos requeridos (MES, DESCRIPCION, CANT)'])
+        a = Abastecimiento.objects.get(descripcion='Bentonita')
+        self.assertEqual((a.total, a.tipo_aditivo.nombre), (Decimal('50.00'), 'BENTONITA'))
+        self.assertEqual((a.codigo_producto, a.numero_guia), ('00123', '0045'))
+        b = Abastecimiento.objects.get(descripcion='Corona')
+        self.assertEqual((b.cantidad, b.total, b.codigo_producto), (Decimal('1234.50'), Decimal('2469.00'), '007'))
+
+    def test_excel_numeric_codes_read_as_text_in_any_block_size(self):
+        from .utils.chunked_reader import LectorPorBloques
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        filas = [self._fila(0, CODIGO=123), self._fila(1, CODIGO=None), self._fila(2, CODIGO=777, GUIA=45)]
+        for tamano in (1, 3):
+            bloques = list(LectorPorBloques(
+                self._excel(filas), tamano=tamano, nombre='a.xlsx', columnas_texto=('CODIGO', 'GUIA'),
+            ))
+            codigos = [v for b in bloques for v in b['CODIGO'].tolist()]
+            self.assertEqual(codigos, ['123', None, '777'], f'tamano={tamano}')
+            self.assertEqual([v for b in bloques for v in b['GUIA'].tolist()][2], '45')
+
+        # La clave natural no cambia con el bloque: re-importar actualiza en vez de duplicar
+        AbastecimientoExcelImporter(self.admin, chunk_size=3).process_excel(self._excel(filas), delete_existing=False)
+        resultado = AbastecimientoExcelImporter(self.admin, chunk_size=1).process_excel(
+            self._excel(filas), delete_existing=False,
+        )
+        self.assertEqual((resultado['inserted_count'], resultado['unchanged_count']), (0, 3))
+        self.assertEqual(Abastecimiento.objects.get(descripcion='Item 0').codigo_producto, '123')
+
+    def test_reimport_updates_changed_rows_and_skips_unchanged(self):
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        filas = [self._fila(i, CODIGO=f'P{i % 3}') for i in range(6)]
+        filas.append(self._fila('dup', CODIGO='P0'))
+        primera = AbastecimientoExcelImporter(self.admin).process_excel(self._excel(filas), delete_existing=False)
+        self.assertEqual(primera['inserted_count'], 7)
+
+        # Un consumo impide el borrado por mes (PROTECT) pero no el upsert
+        a = Abastecimiento.objects.get(descripcion='Item 1')
+        turno = Turno.objects.create(
+            contrato=self.contrato, maquina=Maquina.objects.create(contrato=self.contrato, nombre='M', tipo='T'),
+            tipo_turno=TipoTurno.objects.create(nombre='Noche'), fecha=timezone.now().date(),
+        )
+        ConsumoStock.objects.create(turno=turno, abastecimiento=a, cantidad_consumida=Decimal('1'))
+
+        filas[1]['CANT'] = 5
+        filas[4]['DESCRIPCION'] = 'Item 4 corregido'
+        filas.append(self._fila('nuevo', CODIGO='P9'))
+        segunda = AbastecimientoExcelImporter(self.admin).process_excel(self._excel(filas), delete_existing=False)
+        self.assertTrue(segunda['success'], segunda.get('error'))
+        self.assertEqual(
+            (segunda['inserted_count'], segunda['updated_count'], segunda['unchanged_count'], segunda['deleted_count']),
+            (1, 2, 5, 0),
+        )
+        self.assertEqual(Abastecimiento.objects.count(), 8)
+        a.refresh_from_db()
+        self.assertEqual((a.cantidad, a.total), (Decimal('5.00'), Decimal('52.50')))
+        self.assertEqual(StockBalance.objects.get(pk=a.pk).cantidad_disponible, Decimal('4.00'))
+        self.assertTrue(Abastecimiento.objects.filter(descripcion='Item 4 corregido').exists())
+
+        tercera = AbastecimientoExcelImporter(self.admin).process_excel(self._excel(filas), delete_existing=False)
+        self.assertEqual((tercera['inserted_count'], tercera['updated_count'], tercera['unchanged_count']), (0, 0, 8))
+
+
+class ImportacionQueueTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=self.media.name, IMPORTACION_EN_SEGUNDO_PLANO=True)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.contrato = Contrato.objects.create(
+            nombre_contrato='CT-COLA', cliente=Cliente.objects.create(nombre='C-COLA'),
+        )
+        self.otro = Contrato.objects.create(
+            nombre_contrato='CT-OTRO', cliente=Cliente.objects.create(nombre='C-OTRO'),
+        )
+        self.usuario = CustomUser.objects.create_user(
+            username='cola', password='pass', role='SUPERVISOR', contrato=self.contrato
+        )
+
+    def _archivo(self, nombre='abastecimiento.csv'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        contenido = (
+            'MES,FECHA,CONTRATO,DESCRIPCION,FAMILIA,CANT,PRECIO,UNIDAD\n'
+            'abril,2025-04-01,CT-COLA,Zapata,CONSUMIBLES,3,7,und\n'
+            'abril,2025-04-01,CT-OTRO,Ajena,CONSUMIBLES,3,7,und\n'
+        )
+        return SimpleUploadedFile(nombre, contenido.encode('utf-8'), content_type='text/csv')
+
+    def test_upload_is_queued_and_worker_reports_progress(self):
+        from .utils.import_queue import procesar_pendientes
+        c = Client()
+        c.force_login(self.usuario)
+        response = c.post(
+            reverse('importar-abastecimiento'), {'excel_file': self._archivo()},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 202)
+        estado_url = response.json()['estado_url']
+        self.assertEqual(c.get(estado_url).json()['estado'], 'PENDIENTE')
+        self.assertFalse(Abastecimiento.objects.exists())
+
+        self.assertEqual(procesar_pendientes('test'), 1)
+        estado = c.get(estado_url).json()
+        self.assertEqual((estado['estado'], estado['porcentaje']), ('COMPLETADO', 100))
+        self.assertEqual((estado['creados'], estado['omitidos'], estado['filas_leidas']), (1, 1, 2))
+        self.assertEqual(estado['errores'], ["Fila 3: Sin permisos para el contrato 'CT-OTRO'"])
+
+        # Otro usuario no ve la importación
+        ajeno = CustomUser.objects.create_user(username='ajeno', password='pass', role='SUPERVISOR', contrato=self.otro)
+        c.force_login(ajeno)
+        self.assertEqual(c.get(estado_url).status_code, 404)
+
+    def test_claim_serializes_per_contract(self):
+        from .utils.import_queue import encolar_importacion
+        primera = encolar_importacion(self.usuario, self._archivo())
+        segunda = encolar_importacion(self.usuario, self._archivo())
+        otro_usuario = CustomUser.objects.create_user(username='otro', password='pass', role='SUPERVISOR', contrato=self.otro)
+        otra = encolar_importacion(otro_usuario, self._archivo())
+
+        self.assertEqual(ImportacionAbastecimiento.reclamar('w1').pk, primera.pk)
+        # La segunda del mismo contrato espera; la de otro contrato corre en paralelo
+        self.assertEqual(ImportacionAbastecimiento.reclamar('w2').pk, otra.pk)
+        self.assertIsNone(ImportacionAbastecimiento.reclamar('w3'))
+
+        ImportacionAbastecimiento.objects.filter(pk=primera.pk).update(estado='COMPLETADO')
+        self.assertEqual(ImportacionAbastecimiento.reclamar('w3').pk, segunda.pk)
+
+    def test_system_admin_import_runs_alone(self):
+        from .utils.import_queue import encolar_importacion
+        admin = CustomUser.objects.create_user(
+            username='admin-cola', password='pass', role='ADMIN_SISTEMA', is_system_admin=True
+        )
+        primera = encolar_importacion(self.usuario, self._archivo())
+        de_admin = encolar_importacion(admin, self._archivo())
+        posterior = encolar_importacion(self.usuario, self._archivo())
+        self.assertIsNone(de_admin.contrato)
+
+        self.assertEqual(ImportacionAbastecimiento.reclamar('w1').pk, primera.pk)
+        # La del administrador espera a la del contrato y las más nuevas esperan a ella
+        self.assertIsNone(ImportacionAbastecimiento.reclamar('w2'))
+        ImportacionAbastecimiento.objects.filter(pk=primera.pk).update(estado='COMPLETADO')
+        self.assertEqual(ImportacionAbastecimiento.reclamar('w2').pk, de_admin.pk)
+        self.assertIsNone(ImportacionAbastecimiento.reclamar('w3'))
+        ImportacionAbastecimiento.objects.filter(pk=de_admin.pk).update(estado='COMPLETADO')
+        self.assertEqual(ImportacionAbastecimiento.reclamar('w3').pk, posterior.pk)
+
+    def test_requeues_only_jobs_without_heartbeat(self):
+        import time as reloj
+        from unittest import mock
+        from .utils.import_queue import encolar_importacion, latido
+        viva = encolar_importacion(self.usuario, self._archivo())
+        otro_usuario = CustomUser.objects.create_user(username='otro', password='pass', role='SUPERVISOR', contrato=self.otro)
+        muerta = encolar_importacion(otro_usuario, self._archivo())
+        ImportacionAbastecimiento.reclamar('w1')
+        ImportacionAbastecimiento.reclamar('w2')
+
+        # Ninguna avanza hace una hora, pero solo el worker de `viva` sigue latiendo
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        ImportacionAbastecimiento.objects.update(updated_at=hace_una_hora, latido_at=hace_una_hora)
+        self.assertEqual(ImportacionAbastecimiento.latir(viva.pk, 'w1'), 1)
+        self.assertEqual(ImportacionAbastecimiento.latir(muerta.pk, 'w1'), 0)
+        self.assertEqual(ImportacionAbastecimiento.liberar_colgadas(timedelta(minutes=5)), 1)
+        viva.refresh_from_db()
+        muerta.refresh_from_db()
+        self.assertEqual((viva.estado, viva.worker), ('EN_PROCESO', 'w1'))
+        self.assertEqual((muerta.estado, muerta.worker), ('PENDIENTE', ''))
+
+        # El hilo de latido corre mientras dura el procesamiento
+        with mock.patch.object(ImportacionAbastecimiento, 'latir') as latir:
+            with latido(viva, intervalo=0.01):
+                reloj.sleep(0.1)
+            llamadas = latir.call_count
+            reloj.sleep(0.05)
+        self.assertGreater(llamadas, 0)
+        self.assertEqual(latir.call_count, llamadas)
+        latir.assert_called_with(viva.pk, 'w1')
+
+    def test_preview_validates_without_writes_and_confirm_skips_reparse(self):
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .utils.import_queue import procesar_pendientes
+        c = Client()
+        c.force_login(self.usuario)
+        # La validación también la hace el worker: el request solo encola
+        response = c.post(
+            reverse('importar-abastecimiento'), {'excel_file': self._archivo(), 'vista_previa': 'on'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 202)
+        estado_url = response.json()['estado_url']
+        self.assertEqual(c.get(estado_url).json()['estado'], 'PENDIENTE')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(procesar_pendientes('test'), 1)
+        # Solo se escribe el registro de la importación
+        escrituras = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) and 'importacion_abastecimiento' not in q['sql']
+        ]
+        self.assertEqual(escrituras, [])
+        estado = c.get(estado_url).json()
+        self.assertEqual((estado['estado'], estado['terminado']), ('PREVIA', True))
+        informe = estado['resultado']
+        self.assertEqual((informe['total_rows'], informe['valid_count'], informe['error_count']), (2, 1, 1))
+        self.assertEqual(informe['errors'], [{'fila': 3, 'error': "Sin permisos para el contrato 'CT-OTRO'"}])
+        self.assertEqual(informe['nuevas_referencias']['unidades'], ['und'])
+        self.assertEqual(informe['monto_total'], '21.00')
+        self.assertFalse(UnidadMedida.objects.exists())
+
+        # Las filas validadas quedan como JSON lines (datos, no objetos serializados)
+        importacion = ImportacionAbastecimiento.objects.get(pk=estado['id'])
+        with importacion.previa.open('rb') as previa:
+            filas = [json.loads(linea) for linea in previa]
+        self.assertEqual([f['descripcion'] for f in filas], ['Zapata', 'Ajena'])
+        self.assertEqual(filas[0]['cantidad'], '3.00')
+        # Una vista previa lista no es reclamada otra vez por el worker
+        self.assertEqual(procesar_pendientes('test'), 0)
+
+        confirmar_url = estado['confirmar_url']
+        self.assertEqual(c.post(confirmar_url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code, 202)
+        self.assertEqual(c.post(confirmar_url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code, 409)
+        with mock.patch('drilling.utils.excel_importer.LectorPorBloques', side_effect=AssertionError):
+            self.assertEqual(procesar_pendientes('test'), 1)
+        importacion.refresh_from_db()
+        self.assertEqual((importacion.estado, importacion.creados, importacion.omitidos), ('COMPLETADO', 1, 1))
+        self.assertFalse(importacion.previa)
+        self.assertEqual(Abastecimiento.objects.get().descripcion, 'Zapata')
+
+    def test_preview_in_request_when_not_in_background(self):
+        from django.test import override_settings
+        c = Client()
+        c.force_login(self.usuario)
+        with override_settings(IMPORTACION_EN_SEGUNDO_PLANO=False):
+            response = c.post(
+                reverse('importar-abastecimiento'), {'excel_file': self._archivo(), 'vista_previa': 'on'},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        informe = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((informe['valid_count'], informe['error_count']), (1, 1))
+        self.assertEqual(ImportacionAbastecimiento.objects.get(pk=informe['id']).estado, 'PREVIA')
+        self.assertIn('confirmar_url', informe)
+
+    def test_preview_streams_blocks_without_concatenating(self):
+        import io
+        from unittest import mock
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        lineas = ['MES,FECHA,CONTRATO,DESCRIPCION,FAMILIA,CANT,PRECIO,UNIDAD']
+        lineas += [f'abril,2025-04-01,CT-COLA,Item {i},CONSUMIBLES,1,2,und' for i in range(25)]
+        archivo = io.BytesIO('\n'.join(lineas).encode('utf-8'))
+        archivo.name = 'grande.csv'
+        destino = io.BytesIO()
+        importador = AbastecimientoExcelImporter(self.usuario, chunk_size=10)
+        with mock.patch('drilling.utils.excel_importer.pd.concat', side_effect=AssertionError):
+            resumen = importador.preview(archivo, destino=destino)
+        self.assertEqual((resumen['total_rows'], resumen['valid_count'], resumen['monto_total']), (25, 25, '50.00'))
+
+        destino.seek(0)
+        bloques = list(AbastecimientoExcelImporter(self.usuario, chunk_size=10)._leer_previa(destino))
+        self.assertEqual([len(b) for b in bloques], [10, 10, 5])
+        self.assertEqual(bloques[0]['cantidad'].iloc[0], Decimal('1.00'))
+
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        from .utils.request_metrics import request_metrics
+        self.metricas = request_metrics
+        self.metricas.reiniciar()
+        self.addCleanup(self.metricas.reiniciar)
+        self.contrato = Contrato.objects.create(
+            nombre_contrato='CT-MET', cliente=Cliente.objects.create(nombre='C-MET'),
+        )
+        self.supervisor = CustomUser.objects.create_user(
+            username='met-sup', password='pass', role='SUPERVISOR', contrato=self.contrato
+        )
+        self.admin = CustomUser.objects.create_user(
+            username='met-admin', password='pass', role='ADMIN_SISTEMA', is_system_admin=True
+        )
+
+    def test_server_timing_header_and_budget_warning(self):
+        import re
+        from django.test import override_settings
+        c = Client()
+        c.force_login(self.supervisor)
+        with override_settings(QUERY_BUDGETS={'api-turno-autocomplete': 1}, REQUEST_METRICS_SERVER_TIMING=True):
+            with self.assertLogs('drilling.middleware', 'WARNING') as logs:
+                response = c.get(reverse('api-turno-autocomplete'), {'q': 'x'})
+
+        timing = re.match(r'db;dur=[\d.]+;desc="(\d+) consultas", tpl;dur=[\d.]+, total;dur=[\d.]+$', response['Server-Timing'])
+        self.assertIsNotNone(timing, response['Server-Timing'])
+        consultas = int(timing.group(1))
+        self.assertGreater(consultas, 1)
+        self.assertIn(f'(api-turno-autocomplete): {consultas} consultas, presupuesto 1', logs.output[0])
+
+        [fila] = self.metricas.resumen()
+        self.assertEqual((fila['vista'], fila['requests'], fila['consultas_max']), ('api-turno-autocomplete', 1, consultas))
+        self.assertEqual(fila['sobre_presupuesto'], 1)
+
+    def test_server_timing_only_for_staff_and_counts_session_save(self):
+        from unittest import mock
+        from django.db import connection
+        from django.http import HttpResponse
+        from django.test.utils import CaptureQueriesContext
+        from .views import MetricasRequestsView
+        c = Client()
+        # Anónimos y usuarios comunes (también en 4xx) no reciben el encabezado
+        self.assertNotIn('Server-Timing', c.get(reverse('login')))
+        c.force_login(self.supervisor)
+        response = c.get(reverse('metricas-requests'))
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('Server-Timing', response)
+
+        c.force_login(self.admin)
+        self.assertIn('Server-Timing', c.get(reverse('metricas-requests')))
+        self.assertEqual(settings.MIDDLEWARE[0], 'drilling.middleware.RequestMetricsMiddleware')
+
+        # Medido por fuera de SessionMiddleware: el guardado de la sesión también cuenta
+        def modificar_sesion(request, *args, **kwargs):
+            request.session['visto'] = True
+            return HttpResponse()
+
+        self.metricas.reiniciar()
+        with mock.patch.object(MetricasRequestsView, 'get', side_effect=modificar_sesion):
+            with CaptureQueriesContext(connection) as ctx:
+                c.get(reverse('metricas-requests'))
+        [fila] = self.metricas.resumen()
+        self.assertTrue(any('django_session' in q['sql'] and q['sql'].startswith('UPDATE') for q in ctx.captured_queries))
+        self.assertEqual(fila['consultas_max'], len(ctx.captured_queries))
+
+    def test_stats_page_is_admin_only(self):
+        c = Client()
+        c.force_login(self.supervisor)
+        self.assertEqual(c.get(reverse('metricas-requests')).status_code, 403)
+
+        c.force_login(self.admin)
+        response = c.get(reverse('metricas-requests'))
+        self.assertEqual(response.status_code, 200)
+        # El 403 y la página ya figuran; la consulta JSON aún no (se registra al terminar)
+        vistas = {f['vista']: f for f in c.get(reverse('metricas-requests'), {'formato': 'json'}).json()['vistas']}
+        self.assertGreater(vistas['metricas-requests']['plantillas_ms_promedio'], 0)
+        self.assertEqual(vistas['metricas-requests']['requests'], 2)
+
+
+# Plantillas de este listado no están en el repositorio; para medir igual sus
+# vistas se renderiza una genérica que recorre lo mismo que una real: cada
+# objeto de la lista (vía __str__) y el formulario completo.
+_PLANTILLAS_GENERICAS = {
+    nombre: (
+        "{% extends 'drilling/base.html' %}{% block content %}"
+        "{% for obj in object_list %}{{ obj }}{% endfor %}{{ object }}{{ form }}"
+        "{% endblock %}"
+    )
+    for nombre in [
+        'drilling/actividades/form.html', 'drilling/actividades/confirm_delete.html',
+        'drilling/tipo_turnos/list.html', 'drilling/tipo_turnos/form.html', 'drilling/tipo_turnos/confirm_delete.html',
+        'drilling/abastecimiento/list.html', 'drilling/abastecimiento/form.html',
+        'drilling/abastecimiento/detail.html', 'drilling/abastecimiento/confirm_delete.html',
+        'drilling/abastecimiento/importar.html',
+        'drilling/consumo/list.html', 'drilling/consumo/form.html', 'drilling/consumo/confirm_delete.html',
+        'drilling/stock/disponible.html',
+    ]
+}
+
+
+class QueryCountRegressionTests(TestCase):
+    """Consultas SQL por vista con un conjunto de datos realista.
+
+    Cada vista se mide dos veces, como administrador y como supervisor de un
+    contrato: con el conjunto base y tras multiplicar por 100 turnos,
+    trabajadores y abastecimientos. La cantidad de consultas debe
+    ser la misma (sin N+1) y no superar el presupuesto de QUERY_BUDGETS.
+    """
+    CONTRATOS = 3
+    ESCALA_BASE = 1
+    # 1.500 turnos, 1.200 trabajadores y 1.500 líneas de abastecimiento en total
+    ESCALA_FINAL = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre='C-PERF')
+        cls.contratos = [
+            Contrato.objects.create(nombre_contrato=f'CT-PERF-{i}', cliente=cls.cliente) for i in range(cls.CONTRATOS)
+        ]
+        cls.contrato = cls.contratos[0]
+        cls.tipo_turno = TipoTurno.objects.create(nombre='Día')
+        cls.unidad = UnidadMedida.objects.create(nombre='Unidades', simbolo='und')
+        cls.tipo_complemento = TipoComplemento.objects.create(nombre='Broca HQ', categoria='BROCA')
+        cls.tipo_aditivo = TipoAditivo.objects.create(
+            nombre='Bentonita', categoria='BENTONITA', unidad_medida_default=cls.unidad,
+        )
+        cls.actividades = TipoActividad.objects.bulk_create(
+            TipoActividad(nombre=f'Actividad {i}', tipo_actividad='OPERATIVO') for i in range(5)
+        )
+        ContratoActividad.objects.bulk_create(
+            ContratoActividad(contrato=c, tipoactividad=a) for c in cls.contratos for a in cls.actividades
+        )
+        cls.admin = CustomUser.objects.create_user(
+            username='perf-admin', password='pass', role='ADMIN_SISTEMA', is_system_admin=True, contrato=cls.contrato,
+        )
+        cls.supervisor = CustomUser.objects.create_user(
+            username='perf-sup', password='pass', role='SUPERVISOR', contrato=cls.contrato,
+        )
+        cls.lote = 0
+        cls._sembrar(cls.ESCALA_BASE)
+
+    @classmethod
+    def _sembrar(cls, escala):
+        """Agregar a cada contrato `escala` lotes de datos (una sola pasada de bulk_create).
+
+        El lote base queda por debajo del tamaño de página de todos los
+        listados, así que un N+1 se nota al crecer aunque la vista pagine.
+        """
+        from .utils.stock import reservar_stock
+        hoy = timezone.now().date()
+        lotes = [(contrato, cls.lote + k) for contrato in cls.contratos for k in range(1, escala + 1)]
+        cls.lote += escala
+
+        maquinas = Maquina.objects.bulk_create(
+            Maquina(contrato=c, nombre=f'Maq-{c.pk}-{n}-{i}', tipo='LF-90') for c, n in lotes for i in range(2)
+        )
+        sondajes = Sondaje.objects.bulk_create(
+            Sondaje(
+                contrato=c, nombre_sondaje=f'DDH-{c.pk}-{n}-{i}', fecha_inicio=hoy,
+                profundidad=500, inclinacion=-60, cota_collar=4000,
+            ) for c, n in lotes for i in range(2)
+        )
+        trabajadores = Trabajador.objects.bulk_create(
+            Trabajador(contrato=c, nombres=f'Trabajador {n}-{i}', cargo='PERFORISTA DDH', dni=f'{c.pk:02d}{n:05d}{i}')
+            for c, n in lotes for i in range(4)
+        )
+        # Cinco turnos por lote: fechas distintas por máquina (unique por contrato, máquina, fecha y tipo)
+        turnos = Turno.objects.bulk_create(
+            Turno(
+                contrato=c, maquina=maquinas[2 * k + i % 2], tipo_turno=cls.tipo_turno,
+                fecha=hoy - timedelta(days=i), estado='COMPLETADO',
+            ) for k, (c, n) in enumerate(lotes) for i in range(5)
+        )
+        por_lote = lambda lista, tamano: [lista[k * tamano:(k + 1) * tamano] for k in range(len(lotes))]
+        turnos_lote = por_lote(turnos, 5)
+        sondajes_lote = por_lote(sondajes, 2)
+        trabajadores_lote = por_lote(trabajadores, 4)
+
+        TurnoSondaje.objects.bulk_create(
+            TurnoSondaje(turno=t, sondaje=sondajes_lote[k][i % 2], metros_turno=25)
+            for k, ts in enumerate(turnos_lote) for i, t in enumerate(ts)
+        )
+        TurnoAvance.objects.bulk_create(TurnoAvance(turno=t, metros_perforados=25) for t in turnos)
+        TurnoMaquina.objects.bulk_create(
+            TurnoMaquina(
+                turno=t, hora_inicio=time(8), hora_fin=time(20), horas_trabajadas_calc=12,
+                estado_bomba='OPERATIVO', estado_unidad='OPERATIVO', estado_rotacion='OPERATIVO',
+            ) for t in turnos
+        )
+        TurnoTrabajador.objects.bulk_create(
+            TurnoTrabajador(turno=t, trabajador=trabajadores_lote[k][(i + j) % 4], funcion=funcion)
+            for k, ts in enumerate(turnos_lote) for i, t in enumerate(ts)
+            for j, funcion in enumerate(['PERFORISTA', 'AYUDANTE'])
+        )
+        TurnoActividad.objects.bulk_create(
+            TurnoActividad(turno=t, actividad=cls.actividades[i % 5], hora_inicio=time(8), hora_fin=time(20), tiempo_calc=12)
+            for i, t in enumerate(turnos)
+        )
+        TurnoComplemento.objects.bulk_create(
+            TurnoComplemento(
+                turno=t, sondaje=sondajes_lote[k][i % 2], tipo_complemento=cls.tipo_complemento,
+                codigo_serie=f'S-{t.pk}', metros_inicio=0, metros_fin=25, metros_turno_calc=25,
+            ) for k, ts in enumerate(turnos_lote) for i, t in enumerate(ts)
+        )
+        TurnoAditivo.objects.bulk_create(
+            TurnoAditivo(
+                turno=t, sondaje=sondajes_lote[k][i % 2], tipo_aditivo=cls.tipo_aditivo, cantidad_usada=2,
+                unidad_medida=cls.unidad,
+            ) for k, ts in enumerate(turnos_lote) for i, t in enumerate(ts)
+        )
+        TurnoCorrida.objects.bulk_create(
+            TurnoCorrida(
+                turno=t, corrida_numero=1, desde=0, hasta=3, total_calc=3, longitud_testigo=3,
+                pct_recuperacion=100, pct_retorno_agua=90, litologia='Andesita',
+            ) for t in turnos
+        )
+        abastecimientos = Abastecimiento.objects.bulk_create(
+            Abastecimiento(
+                mes='ENERO', fecha=hoy, contrato=c, descripcion=f'Item {n}-{i}', familia='CONSUMIBLES',
+                unidad_medida=cls.unidad, cantidad=10, precio_unitario=5, total=50,
+            ) for c, n in lotes for i in range(5)
+        )
+        StockBalance.crear_iniciales(abastecimientos)
+        abastecimientos_lote = por_lote(abastecimientos, 5)
+        # Las dos últimas líneas de cada lote quedan sin consumos (editables)
+        consumos = reservar_stock([
+            ConsumoStock(turno=turnos_lote[k][i], abastecimiento=a, cantidad_consumida=Decimal('1'))
+            for k, lote in enumerate(abastecimientos_lote) for i, a in enumerate(lote[:3])
+        ])
+
+        if not hasattr(cls, 'objetos'):
+            cls.objetos = {
+                'maquina': maquinas[0], 'sondaje': sondajes[0], 'trabajador': trabajadores[0],
+                'turno': turnos[0], 'abastecimiento': abastecimientos[0],
+                'abastecimiento_libre': abastecimientos_lote[0][-1], 'consumo': consumos[0],
+            }
+
+    def _vistas(self):
+        """(nombre de URL, kwargs) de cada vista GET de drilling/urls.py."""
+        o = self.objetos
+        pk = lambda obj: {'pk': obj.pk}
+        importacion = ImportacionAbastecimiento.objects.create(
+            archivo='importaciones/prueba.csv', nombre_archivo='prueba.csv', usuario=self.supervisor, contrato=self.contrato,
+        )
+        return [
+            ('dashboard', {}),
+            ('trabajador-list', {}), ('trabajador-create', {}),
+            ('trabajador-update', pk(o['trabajador'])), ('trabajador-delete', pk(o['trabajador'])),
+            ('maquina-list', {}), ('maquina-create', {}),
+            ('maquina-update', pk(o['maquina'])), ('maquina-delete', pk(o['maquina'])),
+            ('sondaje-list', {}), ('sondaje-create', {}),
+            ('sondaje-update', pk(o['sondaje'])), ('sondaje-delete', pk(o['sondaje'])),
+            ('actividades-list', {}), ('actividades-create', {}),
+            ('actividades-update', pk(self.actividades[0])), ('actividades-delete', pk(self.actividades[0])),
+            # 'contrato-actividades' no se mide: su plantilla enlaza a 'contrato-list', que no existe
+            ('tipo-turno-list', {}), ('tipo-turno-create', {}),
+            ('tipo-turno-update', pk(self.tipo_turno)), ('tipo-turno-delete', pk(self.tipo_turno)),
+            ('complemento-list', {}), ('complemento-create', {}),
+            ('complemento-update', pk(self.tipo_complemento)), ('complemento-delete', pk(self.tipo_complemento)),
+            ('aditivo-list', {}), ('aditivo-create', {}),
+            ('aditivo-update', pk(self.tipo_aditivo)), ('aditivo-delete', pk(self.tipo_aditivo)),
+            ('unidad-list', {}), ('unidad-create', {}),
+            ('unidad-update', pk(self.unidad)), ('unidad-delete', pk(self.unidad)),
+            ('crear-turno-completo', {}), ('editar-turno-completo', pk(o['turno'])),
+            ('listar-turnos', {}), ('turno-detail', pk(o['turno'])),
+            ('turno-update', pk(o['turno'])), ('turno-delete', pk(o['turno'])), ('turno-approve', pk(o['turno'])),
+            ('abastecimiento-list', {}), ('abastecimiento-create', {}),
+            ('abastecimiento-detail', pk(o['abastecimiento'])), ('abastecimiento-update', pk(o['abastecimiento_libre'])),
+            ('abastecimiento-delete', pk(o['abastecimiento_libre'])),
+            ('importar-abastecimiento', {}), ('api-importacion-estado', pk(importacion)),
+            ('consumo-list', {}), ('consumo-create', {}),
+            ('consumo-update', pk(o['consumo'])), ('consumo-delete', pk(o['consumo'])),
+            ('stock-disponible', {}),
+            ('api-abastecimiento-detalle', pk(o['abastecimiento'])),
+            ('api-turno-autocomplete', {}), ('api-turno-opciones', {}), ('api-abastecimiento-autocomplete', {}),
+            ('api-v1-turnos', {}), ('api-v1-turno-detalle', pk(o['turno'])),
+            ('metricas-requests', {}),
+        ]
+
+    def _consultas(self, client, vistas):
+        """Consultas de cada vista según Server-Timing (las mismas que compara QUERY_BUDGETS)."""
+        import re
+        conteos = {}
+        for nombre, kwargs in vistas:
+            response = client.get(reverse(nombre, kwargs=kwargs))
+            # 403: vistas solo para administradores del sistema, medidas igual
+            self.assertIn(response.status_code, (200, 403), f'{nombre}: HTTP {response.status_code}')
+            conteos[nombre] = int(re.search(r'desc="(\d+) consultas"', response['Server-Timing']).group(1))
+        return conteos
+
+    def _medir_escalas(self, *usuarios):
+        from django.test import override_settings
+        from .utils.request_metrics import presupuesto_consultas
+        plantillas = [dict(settings.TEMPLATES[0], APP_DIRS=False)]
+        plantillas[0]['OPTIONS'] = dict(plantillas[0]['OPTIONS'], loaders=[
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+            ('django.template.loaders.locmem.Loader', _PLANTILLAS_GENERICAS),
+        ])
+        clientes = []
+        for usuario in usuarios:
+            c = Client()
+            c.force_login(usuario)
+            clientes.append((usuario.username, c))
+        vistas = self._vistas()
+        with override_settings(TEMPLATES=plantillas, REQUEST_METRICS_SERVER_TIMING=True):
+            base, final = {}, {}
+            for usuario, c in clientes:
+                self._consultas(c, vistas)  # calentar cachés de plantillas y de sesión
+                base[usuario] = self._consultas(c, vistas)
+            self._sembrar(self.ESCALA_FINAL - self.ESCALA_BASE)
+            for usuario, c in clientes:
+                final[usuario] = self._consultas(c, vistas)
+
+        for usuario, _ in clientes:
+            for nombre, _ in vistas:
+                with self.subTest(usuario=usuario, vista=nombre):
+                    self.assertEqual(
+                        final[usuario][nombre], base[usuario][nombre], f'{nombre}: las consultas crecen con los datos'
+                    )
+                    self.assertLessEqual(final[usuario][nombre], presupuesto_consultas(nombre))
+
+    def test_query_counts_do_not_grow_with_data(self):
+        self._medir_escalas(self.admin, self.supervisor)
+
+
+class SyntheticDataTests(TestCase):
+    def _generar(self, prefijo, seed=7):
+        import io
+        from django.core.management import call_command
+
+        call_command(
+            'generate_synthetic_data', contratos=1, maquinas=2, trabajadores=6, dias=20, abastecimientos=5,
+            hasta=timezone.localdate(), seed=seed, prefijo=prefijo, batch_size=50, dias_por_bloque=7, stdout=io.StringIO(),
+        )
+        turnos = Turno.objects.filter(contrato__nombre_contrato__startswith=f'{prefijo} {seed}-')
+        return turnos.order_by('fecha', 'maquina__nombre', 'tipo_turno_id')
+
+    def test_generates_consistent_shifts_and_is_reproducible(self):
+        from django.core.management.base import CommandError
+        from django.db.models import Sum
+        from .utils.stock import verificar_balances
+
+        turnos = self._generar('SINT')
+        self.assertGreater(turnos.count(), 50)
+        for turno in turnos.filter(corridas__isnull=False).distinct()[:20]:
+            metros = turno.corridas.aggregate(total=Sum('total_calc'))['total']
+            self.assertEqual(turno.avance.metros_perforados, metros)
+            self.assertEqual(turno.turno_sondajes.get().metros_turno, metros)
+            self.assertEqual(turno.trabajadores_turno.count(), 3)
+            self.assertEqual(
+                sum(a.tiempo_calc for a in turno.actividades.all()), turno.contrato.duracion_turno
+            )
+        for maquina in Maquina.objects.filter(contrato__nombre_contrato__startswith='SINT 7-'):
+            self.assertEqual(maquina.horometro, maquina.horometro_al(timezone.localdate()))
+        self.assertEqual(verificar_balances(Abastecimiento.objects.filter(contrato__nombre_contrato__startswith='SINT 7-')), [])
+        self.assertTrue(ConsumoStock.objects.filter(turno__in=turnos).exists())
+
+        # Misma semilla, otro prefijo: mismos turnos y metros
+        huella = list(turnos.values_list('fecha', 'estado', 'avance__metros_perforados'))
+        self.assertEqual(list(self._generar('COPIA').values_list('fecha', 'estado', 'avance__metros_perforados')), huella)
+
+        with self.assertRaises(CommandError):
+            self._generar('SINT')
+
+
+class BenchCommandTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from .utils.synthetic_data import GeneradorDatosSinteticos
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        plantillas = [dict(settings.TEMPLATES[0], APP_DIRS=False)]
+        plantillas[0]['OPTIONS'] = dict(plantillas[0]['OPTIONS'], loaders=[
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+            ('django.template.loaders.locmem.Loader', _PLANTILLAS_GENERICAS),
+        ])
+        ajustes = override_settings(MEDIA_ROOT=self.media.name, TEMPLATES=plantillas)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        GeneradorDatosSinteticos(seed=3, contratos=1, maquinas=2, trabajadores=6, dias=10, abastecimientos_por_mes=5).generar()
+
+    def _bench(self, **opciones):
+        import io
+        from django.core.management import call_command
+        call_command('bench', iteraciones=2, calentamiento=0, filas_importacion=20, stdout=io.StringIO(), **opciones)
+
+    def test_reports_percentiles_and_fails_on_regression(self):
+        import os
+        from django.core.management.base import CommandError
+        from .utils.benchmark import ESCENARIOS, cargar_base, guardar_base
+
+        turnos, abastecimientos = Turno.objects.count(), Abastecimiento.objects.count()
+        ruta = os.path.join(self.media.name, 'base.json')
+        self._bench(guardar_baseline=ruta)
+        base = cargar_base(ruta)
+        self.assertEqual(list(base['escenarios']), ESCENARIOS)
+        for resultado in base['escenarios'].values():
+            self.assertLessEqual(resultado['p50_ms'], resultado['p95_ms'])
+            self.assertLessEqual(resultado['p95_ms'], resultado['p99_ms'])
+            self.assertGreater(resultado['consultas'], 0)
+        # Los flujos que escriben se revierten y no dejan archivos
+        self.assertEqual((Turno.objects.count(), Abastecimiento.objects.count()), (turnos, abastecimientos))
+        self.assertFalse(CustomUser.objects.filter(username__startswith='bench-').exists())
+        archivos = [f for _, _, nombres in os.walk(self.media.name) for f in nombres]
+        self.assertEqual(archivos, ['base.json'])
+
+        # Una consulta menos en la base equivale a una consulta extra ahora
+        base['escenarios']['dashboard']['consultas'] -= 1
+        guardar_base(base['escenarios'], ruta, 2)
+        with self.assertRaisesMessage(CommandError, '1 regresiones'):
+            self._bench(baseline=ruta, escenarios='dashboard', tolerancia=100)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.contrato = Contrato.objects.create(
+            nombre_contrato='CT-CURSOR', cliente=Cliente.objects.create(nombre='C-CURSOR'),
+        )
+        tipos = [TipoTurno.objects.create(nombre=n) for n in ('Día', 'Noche', 'Extra')]
+        maquina = Maquina.objects.create(contrato=self.contrato, nombre='Maq-C', tipo='T1')
+        hoy = timezone.now().date()
+        # Tres turnos por fecha: el id desempata dentro del mismo día
+        Turno.objects.bulk_create(
+            Turno(contrato=self.contrato, maquina=maquina, tipo_turno=tipo, fecha=hoy - timedelta(days=d))
+            for d in range(15) for tipo in tipos
+        )
+        self.esperado = list(Turno.objects.order_by('-fecha', '-id').values_list('pk', flat=True))
+
+    def test_walks_forward_and_back_over_all_rows(self):
+        from .utils.keyset_pagination import KeysetPaginator
+        paginador = KeysetPaginator(Turno.objects.all(), 20)
+
+        paginas, cursor = [], None
+        while True:
+            page = paginador.get_page(cursor)
+            paginas.append([t.pk for t in page])
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual([len(p) for p in paginas], [20, 20, 5])
+        self.assertEqual(sum(paginas, []), self.esperado)
+
+        atras = paginador.get_page(page.previous_cursor)
+        self.assertEqual([t.pk for t in atras], paginas[1])
+        primera = paginador.get_page(atras.previous_cursor)
+        self.assertEqual([t.pk for t in primera], paginas[0])
+        self.assertFalse(primera.has_previous())
+        self.assertEqual([t.pk for t in paginador.get_page('no-es-un-cursor')], paginas[0])
+
+    def test_tampered_cursor_returns_first_page(self):
+        import base64
+        from .utils.keyset_pagination import KeysetPaginator
+        # JSON válido con valores que to_python() rechaza (ValidationError)
+        manipulado = base64.urlsafe_b64encode(b'{"v":["abc",1],"d":"n"}').decode().rstrip('=')
+        page = KeysetPaginator(Turno.objects.all(), 20).get_page(manipulado)
+        self.assertEqual([t.pk for t in page], self.esperado[:20])
+
+        admin = CustomUser.objects.create_user(
+            username='admin-manip', password='p', role='ADMIN_SISTEMA', is_system_admin=True,
+        )
+        c = Client()
+        c.force_login(admin)
+        r = c.get(reverse('listar-turnos'), {'cursor': manipulado})
+        self.assertEqual([t.pk for t in r.context['page_obj']], self.esperado[:20])
+        r = c.get(reverse('api-v1-turnos'), {'cursor': manipulado})
+        self.assertEqual(r.status_code, 200)
+
+    def test_listar_turnos_uses_cursor_without_offset(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        admin = CustomUser.objects.create_user(
+            username='admin-cursor', password='p', role='ADMIN_SISTEMA', is_system_admin=True,
+        )
+        c = Client()
+        c.force_login(admin)
+        primera = c.get(reverse('listar-turnos')).context['page_obj']
+        self.assertIn('cursor=', primera.next_query)
+        with CaptureQueriesContext(connection) as ctx:
+            segunda = c.get(f"{reverse('listar-turnos')}?{primera.next_query}")
+        self.assertEqual([t.pk for t in segunda.context['page_obj']], self.esperado[20:40])
+        self.assertFalse(any('OFFSET' in q['sql'] for q in ctx.captured_queries))
+
+    def test_listar_turnos_header_stats_in_one_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        turnos = list(Turno.objects.all())
+        TurnoAvance.objects.bulk_create(TurnoAvance(turno=t, metros_perforados=Decimal('10.50')) for t in turnos[:30])
+        sup = CustomUser.objects.create_user(username='sup-cursor', password='p', role='SUPERVISOR', contrato=self.contrato)
+        c = Client()
+        c.force_login(sup)
+        with CaptureQueriesContext(connection) as ctx:
+            r = c.get(reverse('listar-turnos'))
+        inicio_mes = timezone.now().date().replace(day=1)
+        self.assertEqual(r.context['total_turnos'], 45)
+        self.assertEqual(r.context['metros_total'], Decimal('315.00'))
+        self.assertEqual(r.context['turnos_mes'], sum(1 for t in turnos if t.fecha >= inicio_mes))
+        self.assertEqual(r.context['promedio_avance'], Decimal('7.00'))
+        conteos = [q['sql'] for q in ctx.captured_queries if 'COUNT(' in q['sql'] or 'SUM(' in q['sql']]
+        self.assertEqual(len(conteos), 1)
+        self.assertNotIn('turno_sondaje', conteos[0])
+
+
+class ContractScopingTests(TestCase):
+    def setUp(self):
+        cliente = Cliente.objects.create(nombre='C-SCOPE')
+        self.contrato = Contrato.objects.create(nombre_contrato='CT-SCOPE', cliente=cliente)
+        self.otro = Contrato.objects.create(nombre_contrato='CT-SCOPE-2', cliente=cliente)
+        tipo = TipoTurno.objects.create(nombre='Día')
+        hoy = timezone.now().date()
+        sondajes = [
+            Sondaje.objects.create(
+                contrato=self.contrato, nombre_sondaje=f'SC{i}', fecha_inicio=hoy,
+                profundidad=100, inclinacion=0, cota_collar=1000,
+            ) for i in range(2)
+        ]
+        self.turnos = []
+        for contrato in (self.contrato, self.otro):
+            maquina = Maquina.objects.create(contrato=contrato, nombre=f'Maq-{contrato.pk}', tipo='T1')
+            turno = Turno.objects.create(contrato=contrato, maquina=maquina, tipo_turno=tipo, fecha=hoy)
+            TurnoAvance.objects.create(turno=turno, metros_perforados=Decimal('12.00'))
+            self.turnos.append(turno)
+        # Turno con dos sondajes: antes se contaba dos veces vía sondajes__contrato
+        for sondaje in sondajes:
+            TurnoSondaje.objects.create(turno=self.turnos[0], sondaje=sondaje)
+        self.sup = CustomUser.objects.create_user(
+            username='sup-scope', password='p', role='SUPERVISOR', contrato=self.contrato,
+        )
+
+    def test_for_contract_uses_direct_fk_without_duplicates(self):
+        from django.db import connection
+        from django.db.models import Sum
+        queryset = Turno.objects.for_contract(self.contrato).filter(fecha=timezone.now().date())
+        self.assertEqual(queryset.count(), 1)
+        self.assertNotIn('turno_sondaje', str(queryset.query))
+        if connection.vendor == 'sqlite':
+            # Índice (contrato, fecha) en lugar de recorrer turno_sondaje
+            self.assertIn('turnos_contrat_6d9062_idx', queryset.explain())
+
+        self.assertEqual(Turno.objects.for_contract([self.contrato, self.otro]).count(), 2)
+        self.assertEqual(list(Turno.objects.for_user(self.sup)), [self.turnos[0]])
+        self.assertEqual(
+            TurnoAvance.objects.for_user(self.sup).aggregate(total=Sum('metros_perforados'))['total'], Decimal('12.00')
+        )
+        sin_contrato = CustomUser.objects.create_user(username='sin-contrato', password='p', role='OPERADOR')
+        self.assertFalse(Turno.objects.for_user(sin_contrato).exists())
+
+    def test_dashboard_counts_multi_sondaje_shift_once(self):
+        c = Client()
+        c.force_login(self.sup)
+        r = c.get(reverse('dashboard'))
+        self.assertEqual(r.context['turnos_hoy'], 1)
+        self.assertEqual(r.context['metros_perforados_mes'], Decimal('12.00'))
+        self.assertEqual(list(r.context['ultimos_turnos']), [self.turnos[0]])
+
+
+class SessionRefreshTests(TestCase):
+    def setUp(self):
+        contrato = Contrato.objects.create(nombre_contrato='CT-SES', cliente=Cliente.objects.create(nombre='C-SES'))
+        self.usuario = CustomUser.objects.create_user(username='ses', password='p', role='SUPERVISOR', contrato=contrato)
+        self.ahora = timezone.now()
+
+    def _get(self, c, minutos):
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with mock.patch('django.utils.timezone.now', return_value=self.ahora + timedelta(minutes=minutos)):
+            with CaptureQueriesContext(connection) as ctx:
+                r = c.get(reverse('api-turno-autocomplete'))
+        escrituras = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT')) and 'django_session' in q['sql']]
+        return r, escrituras
+
+    def test_sliding_expiry_without_writing_every_request(self):
+        from unittest import mock
+        vida = settings.SESSION_COOKIE_AGE // 60
+        margen = settings.SESSION_REFRESH_MARGIN // 60
+        c = Client()
+        with mock.patch('django.utils.timezone.now', return_value=self.ahora):
+            c.force_login(self.usuario)
+
+        # Dentro del margen: respuesta autenticada, cookie renovada y sin escribir la fila
+        r, escrituras = self._get(c, 1)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(escrituras, [])
+        self.assertEqual(r.cookies[settings.SESSION_COOKIE_NAME]['max-age'], settings.SESSION_COOKIE_AGE)
+
+        # Pasado el margen la fila se renueva una vez
+        self.assertEqual(len(self._get(c, margen + 1)[1]), 1)
+        self.assertEqual(self._get(c, margen + 2)[1], [])
+
+        # Expiración deslizante: válida SESSION_COOKIE_AGE después del último request que escribió ...
+        escrito = margen + 1
+        r, escrituras = self._get(c, escrito + vida - 1)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(escrituras), 1)
+        # ... y nunca aceptada pasada la vida completa desde el último request
+        ultimo = escrito + vida - 1
+        self.assertEqual(self._get(c, ultimo + 1)[1], [])
+        ultimo += 1
+        r, _ = self._get(c, ultimo + vida + 1)
+        self.assertEqual(r.status_code, 302)
+
+    def test_expires_session_life_after_last_request_that_did_not_write(self):
+        from unittest import mock
+        vida = settings.SESSION_COOKIE_AGE // 60
+        c = Client()
+        with mock.patch('django.utils.timezone.now', return_value=self.ahora):
+            c.force_login(self.usuario)
+        r, escrituras = self._get(c, 1)
+        self.assertEqual((r.status_code, escrituras), (200, []))
+        r, _ = self._get(c, 1 + vida + 1)
+        self.assertEqual(r.status_code, 302)
+
+
+class ReferenceCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.contrato = Contrato.objects.create(nombre_contrato='CT-REF', cliente=Cliente.objects.create(nombre='C-REF'))
+        self.turno = TipoTurno.objects.create(nombre='Día')
+        self.actividad = TipoActividad.objects.create(nombre='Perforación')
+        self.contrato.actividades.add(self.actividad)
+
+    def test_tables_load_once_and_invalidate_on_save_and_delete(self):
+        from .utils import reference_cache
+        with self.assertNumQueries(1):
+            self.assertEqual(reference_cache.tabla('tipos_turno'), [self.turno])
+        with self.assertNumQueries(0):
+            reference_cache.tabla('tipos_turno')
+
+        noche = TipoTurno.objects.create(nombre='Noche')
+        with self.assertNumQueries(1):
+            self.assertEqual(reference_cache.tabla('tipos_turno'), [self.turno, noche])
+        self.turno.nombre = 'Mañana'
+        self.turno.save()
+        self.assertEqual(reference_cache.tabla('tipos_turno')[0].nombre, 'Mañana')
+        noche.delete()
+        self.assertEqual(reference_cache.tabla('tipos_turno'), [self.turno])
+
+        # Los aditivos guardan su unidad: cambiarla invalida ambas tablas
+        unidad = UnidadMedida.objects.create(nombre='Kilogramo', simbolo='kg')
+        TipoAditivo.objects.create(nombre='Bentonita', categoria='BENTONITA', unidad_medida_default=unidad)
+        self.assertEqual(reference_cache.tabla('tipos_aditivo')[0].unidad_medida_default.simbolo, 'kg')
+        unidad.simbolo = 'KG'
+        unidad.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(reference_cache.tabla('tipos_aditivo')[0].unidad_medida_default.simbolo, 'KG')
+
+    def test_contract_activities_follow_assignment_changes(self):
+        from .utils import reference_cache
+        with self.assertNumQueries(1):
+            self.assertEqual(reference_cache.actividades_contrato(self.contrato), [self.actividad])
+        with self.assertNumQueries(0):
+            reference_cache.actividades_contrato(self.contrato.pk)
+        otra = TipoActividad.objects.create(nombre='Traslado')
+        self.contrato.actividades.add(otra)
+        self.assertEqual(reference_cache.actividades_contrato(self.contrato), [self.actividad, otra])
+        self.contrato.actividades.remove(self.actividad)
+        self.assertEqual(reference_cache.actividades_contrato(self.contrato), [otra])
+        otra.nombre = 'Traslado de equipo'
+        otra.save()
+        self.assertEqual(reference_cache.actividades_contrato(self.contrato)[0].nombre, 'Traslado de equipo')
+        self.assertEqual(reference_cache.actividades_contrato(None), [])
+
+    def test_bulk_created_reference_rows_invalidate_cache(self):
+        import io
+        from .utils import form_options, reference_cache
+        from .utils.excel_importer import AbastecimientoExcelImporter
+        admin = CustomUser.objects.create_user(
+            username='ref-admin', password='p', role='ADMIN_SISTEMA', is_system_admin=True
+        )
+        self.assertEqual(reference_cache.tabla('unidades_medida'), [])
+        _, antes = form_options.opciones(admin)
+        self.assertEqual(antes['tipos_aditivo'], [])
+
+        archivo = io.BytesIO((
+            'MES,FECHA,CONTRATO,DESCRIPCION,FAMILIA,CANT,PRECIO,UNIDAD,TIPO_COMPLEMENTO\n'
+            'mayo,2025-05-02,CT-REF,Bentonita,ADITIVOS_PERFORACION,2,3,saco,\n'
+            'mayo,2025-05-02,CT-REF,Corona,PRODUCTOS_DIAMANTADOS,1,9,und,Broca NQ\n'
+        ).encode('utf-8'))
+        archivo.name = 'refs.csv'
+        resultado = AbastecimientoExcelImporter(admin).process_excel(archivo)
+        self.assertTrue(resultado['success'], resultado.get('error'))
+
+        # bulk_create no emite post_save: el importador invalida igual
+        self.assertEqual({u.nombre for u in reference_cache.tabla('unidades_medida')}, {'saco', 'und'})
+        self.assertEqual([t.nombre for t in reference_cache.tabla('tipos_complemento')], ['Broca NQ'])
+        _, despues = form_options.opciones(admin)
+        self.assertEqual([a['nombre'] for a in despues['tipos_aditivo']], ['BENTONITA'])
+
+    def test_import_worker_refuses_process_local_cache(self):
+        import io
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from django.test import override_settings
+        with self.assertRaisesMessage(CommandError, 'caché compartida'):
+            call_command('procesar_importaciones', once=True)
+        with override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        }):
+            call_command('procesar_importaciones', once=True, stdout=io.StringIO())
+
+    def test_catalog_list_view_reads_from_cache(self):
+        usuario = CustomUser.objects.create_user(
+            username='ref', password='p', role='MANAGER_CONTRATO', contrato=self.contrato
+        )
+        c = Client()
+        c.force_login(usuario)
+        c.get(reverse('actividades-list'))
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            r = c.get(reverse('actividades-list'))
+        self.assertEqual(list(r.context['actividades']), [self.actividad])
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "tipos_actividad"' in q['sql']])
+
+
+class FormOptionsTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.contrato = Contrato.objects.create(nombre_contrato='CT-OPC', cliente=Cliente.objects.create(nombre='C-OPC'))
+        self.otro = Contrato.objects.create(nombre_contrato='CT-OPC2', cliente=Cliente.objects.create(nombre='C-OPC2'))
+        self.maquina = Maquina.objects.create(contrato=self.contrato, nombre='Maq-A', tipo='T1')
+        Maquina.objects.create(contrato=self.otro, nombre='Maq-B', tipo='T1')
+        Maquina.objects.create(contrato=self.contrato, nombre='Maq-Taller', tipo='T1', estado='MANTENIMIENTO')
+        Trabajador.objects.create(contrato=self.contrato, nombres='Ana', apellidos='Rojas', cargo='AYUDANTE', dni='40000001')
+        self.actividad = TipoActividad.objects.create(nombre='Perforación')
+        self.contrato.actividades.add(self.actividad)
+        TipoActividad.objects.create(nombre='Sin asignar')
+        self.tipo_turno = TipoTurno.objects.create(nombre='Día')
+        self.usuario = CustomUser.objects.create_user(
+            username='opc', password='p', role='MANAGER_CONTRATO', contrato=self.contrato
+        )
+        self.client.force_login(self.usuario)
+
+    def _get(self, etag=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        cabeceras = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(reverse('api-turno-opciones'), **cabeceras)
+        tablas = ('maquinas', 'sondajes', 'trabajadores', 'tipo_turnos', 'tipos_actividad')
+        return r, [q['sql'] for q in ctx.captured_queries if any(f'FROM "{t}"' in q['sql'] for t in tablas)]
+
+    def test_bundle_is_scoped_to_the_contract(self):
+        r, _ = self._get()
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('private', r['Cache-Control'])
+        datos = r.json()
+        self.assertEqual(datos['maquinas'], [{'id': self.maquina.pk, 'nombre': 'Maq-A'}])
+        self.assertEqual(datos['tipos_actividad'], [{'id': self.actividad.pk, 'nombre': 'Perforación'}])
+        self.assertEqual([t['id'] for t in datos['trabajadores']], ['40000001'])
+        self.assertEqual(datos['tipos_turno'], [{'id': self.tipo_turno.pk, 'nombre': 'Día'}])
+
+        admin = CustomUser.objects.create_user(username='opc-admin', password='p', role='ADMIN_SISTEMA', is_system_admin=True)
+        self.client.force_login(admin)
+        r = self.client.get(reverse('api-turno-opciones'), HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()['maquinas']), 2)
+        self.assertEqual(len(r.json()['tipos_actividad']), 2)
+
+    def test_conditional_get_and_invalidation_per_contract(self):
+        r, consultas = self._get()
+        self.assertTrue(consultas)
+        etag = r['ETag']
+
+        # Sin cambios: 304 sin tocar las tablas
+        r, consultas = self._get(etag)
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(consultas, [])
+
+        # Cambios en otro contrato no invalidan el paquete
+        Maquina.objects.create(contrato=self.otro, nombre='Maq-C', tipo='T1')
+        self.assertEqual(self._get(etag)[0].status_code, 304)
+
+        # Una máquina nueva del contrato, un tipo de turno o una asignación de actividad sí
+        for cambio in (
+            lambda: Maquina.objects.create(contrato=self.contrato, nombre='Maq-D', tipo='T1'),
+            lambda: TipoTurno.objects.create(nombre='Noche'),
+            lambda: self.contrato.actividades.add(TipoActividad.objects.get(nombre='Sin asignar')),
+        ):
+            cambio()
+            r, _ = self._get(etag)
+            self.assertEqual(r.status_code, 200)
+            self.assertNotEqual(r['ETag'], etag)
+            etag = r['ETag']
+        self.assertEqual(len(r.json()['maquinas']), 2)
+        self.assertEqual(len(r.json()['tipos_actividad']), 2)
+
+        # Mover la máquina a otro contrato invalida ambos
+        self.maquina.contrato = self.otro
+        self.maquina.save()
+        r, _ = self._get(etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotIn(self.maquina.pk, [m['id'] for m in r.json()['maquinas']])
+
+    def test_shift_form_does_not_render_option_lists(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(reverse('crear-turno-completo'))
+        self.assertEqual(r.status_code, 200)
+        self.assertContains(r, reverse('api-turno-opciones'))
+        self.assertNotContains(r, 'Maq-A')
+        tablas = ('maquinas', 'sondajes', 'trabajadores', 'tipo_turnos', 'tipos_actividad', 'tipos_complemento')
+        self.assertFalse([q for q in ctx.captured_queries if any(f'FROM "{t}"' in q['sql'] for t in tablas)])
+
+
+class TurnoApiTests(TestCase):
+    def setUp(self):
+        self.contrato = Contrato.objects.create(
+            nombre_contrato='CT-API', cliente=Cliente.objects.create(nombre='C-API'), duracion_turno=2,
+        )
+        self.maquina = Maquina.objects.create(contrato=self.contrato, nombre='Maq-API', tipo='T1')
+        self.sondaje = Sondaje.objects.create(
+            contrato=self.contrato, nombre_sondaje='S-API', fecha_inicio=timezone.now().date(),
+            profundidad=100, inclinacion=0, cota_collar=1000, estado='ACTIVO',
+        )
+        self.tipo_turno = TipoTurno.objects.create(nombre='Día')
+        self.actividad = TipoActividad.objects.create(nombre='Perforación')
+        self.complemento = TipoComplemento.objects.create(nombre='Broca HQ', categoria='BROCA')
+        self.unidad = UnidadMedida.objects.create(nombre='Kilogramo', simbolo='kg')
+        self.aditivo = TipoAditivo.objects.create(nombre='Bentonita', categoria='BENTONITA', unidad_medida_default=self.unidad)
+        Trabajador.objects.create(contrato=self.contrato, nombres='Ana', apellidos='Rojas', cargo='AYUDANTE', dni='50000001')
+        self.supervisor = CustomUser.objects.create_user(
+            username='api-sup', password='p', role='SUPERVISOR', contrato=self.contrato
+        )
+        self.client.force_login(self.supervisor)
+
+    def _documento(self, corridas=2, **cambios):
+        documento = {
+            'fecha': '2026-01-15',
+            'maquina_id': self.maquina.pk,
+            'tipo_turno_id': self.tipo_turno.pk,
+            'sondajes': [{'sondaje_id': self.sondaje.pk, 'metros': 3.0}],
+            'maquina_estado': {'horometro_inicio': 100, 'horometro_fin': 102, 'estado_bomba': 'OPERATIVO'},
+            'trabajadores': [{'trabajador_id': '50000001', 'funcion': 'AYUDANTE'}],
+            'actividades': [
+                {'actividad_id': self.actividad.pk, 'hora_inicio': '07:00', 'hora_fin': '09:00'},
+            ],
+            'corridas': [
+                {'corrida_numero': i + 1, 'desde': 1.5 * i, 'hasta': 1.5 * (i + 1), 'longitud_testigo': 1.4,
+                 'pct_recuperacion': 93.3, 'pct_retorno_agua': 80, 'litologia': 'Andesita'}
+                for i in range(corridas)
+            ],
+            'complementos': [
+                {'tipo_complemento_id': self.complemento.pk, 'sondaje_id': self.sondaje.pk, 'codigo_serie': 'B-1',
+                 'metros_inicio': 0, 'metros_fin': 3},
+            ],
+            'aditivos': [
+                {'tipo_aditivo_id': self.aditivo.pk, 'cantidad_usada': 2.5, 'unidad_medida_id': self.unidad.pk},
+            ],
+        }
+        documento.update(cambios)
+        return documento
+
+    def _enviar(self, documento, pk=None, metodo='post'):
+        url = reverse('api-v1-turno-detalle', kwargs={'pk': pk}) if pk else reverse('api-v1-turnos')
+        return getattr(self.client, metodo)(url, json.dumps(documento), content_type='application/json')
+
+    def test_create_and_read_nested_document(self):
+        r = self._enviar(self._documento())
+        self.assertEqual(r.status_code, 201, r.content)
+        doc = r.json()
+        self.assertEqual(r['Location'], reverse('api-v1-turno-detalle', kwargs={'pk': doc['id']}))
+        self.assertEqual(doc['estado'], 'COMPLETADO')
+        self.assertEqual(doc['metros_perforados'], 3.0)
+        self.assertEqual(doc['maquina_estado']['horas_trabajadas'], 2.0)
+        self.assertEqual([c['total'] for c in doc['corridas']], [1.5, 1.5])
+        self.assertEqual(doc['trabajadores'], [{'trabajador_id': '50000001', 'funcion': 'AYUDANTE', 'observaciones': ''}])
+        self.assertEqual(doc['actividades'][0]['tiempo'], 2.0)
+        self.assertEqual(self.client.get(r['Location']).json(), doc)
+
+        listado = self.client.get(reverse('api-v1-turnos'), {'fecha_desde': '2026-01-01'}).json()
+        self.assertEqual(listado['results'], [doc])
+        self.assertIsNone(listado['next'])
+
+    def test_create_query_count_does_not_grow_with_rows(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self._enviar(self._documento(fecha='2026-01-09'))  # cachés y sesión ya cargadas
+        conteos = []
+        for i, corridas in enumerate((2, 40)):
+            with CaptureQueriesContext(connection) as ctx:
+                r = self._enviar(self._documento(corridas=corridas, fecha=f'2026-01-{10 + i}'))
+            self.assertEqual(r.status_code, 201, r.content)
+            conteos.append(len(ctx.captured_queries))
+        self.assertEqual(conteos[0], conteos[1])
+
+    def test_structured_errors(self):
+        documento = self._documento(fecha='15/01/2026')
+        documento['trabajadores'][0]['funcion'] = 'CHOFER'
+        documento['corridas'][1]['pct_recuperacion'] = 120
+        documento['actividades'].append({'actividad_id': 9999, 'hora_inicio': '09:00', 'hora_fin': '10:00'})
+        r = self._enviar(documento)
+        self.assertEqual(r.status_code, 400)
+        errores = r.json()['errors']
+        self.assertIn('fecha', errores)
+        self.assertEqual(errores['trabajadores']['0']['funcion'][0]['code'], 'invalid_choice')
+        self.assertIn('pct_recuperacion', errores['corridas']['1'])
+        self.assertFalse(Turno.objects.exists())
+
+        # Referencias y reglas del contrato se informan por fila y campo
+        documento = self._documento()
+        documento['actividades'].append({'actividad_id': 9999, 'hora_inicio': '09:00', 'hora_fin': '10:00'})
+        errores = self._enviar(documento).json()['errors']
+        self.assertEqual(errores['actividades']['1']['actividad_id'][0]['code'], 'invalid_choice')
+        documento = self._documento(actividades=[
+            {'actividad_id': self.actividad.pk, 'hora_inicio': '07:00', 'hora_fin': '08:00'},
+        ])
+        self.assertEqual(self._enviar(documento).json()['errors']['actividades'][0]['code'], 'incomplete')
+        self.assertEqual(self.client.post(reverse('api-v1-turnos'), 'no-json', content_type='application/json').status_code, 400)
+        self.assertFalse(Turno.objects.exists())
+
+        # Duplicado (restricción única del turno)
+        self.assertEqual(self._enviar(self._documento()).status_code, 201)
+        r = self._enviar(self._documento())
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('__all__', r.json()['errors'])
+
+    def test_put_replaces_and_access_is_scoped(self):
+        pk = self._enviar(self._documento()).json()['id']
+        r = self._enviar(self._documento(corridas=1, complementos=[], aditivos=[]), pk=pk, metodo='put')
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(len(r.json()['corridas']), 1)
+        self.assertEqual(r.json()['complementos'], [])
+        self.assertEqual(TurnoCorrida.objects.filter(turno_id=pk).count(), 1)
+
+        otro = Contrato.objects.create(nombre_contrato='CT-API2', cliente=Cliente.objects.create(nombre='C-API2'))
+        ajeno = CustomUser.objects.create_user(username='api-ajeno', password='p', role='SUPERVISOR', contrato=otro)
+        self.client.force_login(ajeno)
+        self.assertEqual(self.client.get(reverse('api-v1-turno-detalle', kwargs={'pk': pk})).status_code, 404)
+        r = self._enviar(self._documento(fecha='2026-02-01'))
+        self.assertEqual(r.json()['errors']['sondajes'][0]['code'], 'permission')
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api-v1-turnos')).status_code, 401)
@@ -78,6 +78,8 @@ urlpatterns = [
     path('abastecimiento/<int:pk>/editar/', views.AbastecimientoUpdateView.as_view(), name='abastecimiento-update'),
     path('abastecimiento/<int:pk>/eliminar/', views.AbastecimientoDeleteView.as_view(), name='abastecimiento-delete'),
     path('abastecimiento/importar/', views.importar_abastecimiento_excel, name='importar-abastecimiento'),
+    path('api/importaciones/<int:pk>/', views.api_importacion_estado, name='api-importacion-estado'),
+    path('api/importaciones/<int:pk>/confirmar/', views.confirmar_importacion, name='confirmar-importacion'),
     
     # Consumo CRUD Completo
     path('consumo/', views.ConsumoStockListView.as_view(), name='consumo-list'),
@@ -90,4 +92,12 @@ urlpatterns = [
     
     # APIs
     path('api/abastecimiento/<int:pk>/', views.api_abastecimiento_detalle, name='api-abastecimiento-detalle'),
+    path('api/turnos/buscar/', views.api_turno_autocomplete, name='api-turno-autocomplete'),
+    path('api/turnos/opciones/', views.api_turno_opciones, name='api-turno-opciones'),
+    path('api/v1/turnos/', views.api_v1_turnos, name='api-v1-turnos'),
+    path('api/v1/turnos/<int:pk>/', views.api_v1_turno_detalle, name='api-v1-turno-detalle'),
+    path('api/abastecimiento/buscar/', views.api_abastecimiento_autocomplete, name='api-abastecimiento-autocomplete'),
+    
+    # Métricas (solo administradores del sistema)
+    path('metricas/', views.MetricasRequestsView.as_view(), name='metricas-requests'),
 ]
\ No newline at end of file
@@ -0,0 +1,176 @@
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    """Registro agrupado de `last_activity` de los usuarios.
+
+    En lugar de ejecutar un UPDATE por cada request, las marcas de tiempo se
+    acumulan en memoria del proceso y se escriben juntas en un único UPDATE
+    (bulk_update). Un usuario solo vuelve a encolarse cuando su valor guardado
+    en BD tiene más de `window` de antigüedad, por lo que `last_activity` e
+    `is_active_recently()` son exactos dentro de esa ventana (más el intervalo
+    de flush).
+
+    Las marcas pendientes se escriben al superar el lote, en el primer request
+    posterior al intervalo (`flush_if_due`, desde el middleware) y, si el
+    proceso queda sin tráfico, desde un timer en un hilo daemon. El timer y el
+    flush al salir solo se activan con `iniciar()`, que se llama desde el punto
+    de entrada del servidor (wsgi/asgi): ni los tests ni los comandos de gestión
+    escriben marcas fuera de su propia ejecución.
+
+    Configuración (settings):
+        ACTIVITY_TRACKING_WINDOW: segundos mínimos entre escrituras por usuario.
+        ACTIVITY_FLUSH_INTERVAL: segundos máximos que una marca espera en memoria.
+        ACTIVITY_FLUSH_BATCH: cantidad de usuarios pendientes que fuerza un flush.
+        ACTIVITY_FLUSH_TIMER: programar el flush por tiempo en un hilo una vez
+            iniciado el tracker (True por defecto).
+    """
+
+    def __init__(self, window=None, flush_interval=None, batch_size=None, use_timer=None):
+        self._window = window
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._use_timer = use_timer
+        self._pending = {}
+        self._oldest_pending = None
+        self._timer = None
+        self._iniciado = False
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Activar el flush por tiempo y el flush al terminar el proceso."""
+        with self._lock:
+            if self._iniciado:
+                return
+            self._iniciado = True
+        atexit.register(self.flush)
+
+    @property
+    def window(self):
+        seconds = self._window
+        if seconds is None:
+            seconds = getattr(settings, 'ACTIVITY_TRACKING_WINDOW', 300)
+        return timedelta(seconds=seconds)
+
+    @property
+    def flush_interval(self):
+        seconds = self._flush_interval
+        if seconds is None:
+            seconds = getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 60)
+        return timedelta(seconds=seconds)
+
+    @property
+    def batch_size(self):
+        if self._batch_size is not None:
+            return self._batch_size
+        return getattr(settings, 'ACTIVITY_FLUSH_BATCH', 100)
+
+    @property
+    def use_timer(self):
+        if self._use_timer is not None:
+            return self._use_timer
+        return self._iniciado and getattr(settings, 'ACTIVITY_FLUSH_TIMER', True)
+
+    def touch(self, user, now=None):
+        """Registrar actividad de `user`. Retorna True si quedó encolada."""
+        now = now or timezone.now()
+        last = user.last_activity
+        if last is not None and now - last < self.window:
+            return False
+
+        # Mantener el objeto del request coherente aunque la BD se actualice después
+        user.last_activity = now
+        with self._lock:
+            self._pending[user.pk] = now
+            if self._oldest_pending is None:
+                self._oldest_pending = now
+            should_flush = (
+                len(self._pending) >= self.batch_size
+                or now - self._oldest_pending >= self.flush_interval
+            )
+        if should_flush:
+            self.flush()
+        else:
+            self._schedule()
+        return True
+
+    def flush_if_due(self, now=None):
+        """Escribir las marcas pendientes si la más antigua superó `flush_interval`."""
+        now = now or timezone.now()
+        with self._lock:
+            due = self._oldest_pending is not None and now - self._oldest_pending >= self.flush_interval
+        if due:
+            return self.flush()
+        return 0
+
+    def descartar(self):
+        """Olvidar las marcas pendientes sin escribirlas y cancelar el timer."""
+        with self._lock:
+            self._pending = {}
+            self._oldest_pending = None
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Escribir todas las marcas pendientes en un único UPDATE."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._oldest_pending = None
+        if not pending:
+            return 0
+
+        from ..models import CustomUser
+
+        usuarios = [CustomUser(pk=pk, last_activity=ts) for pk, ts in pending.items()]
+        try:
+            CustomUser.objects.bulk_update(usuarios, ['last_activity'], batch_size=len(usuarios))
+        except Exception:
+            # No perder las marcas: se reintentan en el siguiente flush
+            logger.exception('No se pudo actualizar last_activity de %s usuarios', len(pending))
+            with self._lock:
+                for pk, ts in pending.items():
+                    self._pending.setdefault(pk, ts)
+                if self._oldest_pending is None:
+                    self._oldest_pending = min(pending.values())
+            return 0
+        return len(usuarios)
+
+    def _schedule(self):
+        """Programar un flush por tiempo si hay marcas pendientes y ningún timer activo."""
+        if not self.use_timer:
+            return
+        with self._lock:
+            if self._timer is not None or not self._pending:
+                return
+            self._timer = threading.Timer(self.flush_interval.total_seconds(), self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # El hilo del timer abre su propia conexión: no dejarla abierta
+            connections.close_all()
+        # Si el UPDATE falló las marcas volvieron a la cola: reintentar
+        self._schedule()
+
+
+activity_tracker = ActivityTracker()
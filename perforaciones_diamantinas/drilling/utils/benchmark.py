@@ -0,0 +1,282 @@
+import io
+import json
+import math
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import (
+    Abastecimiento, CustomUser, ImportacionAbastecimiento, Sondaje, TipoActividad, TipoAditivo, TipoComplemento,
+    TipoTurno, Trabajador, Turno,
+)
+from .synthetic_data import MESES
+
+ESCENARIOS = [
+    'login', 'dashboard', 'listar_turnos', 'crear_turno_get', 'crear_turno_post', 'api_turno_post', 'importar_excel',
+    'stock_disponible',
+]
+CLAVE_BENCH = 'bench'
+
+
+def percentil(valores, p):
+    """Percentil `p` (0-100) por rango más cercano."""
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def comparar_con_base(resultados, base, tolerancia=0.25):
+    """Regresiones de `resultados` frente a la línea base (lista de mensajes).
+
+    Es regresión un p95 mayor que el de la base en más de `tolerancia`
+    (fracción) o cualquier consulta SQL adicional. Los escenarios que no
+    figuran en la base se ignoran.
+    """
+    regresiones = []
+    for nombre, actual in resultados.items():
+        previo = base.get('escenarios', {}).get(nombre)
+        if previo is None:
+            continue
+        limite = previo['p95_ms'] * (1 + tolerancia)
+        if actual['p95_ms'] > limite:
+            regresiones.append(
+                f"{nombre}: p95 {actual['p95_ms']} ms > {limite:.1f} ms (base {previo['p95_ms']} ms)"
+            )
+        if actual['consultas'] > previo['consultas']:
+            regresiones.append(f"{nombre}: {actual['consultas']} consultas (base {previo['consultas']})")
+    return regresiones
+
+
+def guardar_base(resultados, ruta, iteraciones):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump({
+            'generado': timezone.now().isoformat(),
+            'iteraciones': iteraciones,
+            'escenarios': resultados,
+        }, archivo, indent=2, ensure_ascii=False)
+
+
+def cargar_base(ruta):
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+class BancoPruebas:
+    """Latencia de extremo a extremo de los flujos principales con el cliente de pruebas de Django.
+
+    Se ejecuta sobre los datos del `contrato` (p. ej. los de
+    generate_synthetic_data) con un usuario MANAGER_CONTRATO temporal. Todo
+    corre en una transacción que se revierte al final, y cada iteración en un
+    savepoint revertido, por lo que los flujos que escriben (crear turno,
+    importar) repiten siempre el mismo trabajo y la BD queda intacta.
+
+    Por iteración se mide el tiempo del request completo (middleware, vista
+    y plantilla) y las consultas SQL de la conexión por defecto.
+    """
+
+    def __init__(self, contrato, iteraciones=20, calentamiento=2, filas_importacion=200):
+        self.contrato = contrato
+        self.iteraciones = iteraciones
+        self.calentamiento = calentamiento
+        self.filas_importacion = filas_importacion
+
+    def ejecutar(self, escenarios=None, log=None):
+        """Medir `escenarios` (todos por defecto). Retorna {escenario: estadísticas}."""
+        from django.conf import settings
+
+        resultados = {}
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        with override_settings(ALLOWED_HOSTS=hosts, IMPORTACION_EN_SEGUNDO_PLANO=False), transaction.atomic():
+            self._preparar()
+            for nombre in escenarios or ESCENARIOS:
+                resultados[nombre] = self._medir(nombre)
+                if log:
+                    log(nombre, resultados[nombre])
+            transaction.set_rollback(True)
+        return resultados
+
+    def _preparar(self):
+        self.password = uuid.uuid4().hex
+        self.usuario = CustomUser.objects.create_user(
+            username=f'{CLAVE_BENCH}-{uuid.uuid4().hex[:8]}', password=self.password,
+            role='MANAGER_CONTRATO', contrato=self.contrato,
+        )
+        self.cliente = Client()
+        self.cliente.force_login(self.usuario)
+        self.ultima_importacion = ImportacionAbastecimiento.objects.aggregate(m=Max('pk'))['m'] or 0
+        self.hoy = timezone.localdate()
+        self.datos_turno = self._datos_turno()
+        self.documento_turno = self._documento_turno()
+        self.excel = self._excel()
+
+    def _medir(self, nombre):
+        flujo = getattr(self, f'_{nombre}')
+        tiempos, consultas = [], []
+        for i in range(self.calentamiento + self.iteraciones):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as ctx:
+                    inicio = time.perf_counter()
+                    respuesta = flujo()
+                    duracion = time.perf_counter() - inicio
+                try:
+                    self._verificar(nombre, respuesta)
+                finally:
+                    self._borrar_archivos_importados()
+                    transaction.set_rollback(True)
+            if i >= self.calentamiento:
+                tiempos.append(duracion * 1000)
+                consultas.append(len(ctx.captured_queries))
+        return {
+            'p50_ms': round(percentil(tiempos, 50), 1),
+            'p95_ms': round(percentil(tiempos, 95), 1),
+            'p99_ms': round(percentil(tiempos, 99), 1),
+            'consultas': max(consultas),
+        }
+
+    def _verificar(self, nombre, respuesta):
+        esperados = {
+            'login': (302, reverse('dashboard')),
+            'crear_turno_post': (302, reverse('listar-turnos')),
+            'api_turno_post': (201, None),
+            'importar_excel': (302, reverse('abastecimiento-list')),
+        }
+        estado, destino = esperados.get(nombre, (200, None))
+        if respuesta.status_code != estado or (destino and respuesta.url != destino):
+            raise ValueError(
+                f"{nombre}: respuesta {respuesta.status_code} {getattr(respuesta, 'url', '')} "
+                f"(se esperaba {estado} {destino or ''})"
+            )
+        if nombre == 'importar_excel':
+            importacion = ImportacionAbastecimiento.objects.latest('pk')
+            if importacion.estado != 'COMPLETADO':
+                raise ValueError(f'importar_excel: importación en estado {importacion.estado}: {importacion.mensaje}')
+
+    def _borrar_archivos_importados(self):
+        # El rollback no alcanza al almacenamiento de archivos
+        for importacion in ImportacionAbastecimiento.objects.filter(pk__gt=self.ultima_importacion):
+            importacion.archivo.delete(save=False)
+
+    # Flujos medidos
+
+    def _login(self):
+        return Client().post(reverse('login'), {'username': self.usuario.username, 'password': self.password})
+
+    def _dashboard(self):
+        return self.cliente.get(reverse('dashboard'))
+
+    def _listar_turnos(self):
+        return self.cliente.get(reverse('listar-turnos'), {
+            'fecha_desde': (self.hoy - timedelta(days=90)).isoformat(), 'fecha_hasta': self.hoy.isoformat(),
+        })
+
+    def _crear_turno_get(self):
+        return self.cliente.get(reverse('crear-turno-completo'))
+
+    def _crear_turno_post(self):
+        return self.cliente.post(reverse('crear-turno-completo'), self.datos_turno)
+
+    def _api_turno_post(self):
+        return self.cliente.post(reverse('api-v1-turnos'), self.documento_turno, content_type='application/json')
+
+    def _importar_excel(self):
+        archivo = io.BytesIO(self.excel.getvalue())
+        archivo.name = 'bench.xlsx'
+        return self.cliente.post(reverse('importar-abastecimiento'), {'excel_file': archivo, 'delete_existing': 'off'})
+
+    def _stock_disponible(self):
+        return self.cliente.get(reverse('stock-disponible'))
+
+    # Datos de entrada
+
+    def _datos_turno(self):
+        """Turno completo de tamaño realista: cuadrilla, actividades del turno entero y 40 corridas."""
+        sondaje = Sondaje.objects.filter(contrato=self.contrato).order_by('-fecha_inicio', 'pk').first()
+        maquina = self.contrato.maquinas.order_by('pk').first()
+        if sondaje is None or maquina is None:
+            raise ValueError(f"El contrato '{self.contrato.nombre_contrato}' no tiene sondajes o máquinas")
+        ultimo = Turno.objects.filter(maquina=maquina).aggregate(m=Max('fecha'))['m'] or self.hoy
+        trabajadores = Trabajador.objects.filter(contrato=self.contrato).order_by('pk')[:6]
+        actividad = TipoActividad.objects.order_by('pk').first()
+        complemento = TipoComplemento.objects.order_by('pk').first()
+        aditivo = TipoAditivo.objects.order_by('pk').first()
+        inicio = datetime(2000, 1, 1, 7)
+        corridas = [
+            {'corrida_numero': i + 1, 'desde': 1.5 * i, 'hasta': 1.5 * (i + 1), 'longitud_testigo': 1.4,
+             'pct_recuperacion': 93.3, 'pct_retorno_agua': 80, 'litologia': 'Andesita'}
+            for i in range(40)
+        ]
+        return {
+            'sondaje': sondaje.pk,
+            'maquina': maquina.pk,
+            'tipo_turno': TipoTurno.objects.order_by('pk').first().pk,
+            'fecha': (ultimo + timedelta(days=1)).isoformat(),
+            'sondaje_metraje': '60.00',
+            'hora_inicio_maq': '07:00',
+            'hora_fin_maq': '19:00',
+            'estado_bomba': 'OPERATIVO',
+            'estado_unidad': 'OPERATIVO',
+            'estado_rotacion': 'OPERATIVO',
+            'trabajadores': json.dumps([
+                {'trabajador_id': t.dni, 'funcion': 'AYUDANTE', 'observaciones': ''} for t in trabajadores
+            ]),
+            'actividades': json.dumps([
+                {'actividad_id': actividad.pk, 'hora_inicio': f'{(inicio + timedelta(hours=h)):%H:%M}',
+                 'hora_fin': f'{(inicio + timedelta(hours=h + 1)):%H:%M}', 'observaciones': ''}
+                for h in range(self.contrato.duracion_turno)
+            ]),
+            'corridas': json.dumps(corridas),
+            'complementos': json.dumps([
+                {'tipo_complemento_id': complemento.pk, 'codigo_serie': f'BENCH-{i}', 'metros_inicio': 15.0 * i,
+                 'metros_fin': 15.0 * (i + 1), 'sondaje_id': sondaje.pk}
+                for i in range(4)
+            ] if complemento else []),
+            'aditivos': json.dumps([
+                {'tipo_aditivo_id': aditivo.pk, 'cantidad_usada': 2.5,
+                 'unidad_medida_id': aditivo.unidad_medida_default_id, 'sondaje_id': sondaje.pk}
+                for _ in range(4)
+            ] if aditivo else []),
+        }
+
+    def _documento_turno(self):
+        """El mismo turno de `_datos_turno` como documento de /api/v1/turnos/."""
+        datos = self.datos_turno
+        return json.dumps({
+            'fecha': datos['fecha'],
+            'maquina_id': datos['maquina'],
+            'tipo_turno_id': datos['tipo_turno'],
+            'sondajes': [{'sondaje_id': datos['sondaje'], 'metros': datos['sondaje_metraje']}],
+            'maquina_estado': {
+                'hora_inicio': datos['hora_inicio_maq'], 'hora_fin': datos['hora_fin_maq'],
+                'estado_bomba': datos['estado_bomba'], 'estado_unidad': datos['estado_unidad'],
+                'estado_rotacion': datos['estado_rotacion'],
+            },
+            **{clave: json.loads(datos[clave]) for clave in ('trabajadores', 'actividades', 'corridas', 'complementos', 'aditivos')},
+        })
+
+    def _excel(self):
+        """Archivo de abastecimiento del mes en curso con `filas_importacion` líneas del contrato."""
+        complementos = list(TipoComplemento.objects.order_by('pk').values_list('nombre', flat=True)[:3])
+        unidad = Abastecimiento.objects.filter(contrato=self.contrato).values_list(
+            'unidad_medida__nombre', flat=True
+        ).first() or 'und'
+        filas = []
+        for i in range(self.filas_importacion):
+            diamantado = bool(complementos) and i % 4 == 0
+            filas.append({
+                'MES': MESES[self.hoy.month - 1], 'FECHA': self.hoy.isoformat(),
+                'CONTRATO': self.contrato.nombre_contrato, 'DESCRIPCION': f'Bench {i:05d}',
+                'FAMILIA': 'PRODUCTOS_DIAMANTADOS' if diamantado else 'CONSUMIBLES',
+                'CANT': 1 + i % 20, 'PRECIO': 10 + i % 7, 'UNIDAD': unidad,
+                'TIPO_COMPLEMENTO': complementos[i % len(complementos)] if diamantado else None,
+                'CODIGO': f'B{i:05d}', 'GUIA': f'BENCH-{i // 50:03d}',
+            })
+        archivo = io.BytesIO()
+        pd.DataFrame(filas).to_excel(archivo, index=False)
+        return archivo
@@ -0,0 +1,167 @@
+import csv
+import io
+from datetime import datetime
+
+import pandas as pd
+
+FORMATOS = ('.xlsx', '.xls', '.csv')
+
+# Firmas de archivo: xlsx es un zip, xls un documento OLE2
+_FIRMA_XLSX = b'PK\x03\x04'
+_FIRMA_XLS = b'\xd0\xcf\x11\xe0'
+
+
+class LectorPorBloques:
+    """Lectura de planillas (.xlsx, .xls, .csv) en bloques de `tamano` filas.
+
+    Iterar el lector produce DataFrames con los encabezados de la primera
+    fila; el índice de cada bloque es la posición de la fila de datos en el
+    archivo (0 = primera fila bajo el encabezado), igual que con
+    `pd.read_excel`, de modo que los números de fila de los errores no
+    cambian. Solo se mantiene en memoria el bloque actual: xlsx se recorre con
+    openpyxl en modo read-only y csv con `pd.read_csv(chunksize=...)`. Los
+    .xls (formato BIFF, máx. 65.536 filas) se abren con xlrd bajo demanda.
+
+    `total_filas` es una estimación de filas de datos (None si el formato no
+    la informa sin recorrer el archivo), útil para reportar progreso.
+
+    Las `columnas_texto` se leen siempre como texto: en csv sin convertir
+    (códigos con ceros a la izquierda) y en Excel las celdas numéricas enteras
+    sin decimales (123.0 -> '123'), sin importar los vacíos del bloque. En csv
+    con separador ';' los números se leen con coma decimal y punto de miles
+    (1.234,50).
+    """
+
+    def __init__(self, archivo, tamano=5000, nombre=None, encoding='utf-8-sig', columnas_texto=()):
+        self.archivo = archivo
+        self.tamano = tamano
+        self.encoding = encoding
+        self.columnas_texto = set(columnas_texto)
+        self.formato = self._detectar_formato(nombre or getattr(archivo, 'name', '') or '')
+        self.total_filas = None
+
+    def __iter__(self):
+        if self.formato == '.xlsx':
+            return self._leer_xlsx()
+        if self.formato == '.xls':
+            return self._leer_xls()
+        return self._leer_csv()
+
+    def _detectar_formato(self, nombre):
+        inicio = self.archivo.read(4)
+        self.archivo.seek(0)
+        if inicio == _FIRMA_XLSX:
+            return '.xlsx'
+        if inicio == _FIRMA_XLS:
+            return '.xls'
+        if nombre.lower().endswith('.csv'):
+            return '.csv'
+        raise ValueError('Formato no soportado: se esperaba .xlsx, .xls o .csv')
+
+    def _bloques(self, filas, encabezado):
+        """Agrupar tuplas (posición, valores) en DataFrames de `tamano` filas.
+
+        Los bloques se arman con dtype=object para que el tipo de una celda no
+        dependa de las demás filas del bloque (un vacío no convierte la columna
+        a float).
+        """
+        texto = [i for i, columna in enumerate(encabezado) if columna in self.columnas_texto]
+        posiciones, valores = [], []
+        for posicion, fila in filas:
+            # Las filas completamente vacías (formato residual al final de la hoja) se omiten
+            if all(v is None or v == '' for v in fila):
+                continue
+            if texto:
+                fila = list(fila)
+                for i in texto:
+                    fila[i] = _a_texto(fila[i])
+            posiciones.append(posicion)
+            valores.append(fila)
+            if len(valores) >= self.tamano:
+                yield pd.DataFrame(valores, columns=encabezado, index=posiciones, dtype=object)
+                posiciones, valores = [], []
+        if valores:
+            yield pd.DataFrame(valores, columns=encabezado, index=posiciones, dtype=object)
+
+    def _leer_xlsx(self):
+        from openpyxl import load_workbook
+
+        libro = load_workbook(self.archivo, read_only=True, data_only=True)
+        try:
+            hoja = libro.worksheets[0]
+            if hoja.max_row:
+                self.total_filas = max(hoja.max_row - 1, 0)
+            filas = hoja.iter_rows(values_only=True)
+            encabezado = self._encabezado(next(filas, ()))
+            ancho = len(encabezado)
+            datos = ((i, tuple(fila[:ancho]) + (None,) * (ancho - len(fila))) for i, fila in enumerate(filas))
+            yield from self._bloques(datos, encabezado)
+        finally:
+            libro.close()
+
+    def _leer_xls(self):
+        import xlrd
+
+        libro = xlrd.open_workbook(file_contents=self.archivo.read(), on_demand=True)
+        try:
+            hoja = libro.sheet_by_index(0)
+            self.total_filas = max(hoja.nrows - 1, 0)
+            if not hoja.nrows:
+                return
+            encabezado = self._encabezado(hoja.row_values(0))
+
+            def celda(c):
+                if c.ctype == xlrd.XL_CELL_DATE:
+                    return datetime(*xlrd.xldate_as_tuple(c.value, libro.datemode))
+                if c.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                    return None
+                return c.value
+
+            datos = (
+                (i - 1, tuple(celda(c) for c in hoja.row(i)[:len(encabezado)]))
+                for i in range(1, hoja.nrows)
+            )
+            yield from self._bloques(datos, encabezado)
+        finally:
+            libro.release_resources()
+
+    def _leer_csv(self):
+        texto = io.TextIOWrapper(self.archivo, encoding=self.encoding, newline='')
+        try:
+            # Las exportaciones del ERP usan ',' o ';' según la configuración regional
+            muestra = texto.read(64 * 1024)
+            texto.seek(0)
+            try:
+                separador = csv.Sniffer().sniff(muestra, delimiters=',;\t').delimiter
+            except csv.Error:
+                separador = ','
+            # Con ';' la misma configuración regional usa coma decimal
+            numeros = {'decimal': ',', 'thousands': '.'} if separador == ';' else {}
+            # Encabezados tal como vienen (con espacios) para indicar el dtype
+            encabezado = next(csv.reader(io.StringIO(muestra), delimiter=separador), [])
+            dtype = {c: str for c in encabezado if c.strip() in self.columnas_texto}
+            lector = pd.read_csv(
+                texto, sep=separador, chunksize=self.tamano, skipinitialspace=True, dtype=dtype, **numeros,
+            )
+            for bloque in lector:
+                bloque.columns = self._encabezado(bloque.columns)
+                yield bloque.dropna(how='all')
+        finally:
+            texto.detach()
+
+    @staticmethod
+    def _encabezado(valores):
+        """Nombres de columna normalizados, sin columnas vacías al final."""
+        columnas = ['' if v is None else str(v).strip() for v in valores]
+        while columnas and not columnas[-1]:
+            columnas.pop()
+        return columnas
+
+
+def _a_texto(valor):
+    """Celda de Excel como texto: los números enteros sin el '.0' de xlrd/openpyxl."""
+    if valor is None or isinstance(valor, str):
+        return valor
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
@@ -1,175 +1,663 @@
+import hashlib
+import json
+import tempfile
 import pandas as pd
+from collections import Counter
 from decimal import Decimal
-from datetime import datetime
-from django.db import transaction
-from django.core.exceptions import ValidationError
-from ..models import Abastecimiento, Contrato, UnidadMedida, TipoComplemento, TipoAditivo
+from datetime import date, datetime
+from django.db import models, transaction
+from ..models import Abastecimiento, Contrato, StockBalance, UnidadMedida, TipoComplemento, TipoAditivo
+from . import reference_cache
+from .chunked_reader import LectorPorBloques
+
+# Códigos que se leen como texto en csv (conservan ceros a la izquierda)
+COLUMNAS_TEXTO = ('CODIGO', 'GUIA', 'SERIE')
+
+# Límites de las columnas DecimalField(max_digits=10/12, decimal_places=2)
+MAXIMO_CANTIDAD = 10 ** 8
+MAXIMO_TOTAL = 10 ** 10
+
+
+def _columna(df, nombre, defecto=None):
+    """Columna `nombre` del DataFrame, o una serie constante si no existe."""
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(defecto, index=df.index, dtype=object)
+
+
+def _texto(serie, defecto=''):
+    """Normalizar a texto sin espacios; los vacíos (NaN) toman `defecto`."""
+    return serie.where(serie.notna(), defecto).astype(str).str.strip()
+
+
+def _decimal(valor):
+    return Decimal(str(valor)).quantize(Decimal('0.01'))
+
+
+def _sha1(texto):
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+
+def _id_texto(valor):
+    return '' if valor is None else str(valor)
+
+
+def _ids_opcionales(nombres, mapa):
+    """Ids de `mapa` para cada nombre, con None (no NaN) donde no aplica."""
+    return pd.Series([mapa.get(n) for n in nombres], index=nombres.index, dtype=object)
+
+
+# Columnas de la vista previa que no son texto: se guardan como texto ISO / decimal
+_FECHAS_PREVIA = ('fecha',)
+_DECIMALES_PREVIA = ('cantidad', 'precio_unitario', 'total')
+
+
+def _escribir_previa(filas, destino):
+    """Agregar las filas validadas a `destino` (binario) como JSON lines."""
+    registros = filas.astype(object).where(filas.notna(), None).to_dict('records')
+    destino.writelines(
+        (json.dumps(registro, default=str, ensure_ascii=False) + '\n').encode('utf-8') for registro in registros
+    )
+
+
+def _registro_previa(registro):
+    """Restaurar fechas y decimales de una línea escrita por `_escribir_previa`."""
+    for columna in _FECHAS_PREVIA:
+        if registro.get(columna) is not None:
+            registro[columna] = date.fromisoformat(registro[columna])
+    for columna in _DECIMALES_PREVIA:
+        if registro.get(columna) is not None:
+            registro[columna] = Decimal(registro[columna])
+    return registro
+
+
+# Campos que una reimportación puede modificar (el resto forma la clave natural)
+CAMPOS_ACTUALIZABLES = [
+    'fecha', 'descripcion', 'familia', 'unidad_medida', 'cantidad', 'precio_unitario', 'total',
+    'tipo_complemento', 'tipo_aditivo', 'observaciones', 'contenido_hash',
+]
+
 
 class AbastecimientoExcelImporter:
-    """Importador de archivos Excel para abastecimiento con borrado por mes operativo"""
-    
-    def __init__(self, user):
+    """Importador de planillas de abastecimiento (.xlsx, .xls, .csv) con borrado por mes operativo.
+
+    El archivo se lee en bloques de `chunk_size` filas (ver LectorPorBloques),
+    así que la memoria usada no depende del tamaño del archivo. Cada bloque se
+    normaliza y valida por columnas (pandas), las tablas de referencia se
+    resuelven con una consulta por nombre nuevo (creando en bloque las que
+    falten, con caché entre bloques) y los registros se insertan con
+    bulk_create. Las filas inválidas se omiten y se informan como
+    "Fila N: motivo".
+
+    Cada bloque se confirma en su propia transacción. Con `delete_existing`,
+    el archivo completo se valida antes de escribir nada (a un archivo
+    temporal JSON lines, como la vista previa): así se conocen todos los pares
+    (mes, contrato) y se verifica que ninguno tenga registros protegidos
+    (consumos) antes de borrar el primero. Los registros de un par se borran
+    en la transacción del primer bloque que lo contiene; si la importación se
+    interrumpe, el resultado informa qué pares quedaron completos y cuáles
+    borrados y cargados a medias (`pares_completos`/`pares_incompletos`), y
+    volver a importar el mismo archivo los reemplaza.
+
+    Sin `delete_existing` la importación es un upsert: cada fila se identifica
+    por (contrato, mes, código, serie, guía) más su número de repetición en el
+    archivo (`clave_natural`). Las filas nuevas se insertan, las modificadas
+    se actualizan con bulk_create(update_conflicts=True) y las que tienen el
+    mismo `contenido_hash` se omiten. No borra nada, así que funciona aunque
+    existan consumos (PROTECT) y reimportar el mismo archivo no cambia datos.
+    """
+
+    COLUMNAS_REQUERIDAS = ['MES', 'FECHA', 'CONTRATO', 'DESCRIPCION', 'FAMILIA', 'CANT', 'PRECIO', 'UNIDAD']
+    BATCH_SIZE = 1000
+    CHUNK_SIZE = 5000
+
+    def __init__(self, user, batch_size=None, chunk_size=None):
         self.user = user
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
         self.success_count = 0
         self.skip_count = 0
         self.deleted_count = 0
+        self.inserted_count = 0
+        self.updated_count = 0
+        self.unchanged_count = 0
+        self.rows_read = 0
         self.errors = []
         self.meses_procesados = set()
         self.contratos_procesados = set()
+        self._contratos = {}
+        self._unidades = {}
+        self._tipos_complemento = {}
+        self._tipos_aditivo = {}
+        self._pares_reemplazados = set()
+        self._filas_por_par = Counter()
+        self._filas_escritas = Counter()
+        self._nombres_contrato = {}
+        self._repeticiones = {}
 
-    def process_excel(self, excel_file, delete_existing=True):
-        """Procesar archivo Excel con borrado previo opcional por mes operativo"""
+    def process_excel(self, excel_file, delete_existing=True, progress=None):
+        """Procesar la planilla bloque a bloque: reemplazo por mes operativo o upsert.
+
+        `progress(filas_leidas, total_estimado)` se invoca tras confirmar cada
+        bloque; `total_estimado` es None si el formato no lo informa.
+        """
+        try:
+            if delete_existing:
+                # Reemplazo: validar todo el archivo antes de borrar el primer par
+                with tempfile.TemporaryFile() as previa:
+                    total_filas = self._validar_archivo(excel_file, previa)
+                    self._preparar_reemplazo()
+                    previa.seek(0)
+                    self._escribir_previa_validada(previa, delete_existing, progress, total_filas)
+                return self._resultado()
+
+            lector = LectorPorBloques(excel_file, tamano=self.chunk_size, columnas_texto=COLUMNAS_TEXTO)
+            for bloque in lector:
+                # Validar columnas requeridas
+                missing_columns = [col for col in self.COLUMNAS_REQUERIDAS if col not in bloque.columns]
+
+                if missing_columns:
+                    return {
+                        'success': False,
+                        'error': f'Columnas faltantes: {", ".join(missing_columns)}'
+                    }
+
+                self._escribir_bloque(self._validar_bloque(bloque), delete_existing)
+                self.rows_read += len(bloque)
+                if progress:
+                    progress(self.rows_read, lector.total_filas)
+
+            return self._resultado()
+
+        except Exception as e:
+            return self._resultado_error(e)
+
+    def process_preview(self, previa, delete_existing=True, progress=None, total_filas=None):
+        """Importar las filas ya validadas por `preview` sin volver a leer el archivo.
+
+        `previa` es el archivo JSON lines escrito por `preview`; se lee y se
+        escribe en bloques de `chunk_size` filas, con las mismas transacciones
+        y el mismo avance que `process_excel`. Con `delete_existing` se
+        recorre primero para verificar todos los pares antes de borrar.
+        """
         try:
-            # Leer archivo Excel
-            df = pd.read_excel(excel_file)
-            
-            # Validar columnas requeridas
-            required_columns = ['MES', 'FECHA', 'CONTRATO', 'DESCRIPCION', 'FAMILIA', 'CANT', 'PRECIO', 'UNIDAD']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            
+            if delete_existing:
+                for bloque in self._leer_previa(previa):
+                    self._contar_pares(bloque, self._filas_por_par)
+                self._preparar_reemplazo()
+                previa.seek(0)
+            self._escribir_previa_validada(previa, delete_existing, progress, total_filas)
+            return self._resultado()
+
+        except Exception as e:
+            return self._resultado_error(e)
+
+    def _validar_archivo(self, excel_file, destino):
+        """Validar la planilla completa en `destino` (JSON lines) sin escribir en la BD.
+
+        Cuenta las filas válidas de cada par (mes, contrato). Retorna el total
+        de filas estimado por el lector.
+        """
+        lector = LectorPorBloques(excel_file, tamano=self.chunk_size, columnas_texto=COLUMNAS_TEXTO)
+        for bloque in lector:
+            missing_columns = [col for col in self.COLUMNAS_REQUERIDAS if col not in bloque.columns]
             if missing_columns:
-                return {
-                    'success': False,
-                    'error': f'Columnas faltantes: {", ".join(missing_columns)}'
-                }
-            
-            # Procesar en transacción
-            with transaction.atomic():
-                # Agrupar por mes para borrado selectivo
-                if delete_existing:
-                    meses_a_borrar = df['MES'].dropna().unique()
-                    contratos_afectados = df['CONTRATO'].dropna().unique()
-                    
-                    for mes in meses_a_borrar:
-                        for contrato_nombre in contratos_afectados:
-                            try:
-                                contrato = Contrato.objects.get(nombre_contrato=contrato_nombre)
-                                deleted = Abastecimiento.objects.filter(
-                                    mes=str(mes).upper().strip(),
-                                    contrato=contrato
-                                ).delete()
-                                self.deleted_count += deleted[0] if deleted[0] else 0
-                            except Contrato.DoesNotExist:
-                                continue
-                
-                # Procesar cada fila
-                for index, row in df.iterrows():
-                    try:
-                        self._process_row(row, index)
-                    except Exception as e:
-                        self.errors.append(f"Fila {index + 2}: {str(e)}")
-                        self.skip_count += 1
-            
-            return {
-                'success': True,
-                'success_count': self.success_count,
-                'skip_count': self.skip_count,
-                'deleted_count': self.deleted_count,
-                'errors': self.errors,
-                'meses_procesados': list(self.meses_procesados),
-                'contratos_procesados': list(self.contratos_procesados),
-            }
-            
+                raise ValueError(f'Columnas faltantes: {", ".join(missing_columns)}')
+            filas = self._validar_bloque(bloque)
+            _escribir_previa(filas, destino)
+            self._contar_pares(filas, self._filas_por_par)
+        return lector.total_filas
+
+    def _escribir_previa_validada(self, previa, delete_existing, progress, total_filas):
+        for bloque in self._leer_previa(previa):
+            self._escribir_bloque(bloque, delete_existing)
+            self.rows_read += len(bloque)
+            if progress:
+                progress(self.rows_read, total_filas)
+
+    def _preparar_reemplazo(self):
+        """Fallar antes de escribir si algún par a reemplazar tiene registros protegidos contra el borrado."""
+        if not self._filas_por_par:
+            return
+        existentes = Abastecimiento.objects.filter(self._filtro_pares(self._filas_por_par))
+        for relacion in Abastecimiento._meta.related_objects:
+            if relacion.on_delete not in (models.PROTECT, models.RESTRICT):
+                continue
+            bloqueados = sorted(
+                existentes.filter(**{f'{relacion.name}__isnull': False})
+                .values_list('mes', 'contrato__nombre_contrato').distinct()
+            )
+            if bloqueados:
+                raise ValueError(
+                    'No se pueden reemplazar '
+                    + ', '.join(f'{mes} ({contrato})' for mes, contrato in bloqueados)
+                    + f': tienen {relacion.related_model._meta.verbose_name_plural} asociados. '
+                    'Importe sin reemplazar los existentes para actualizar esos meses.'
+                )
+
+    def preview(self, excel_file, delete_existing=True, destino=None, progress=None):
+        """Validar la planilla sin escribir en la BD.
+
+        Ejecuta la misma normalización vectorizada y resolución de contratos
+        que la importación y consulta (sin crear) unidades y tipos. Procesa el
+        archivo bloque a bloque acumulando solo el resumen, así que la memoria
+        no depende del tamaño del archivo. Si se indica `destino` (archivo
+        binario), cada bloque validado se escribe ahí como JSON lines para
+        pasarlo luego a `process_preview`. Retorna el resumen con los errores
+        por fila.
+        """
+        total = validas_total = 0
+        errores, meses, contratos, pares = [], set(), set(), set()
+        monto_total = Decimal('0')
+        nuevas = {'unidades': set(), 'tipos_complemento': set(), 'tipos_aditivo': set()}
+        try:
+            lector = LectorPorBloques(excel_file, tamano=self.chunk_size, columnas_texto=COLUMNAS_TEXTO)
+            for bloque in lector:
+                missing_columns = [col for col in self.COLUMNAS_REQUERIDAS if col not in bloque.columns]
+                if missing_columns:
+                    return {
+                        'success': False,
+                        'error': f'Columnas faltantes: {", ".join(missing_columns)}'
+                    }
+                filas = self._validar_bloque(bloque)
+                if destino is not None:
+                    _escribir_previa(filas, destino)
+
+                validas = filas[filas['error'].isna()]
+                invalidas = filas[filas['error'].notna()]
+                total += len(filas)
+                validas_total += len(validas)
+                errores.extend(
+                    {'fila': int(fila), 'error': error} for fila, error in zip(invalidas['fila'], invalidas['error'])
+                )
+                meses.update(validas['mes'].unique().tolist())
+                contratos.update(validas['contrato_nombre'].unique().tolist())
+                monto_total += sum(validas['total'], Decimal('0'))
+                pares |= self._pares(validas)
+                nuevas['unidades'].update(
+                    self._nombres_nuevos(self._unidades, UnidadMedida, validas['unidad_nombre'])
+                )
+                nuevas['tipos_complemento'].update(self._nombres_nuevos(
+                    self._tipos_complemento, TipoComplemento, validas['tipo_complemento'].dropna()
+                ))
+                nuevas['tipos_aditivo'].update(self._nombres_nuevos(
+                    self._tipos_aditivo, TipoAditivo, validas['tipo_aditivo'].dropna()
+                ))
+
+                self.rows_read += len(bloque)
+                if progress:
+                    progress(self.rows_read, lector.total_filas)
+            if not total:
+                return {'success': False, 'error': 'El archivo no contiene filas'}
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    def _process_row(self, row, index):
-        """Procesar una fila individual del Excel"""
-        # Validar datos requeridos
-        if pd.isna(row['MES']) or pd.isna(row['DESCRIPCION']) or pd.isna(row['CANT']):
-            raise ValidationError("Faltan datos requeridos (MES, DESCRIPCION, CANT)")
-        
-        # Obtener o validar contrato
-        contrato_nombre = str(row['CONTRATO']).strip()
-        try:
-            contrato = Contrato.objects.get(nombre_contrato=contrato_nombre)
-        except Contrato.DoesNotExist:
-            raise ValidationError(f"Contrato '{contrato_nombre}' no existe")
-        
-        # Validar acceso del usuario al contrato
-        if not self.user.can_manage_all_contracts() and contrato != self.user.contrato:
-            raise ValidationError(f"Sin permisos para el contrato '{contrato_nombre}'")
-        
-        # Obtener unidad de medida
-        unidad_nombre = str(row.get('UNIDAD', 'UND')).strip()
-        unidad, _ = UnidadMedida.objects.get_or_create(
-            nombre=unidad_nombre,
-            defaults={'simbolo': unidad_nombre}
+        reemplazar = 0
+        if delete_existing and pares:
+            reemplazar = Abastecimiento.objects.filter(self._filtro_pares(pares)).count()
+        return {
+            'success': True,
+            'total_rows': total,
+            'valid_count': validas_total,
+            'error_count': len(errores),
+            'errors': errores,
+            'meses': sorted(meses),
+            'contratos': sorted(contratos),
+            'monto_total': str(monto_total),
+            'registros_a_reemplazar': reemplazar,
+            'nuevas_referencias': {nombre: sorted(valores) for nombre, valores in nuevas.items()},
+        }
+
+    def _leer_previa(self, previa):
+        """Bloques de `chunk_size` filas (DataFrames) leídos del JSON lines de `preview`."""
+        registros = []
+        for linea in previa:
+            if not linea.strip():
+                continue
+            registros.append(_registro_previa(json.loads(linea)))
+            if len(registros) >= self.chunk_size:
+                yield pd.DataFrame(registros)
+                registros = []
+        if registros:
+            yield pd.DataFrame(registros)
+
+    def _resultado_error(self, e):
+        resultado = {'success': False, 'error': str(e)}
+        if self._pares_reemplazados:
+            # Pares ya confirmados: los completos quedaron reemplazados, los incompletos borrados y cargados a medias
+            completos = {par for par in self._pares_reemplazados if self._filas_escritas[par] >= self._filas_por_par[par]}
+            resultado['pares_completos'] = self._nombres_pares(completos)
+            resultado['pares_incompletos'] = self._nombres_pares(self._pares_reemplazados - completos)
+        return resultado
+
+    def _nombres_pares(self, pares):
+        return sorted(f'{mes} ({self._nombres_contrato.get(contrato_id, contrato_id)})' for mes, contrato_id in pares)
+
+    def _contar_pares(self, filas, conteo):
+        """Sumar a `conteo` las filas válidas de `filas` por par (mes, contrato)."""
+        validas = filas[filas['error'].isna()]
+        ids = [int(contrato_id) for contrato_id in validas['contrato_id']]
+        conteo.update(zip(validas['mes'], ids))
+        self._nombres_contrato.update(zip(ids, validas['contrato_nombre']))
+
+    def _resultado(self):
+        return {
+            'success': True,
+            'success_count': self.success_count,
+            'skip_count': self.skip_count,
+            'deleted_count': self.deleted_count,
+            'inserted_count': self.inserted_count,
+            'updated_count': self.updated_count,
+            'unchanged_count': self.unchanged_count,
+            'errors': self.errors,
+            'meses_procesados': list(self.meses_procesados),
+            'contratos_procesados': list(self.contratos_procesados),
+        }
+
+    def _validar_bloque(self, df):
+        """Normalizar y validar un bloque del archivo (sin escribir en la BD)."""
+        filas = self._preparar(df)
+        self._resolver_contratos(filas)
+        return filas
+
+    def _escribir_bloque(self, filas, delete_existing):
+        validas = filas[filas['error'].isna()]
+
+        reemplazados, borrados = set(), 0
+        with transaction.atomic():
+            if delete_existing:
+                reemplazados, borrados = self._borrar_existentes(validas)
+            self._insertar(validas, upsert=not delete_existing)
+
+        # Solo lo confirmado: si el bloque falla, su borrado se revierte
+        self._pares_reemplazados |= reemplazados
+        self.deleted_count += borrados
+        if delete_existing:
+            self._contar_pares(filas, self._filas_escritas)
+        self._registrar_errores(filas)
+
+    def _preparar(self, df):
+        """Normalizar las columnas del archivo y marcar las filas inválidas.
+
+        Retorna un DataFrame con una fila por fila del Excel (`fila` es el
+        número visible en la planilla) y la columna `error` con el primer
+        motivo de rechazo, o NaN si la fila es válida.
+        """
+        filas = pd.DataFrame(index=df.index)
+        filas['fila'] = df.index + 2
+        filas['error'] = pd.Series(None, index=df.index, dtype=object)
+
+        faltantes = df['MES'].isna() | df['DESCRIPCION'].isna() | df['CANT'].isna()
+        self._marcar_error(filas, faltantes, 'Faltan datos requeridos (MES, DESCRIPCION, CANT)')
+
+        filas['mes'] = _texto(df['MES']).str.upper()
+        filas['contrato_nombre'] = _texto(df['CONTRATO'])
+        filas['descripcion'] = _texto(df['DESCRIPCION'])
+        filas['codigo_producto'] = _texto(_columna(df, 'CODIGO'))
+        filas['numero_guia'] = _texto(_columna(df, 'GUIA'))
+        filas['observaciones'] = _texto(_columna(df, 'OBSERVACIONES'))
+        serie = _columna(df, 'SERIE')
+        filas['serie'] = _texto(serie).where(serie.notna(), None)
+        filas['unidad_nombre'] = _texto(df['UNIDAD'], 'UND')
+
+        # Fechas vacías o ilegibles se registran con la fecha del día
+        fecha = pd.to_datetime(df['FECHA'], errors='coerce')
+        filas['fecha'] = fecha.dt.date.where(fecha.notna(), datetime.now().date())
+
+        familia = _texto(df['FAMILIA'], 'CONSUMIBLES').str.upper()
+        filas['familia'] = familia.where(familia.isin(dict(Abastecimiento.FAMILIA_CHOICES)), 'CONSUMIBLES')
+        filas['tipo_complemento'] = _texto(_columna(df, 'TIPO_COMPLEMENTO'), 'BROCA').where(
+            filas['familia'] == 'PRODUCTOS_DIAMANTADOS', None
         )
-        
-        # Procesar fecha
-        try:
-            if pd.isna(row.get('FECHA')):
-                fecha = datetime.now().date()
-            else:
-                fecha = pd.to_datetime(row['FECHA']).date()
-        except:
-            fecha = datetime.now().date()
-        
-        # Determinar familia
-        familia = str(row.get('FAMILIA', 'CONSUMIBLES')).strip().upper()
-        if familia not in dict(Abastecimiento.FAMILIA_CHOICES):
-            familia = 'CONSUMIBLES'
-        
-        # Crear registro de abastecimiento
-        abastecimiento = Abastecimiento(
-            mes=str(row['MES']).strip().upper(),
-            fecha=fecha,
-            contrato=contrato,
-            codigo_producto=str(row.get('CODIGO', '')).strip(),
-            descripcion=str(row['DESCRIPCION']).strip(),
-            familia=familia,
-            serie=str(row.get('SERIE', '')).strip() if pd.notna(row.get('SERIE')) else None,
-            unidad_medida=unidad,
-            cantidad=Decimal(str(row['CANT'])),
-            precio_unitario=Decimal(str(row.get('PRECIO', 0))),
-            numero_guia=str(row.get('GUIA', '')).strip(),
-            observaciones=str(row.get('OBSERVACIONES', '')).strip()
+        filas['tipo_aditivo'] = _texto(_columna(df, 'TIPO_ADITIVO'), 'BENTONITA').where(
+            filas['familia'] == 'ADITIVOS_PERFORACION', None
+        )
+
+        cantidad = pd.to_numeric(df['CANT'], errors='coerce').round(2)
+        precio = pd.to_numeric(df['PRECIO'], errors='coerce').round(2)
+        self._marcar_error(filas, cantidad.isna(), 'Cantidad inválida')
+        self._marcar_error(filas, precio.isna(), 'Precio inválido')
+        self._marcar_error(
+            filas,
+            (cantidad.abs() >= MAXIMO_CANTIDAD) | (precio.abs() >= MAXIMO_CANTIDAD)
+            | ((cantidad * precio).abs() >= MAXIMO_TOTAL),
+            'Cantidad o precio fuera de rango',
         )
-        
-        # Asociar tipos si aplica
-        if familia == 'PRODUCTOS_DIAMANTADOS':
-            tipo_complemento = self._get_or_create_tipo_complemento(
-                str(row.get('TIPO_COMPLEMENTO', 'BROCA')).strip()
+
+        validas = filas['error'].isna()
+        filas['cantidad'] = cantidad.where(validas).map(_decimal, na_action='ignore')
+        filas['precio_unitario'] = precio.where(validas).map(_decimal, na_action='ignore')
+        filas['total'] = (filas['cantidad'][validas] * filas['precio_unitario'][validas]).map(_decimal)
+        return filas
+
+    def _marcar_error(self, filas, mascara, mensaje):
+        """Registrar `mensaje` en las filas de `mascara` que aún no tienen error."""
+        mascara = mascara & filas['error'].isna()
+        if isinstance(mensaje, pd.Series):
+            mensaje = mensaje[mascara]
+        filas.loc[mascara, 'error'] = mensaje
+
+    def _resolver_contratos(self, filas):
+        """Asignar `contrato_id` (una consulta por nombres nuevos) y validar el acceso del usuario."""
+        nuevos = [n for n in filas['contrato_nombre'].unique().tolist() if n not in self._contratos]
+        if nuevos:
+            self._contratos.update(dict.fromkeys(nuevos))
+            self._contratos.update(
+                Contrato.objects.filter(nombre_contrato__in=nuevos).values_list('nombre_contrato', 'pk')
             )
-            abastecimiento.tipo_complemento = tipo_complemento
-        
-        elif familia == 'ADITIVOS_PERFORACION':
-            tipo_aditivo = self._get_or_create_tipo_aditivo(
-                str(row.get('TIPO_ADITIVO', 'BENTONITA')).strip(), 
-                unidad
+        filas['contrato_id'] = filas['contrato_nombre'].map(self._contratos)
+
+        self._marcar_error(
+            filas, filas['contrato_id'].isna(),
+            "Contrato '" + filas['contrato_nombre'] + "' no existe",
+        )
+        if not self.user.can_manage_all_contracts():
+            self._marcar_error(
+                filas, filas['contrato_id'] != self.user.contrato_id,
+                "Sin permisos para el contrato '" + filas['contrato_nombre'] + "'",
             )
-            abastecimiento.tipo_aditivo = tipo_aditivo
-        
-        # Guardar
-        abastecimiento.save()
-        
-        self.success_count += 1
-        self.meses_procesados.add(abastecimiento.mes)
-        self.contratos_procesados.add(contrato.nombre_contrato)
-
-    def _get_or_create_tipo_complemento(self, nombre):
-        """Obtener o crear tipo de complemento"""
-        tipo_complemento, _ = TipoComplemento.objects.get_or_create(
-            nombre=nombre,
-            defaults={
-                'categoria': 'BROCA',
-                'descripcion': f'Complemento importado: {nombre}'
-            }
+
+    def _borrar_existentes(self, validas):
+        """Borrar los registros de los pares (mes, contrato) que aparecen por primera vez.
+
+        Solo se consideran filas válidas, que ya pasaron el control de acceso
+        al contrato; un par se reemplaza una sola vez por importación. Retorna
+        los pares reemplazados y la cantidad de registros borrados.
+        """
+        pares = self._pares(validas) - self._pares_reemplazados
+        if not pares:
+            return pares, 0
+        _, borrados = Abastecimiento.objects.filter(self._filtro_pares(pares)).delete()
+        return pares, borrados.get(Abastecimiento._meta.label, 0)
+
+    @staticmethod
+    def _pares(validas):
+        return {(mes, int(contrato_id)) for mes, contrato_id in zip(validas['mes'], validas['contrato_id'])}
+
+    @staticmethod
+    def _filtro_pares(pares):
+        filtro = models.Q()
+        for mes, contrato_id in pares:
+            filtro |= models.Q(mes=mes, contrato_id=contrato_id)
+        return filtro
+
+    def _insertar(self, validas, upsert=False):
+        """Crear tablas de referencia faltantes e insertar (o actualizar) las filas válidas en lotes."""
+        if validas.empty:
+            return
+        unidades = self._resolver_unidades(validas['unidad_nombre'].unique().tolist())
+        complementos = self._resolver_tipos_complemento(validas['tipo_complemento'].dropna().unique().tolist())
+        aditivos = self._resolver_tipos_aditivo(
+            validas.dropna(subset=['tipo_aditivo']).drop_duplicates('tipo_aditivo')
+            .set_index('tipo_aditivo')['unidad_nombre'].map(unidades).to_dict()
         )
-        return tipo_complemento
-
-    def _get_or_create_tipo_aditivo(self, nombre, unidad):
-        """Obtener o crear tipo de aditivo"""
-        tipo_aditivo, _ = TipoAditivo.objects.get_or_create(
-            nombre=nombre,
-            defaults={
-                'categoria': 'BENTONITA',
-                'unidad_medida_default': unidad,
-                'descripcion': f'Aditivo importado: {nombre}'
-            }
+        validas = validas.assign(
+            contrato_id=validas['contrato_id'].astype(int),
+            unidad_medida_id=validas['unidad_nombre'].map(unidades),
+            tipo_complemento_id=_ids_opcionales(validas['tipo_complemento'], complementos),
+            tipo_aditivo_id=_ids_opcionales(validas['tipo_aditivo'], aditivos),
+        )
+        validas = validas.assign(
+            clave_natural=self._claves_naturales(validas),
+            contenido_hash=self._hashes_contenido(validas),
+        )
+
+        for inicio in range(0, len(validas), self.batch_size):
+            lote = validas.iloc[inicio:inicio + self.batch_size]
+            registros = [
+                Abastecimiento(
+                    mes=fila.mes,
+                    fecha=fila.fecha,
+                    contrato_id=fila.contrato_id,
+                    codigo_producto=fila.codigo_producto,
+                    descripcion=fila.descripcion,
+                    familia=fila.familia,
+                    serie=fila.serie,
+                    unidad_medida_id=fila.unidad_medida_id,
+                    cantidad=fila.cantidad,
+                    precio_unitario=fila.precio_unitario,
+                    total=fila.total,
+                    tipo_complemento_id=fila.tipo_complemento_id,
+                    tipo_aditivo_id=fila.tipo_aditivo_id,
+                    numero_guia=fila.numero_guia,
+                    observaciones=fila.observaciones,
+                    clave_natural=fila.clave_natural,
+                    contenido_hash=fila.contenido_hash,
+                )
+                for fila in lote.itertuples(index=False)
+            ]
+            if upsert:
+                self._upsert(registros)
+            else:
+                # bulk_create no pasa por save(): los saldos de stock se crean aquí
+                creados = Abastecimiento.objects.bulk_create(registros)
+                StockBalance.crear_iniciales(creados)
+                self.inserted_count += len(creados)
+
+        self.success_count += len(validas)
+        self.meses_procesados.update(validas['mes'].unique().tolist())
+        self.contratos_procesados.update(validas['contrato_nombre'].unique().tolist())
+
+    def _upsert(self, registros):
+        """Insertar las filas nuevas y actualizar las modificadas en un solo INSERT ... ON CONFLICT."""
+        existentes = {
+            (contrato_id, clave): (pk, contenido_hash)
+            for pk, contrato_id, clave, contenido_hash in Abastecimiento.objects.filter(
+                contrato_id__in={r.contrato_id for r in registros},
+                clave_natural__in=[r.clave_natural for r in registros],
+            ).values_list('pk', 'contrato_id', 'clave_natural', 'contenido_hash')
+        }
+        nuevos, modificados = [], []
+        for registro in registros:
+            actual = existentes.get((registro.contrato_id, registro.clave_natural))
+            if actual is None:
+                nuevos.append(registro)
+            elif actual[1] != registro.contenido_hash:
+                modificados.append(registro)
+        self.unchanged_count += len(registros) - len(nuevos) - len(modificados)
+        if not nuevos and not modificados:
+            return
+
+        Abastecimiento.objects.bulk_create(
+            nuevos + modificados,
+            update_conflicts=True,
+            unique_fields=['contrato', 'clave_natural'],
+            update_fields=CAMPOS_ACTUALIZABLES,
+        )
+        StockBalance.crear_iniciales(nuevos)
+        StockBalance.sincronizar_lote(
+            [existentes[(r.contrato_id, r.clave_natural)][0] for r in modificados]
+        )
+        self.inserted_count += len(nuevos)
+        self.updated_count += len(modificados)
+
+    def _claves_naturales(self, validas):
+        """Hash de (contrato, mes, código, serie, guía, n.º de repetición) de cada fila.
+
+        Las filas con la misma clave dentro del archivo se numeran en orden de
+        aparición (continuando entre bloques), de modo que reimportar el mismo
+        archivo las empareja una a una con lo ya cargado.
+        """
+        base = (
+            validas['contrato_id'].astype(str) + '|' + validas['mes'] + '|' + validas['codigo_producto']
+            + '|' + validas['serie'].fillna('') + '|' + validas['numero_guia']
+        )
+        repeticion = base.groupby(base).cumcount() + base.map(self._repeticiones).fillna(0).astype(int)
+        for clave, cantidad in base.value_counts().items():
+            self._repeticiones[clave] = self._repeticiones.get(clave, 0) + cantidad
+        return (base + '|' + repeticion.astype(str)).map(_sha1)
+
+    @staticmethod
+    def _hashes_contenido(validas):
+        """Hash de los campos actualizables, con la misma representación que tienen en la BD."""
+        contenido = (
+            validas['fecha'].map(lambda f: f.isoformat()) + '|' + validas['descripcion'] + '|' + validas['familia']
+            + '|' + validas['unidad_medida_id'].map(_id_texto) + '|' + validas['cantidad'].astype(str)
+            + '|' + validas['precio_unitario'].astype(str) + '|' + validas['tipo_complemento_id'].map(_id_texto)
+            + '|' + validas['tipo_aditivo_id'].map(_id_texto) + '|' + validas['observaciones']
+        )
+        return contenido.map(_sha1)
+
+    def _registrar_errores(self, filas):
+        invalidas = filas[filas['error'].notna()]
+        self.skip_count += len(invalidas)
+        self.errors.extend(
+            f"Fila {fila}: {error}" for fila, error in zip(invalidas['fila'], invalidas['error'])
+        )
+
+    @staticmethod
+    def _resolver(cache, modelo, nombres, crear):
+        """Completar `cache` (nombre -> id) con una consulta y un bulk_create para los nombres nuevos.
+
+        `crear(nombre)` construye la instancia de los que no existen en la BD.
+        """
+        nuevos = [n for n in nombres if n not in cache]
+        if nuevos:
+            encontrados = {}
+            for pk, nombre in modelo.objects.filter(nombre__in=nuevos).order_by('pk').values_list('pk', 'nombre'):
+                encontrados.setdefault(nombre, pk)
+            cache.update(encontrados)
+            creados = modelo.objects.bulk_create([crear(n) for n in nuevos if n not in encontrados])
+            cache.update((obj.nombre, obj.pk) for obj in creados)
+            if creados:
+                # bulk_create no emite post_save: las tablas cacheadas no se enteran solas
+                reference_cache.invalidar_modelos(modelo)
+        return cache
+
+    @staticmethod
+    def _nombres_nuevos(cache, modelo, nombres):
+        """Nombres que la importación crearía en `modelo` (solo lectura; completa `cache`)."""
+        pendientes = [n for n in nombres.unique().tolist() if n not in cache]
+        if pendientes:
+            cache.update(
+                (nombre, pk) for pk, nombre in
+                modelo.objects.filter(nombre__in=pendientes).order_by('-pk').values_list('pk', 'nombre')
+            )
+        return sorted(n for n in pendientes if n not in cache)
+
+    def _resolver_unidades(self, nombres):
+        """Mapa nombre -> id de UnidadMedida, creando en bloque las que falten."""
+        return self._resolver(
+            self._unidades, UnidadMedida, nombres,
+            lambda n: UnidadMedida(nombre=n, simbolo=n),
+        )
+
+    def _resolver_tipos_complemento(self, nombres):
+        """Mapa nombre -> id de TipoComplemento, creando en bloque los que falten."""
+        return self._resolver(
+            self._tipos_complemento, TipoComplemento, nombres,
+            lambda n: TipoComplemento(nombre=n, categoria='BROCA', descripcion=f'Complemento importado: {n}'),
+        )
+
+    def _resolver_tipos_aditivo(self, unidad_por_nombre):
+        """Mapa nombre -> id de TipoAditivo; los faltantes se crean con la unidad de su primera fila."""
+        return self._resolver(
+            self._tipos_aditivo, TipoAditivo, list(unidad_por_nombre),
+            lambda n: TipoAditivo(
+                nombre=n, categoria='BENTONITA', unidad_medida_default_id=unidad_por_nombre[n],
+                descripcion=f'Aditivo importado: {n}',
+            ),
         )
-        return tipo_aditivo
\ No newline at end of file
@@ -0,0 +1,125 @@
+import hashlib
+
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from ..models import Maquina, Sondaje, Trabajador
+from . import reference_cache
+
+# Alcance de los administradores del sistema: opciones de todos los contratos
+TODOS = 'todos'
+# Versiones de las que depende el paquete, además de la del alcance
+REFERENCIAS = (
+    'tipos_turno', 'tipos_actividad', 'tipos_complemento', 'tipos_aditivo', 'unidades_medida',
+    'contratos_actividades',
+)
+
+
+def alcance(usuario):
+    """TODOS para administradores del sistema; si no, el id del contrato del usuario (o None)."""
+    if usuario.can_manage_all_contracts():
+        return TODOS
+    return usuario.contrato_id
+
+
+def _nombre_version(alcance_):
+    return f'opciones_turno:{alcance_}'
+
+
+def etag(usuario):
+    """Identificador del paquete de opciones vigente para `usuario` (sin consultas SQL)."""
+    alcance_ = alcance(usuario)
+    versiones = [reference_cache.version(nombre) for nombre in (_nombre_version(alcance_), *REFERENCIAS)]
+    return hashlib.sha1(f'{alcance_}:{versiones}'.encode()).hexdigest()[:20]
+
+
+def actividades_disponibles(usuario):
+    """Actividades que `usuario` puede registrar: todas (administradores) o las de su contrato."""
+    alcance_ = alcance(usuario)
+    if alcance_ == TODOS:
+        return reference_cache.tabla('tipos_actividad')
+    return reference_cache.actividades_contrato(alcance_)
+
+
+def opciones(usuario):
+    """Retorna (etag, opciones) con las listas de los <select> del formulario de turno.
+
+    Cada lista es [{'id', 'nombre'}, ...] (aditivos con 'unidad_medida_id',
+    unidades con 'simbolo'). Se cachea por alcance y versión, por lo que el
+    paquete se arma una vez por contrato hasta que cambie alguno de los datos.
+    """
+    etiqueta = etag(usuario)
+    return etiqueta, reference_cache.cargar(
+        f'{reference_cache.PREFIJO}:opciones_turno:{etiqueta}', lambda: _construir(usuario)
+    )
+
+
+def _construir(usuario):
+    alcance_ = alcance(usuario)
+    sondajes = Sondaje.objects.filter(estado='ACTIVO')
+    maquinas = Maquina.objects.filter(estado='OPERATIVO')
+    trabajadores = Trabajador.objects.filter(is_active=True)
+    if alcance_ != TODOS:
+        sondajes, maquinas, trabajadores = (
+            qs.filter(contrato_id=alcance_) for qs in (sondajes, maquinas, trabajadores)
+        )
+
+    return {
+        'sondajes': [
+            {'id': pk, 'nombre': nombre}
+            for pk, nombre in sondajes.order_by('pk').values_list('pk', 'nombre_sondaje')
+        ],
+        'maquinas': [
+            {'id': pk, 'nombre': nombre} for pk, nombre in maquinas.order_by('pk').values_list('pk', 'nombre')
+        ],
+        # Los trabajadores se envían por DNI, como espera crear_turno_completo
+        'trabajadores': [
+            {'id': t.dni, 'nombre': f'{t.apellidos}, {t.nombres} - {t.dni} - {t.get_cargo_display()}'}
+            for t in trabajadores.order_by('pk').only('dni', 'apellidos', 'nombres', 'cargo')
+        ],
+        'tipos_turno': _lista(reference_cache.tabla('tipos_turno')),
+        'tipos_actividad': _lista(actividades_disponibles(usuario)),
+        'tipos_complemento': _lista(reference_cache.tabla('tipos_complemento')),
+        'tipos_aditivo': [
+            {'id': a.pk, 'nombre': a.nombre, 'unidad_medida_id': a.unidad_medida_default_id}
+            for a in reference_cache.tabla('tipos_aditivo')
+        ],
+        'unidades_medida': [
+            {'id': u.pk, 'nombre': u.nombre, 'simbolo': u.simbolo} for u in reference_cache.tabla('unidades_medida')
+        ],
+    }
+
+
+def _lista(objetos):
+    return [{'id': o.pk, 'nombre': o.nombre} for o in objetos]
+
+
+def _recordar_contrato_anterior(sender, instance, update_fields=None, **kwargs):
+    # Si el registro cambia de contrato hay que invalidar también el anterior
+    if instance.pk is None or (update_fields is not None and 'contrato' not in update_fields):
+        return
+    instance._contrato_anterior_id = sender.objects.filter(pk=instance.pk).values_list('contrato_id', flat=True).first()
+
+
+def invalidar_contratos(contrato_ids):
+    """Invalidar los paquetes de `contrato_ids` y el de administradores.
+
+    Las señales lo hacen al guardar un registro; las escrituras en bloque de
+    sondajes, máquinas o trabajadores (sin post_save) deben llamarla.
+    """
+    contratos = set(contrato_ids) - {None}
+    reference_cache.invalidar_al_confirmar(
+        _nombre_version(TODOS), *(_nombre_version(contrato_id) for contrato_id in sorted(contratos))
+    )
+
+
+def _invalidar_contrato(sender, instance, **kwargs):
+    invalidar_contratos({instance.contrato_id, getattr(instance, '_contrato_anterior_id', None)})
+
+
+def conectar_senales():
+    """Invalidar el paquete del contrato al guardar o borrar sondajes, máquinas o trabajadores."""
+    for modelo in (Sondaje, Maquina, Trabajador):
+        etiqueta = modelo._meta.model_name
+        pre_save.connect(_recordar_contrato_anterior, sender=modelo, dispatch_uid=f'opciones_turno:pre_save:{etiqueta}')
+        post_save.connect(_invalidar_contrato, sender=modelo, dispatch_uid=f'opciones_turno:save:{etiqueta}')
+        post_delete.connect(_invalidar_contrato, sender=modelo, dispatch_uid=f'opciones_turno:delete:{etiqueta}')
@@ -0,0 +1,200 @@
+import logging
+import os
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections
+from django.utils import timezone
+
+from ..models import ImportacionAbastecimiento
+from .excel_importer import AbastecimientoExcelImporter
+
+logger = logging.getLogger(__name__)
+
+# Errores por fila guardados en el registro (el total se informa en `omitidos`)
+MAXIMO_ERRORES_GUARDADOS = 500
+
+
+def encolar_importacion(usuario, archivo, reemplazar_existentes=True, solo_validar=False):
+    """Guardar el archivo subido y crear la importación PENDIENTE. Retorna el registro.
+
+    Con `solo_validar` el worker genera la vista previa (ver `previsualizar`)
+    en lugar de importar.
+    """
+    return ImportacionAbastecimiento.objects.create(
+        archivo=archivo,
+        nombre_archivo=os.path.basename(archivo.name),
+        usuario=usuario,
+        contrato=None if usuario.can_manage_all_contracts() else usuario.contrato,
+        reemplazar_existentes=reemplazar_existentes,
+        solo_validar=solo_validar,
+    )
+
+
+def previsualizar(importacion):
+    """Validar el archivo de una importación `solo_validar` ya reclamada y dejarla en PREVIA.
+
+    Las filas validadas se guardan en `importacion.previa` como JSON lines
+    (bloque a bloque, sin reunir el archivo en memoria) para que la
+    confirmación no vuelva a leer la planilla; el resumen queda en
+    `resultado` y los errores en `errores`.
+    """
+    importador = AbastecimientoExcelImporter(importacion.usuario)
+
+    def progreso(filas_leidas, total_filas):
+        importacion.total_filas = total_filas
+        ImportacionAbastecimiento.objects.filter(pk=importacion.pk).update(
+            filas_leidas=filas_leidas, total_filas=total_filas, updated_at=timezone.now(),
+        )
+
+    with tempfile.TemporaryFile() as destino:
+        try:
+            with importacion.archivo.open('rb') as archivo:
+                resumen = importador.preview(
+                    archivo, importacion.reemplazar_existentes, destino=destino, progress=progreso,
+                )
+        except Exception as e:
+            logger.exception('Vista previa %s falló', importacion.pk)
+            resumen = {'success': False, 'error': str(e)}
+        if not resumen['success']:
+            return _finalizar(importacion, 'ERROR', mensaje=resumen['error'])
+        destino.seek(0)
+        importacion.previa.save(f'{importacion.pk}.jsonl', File(destino), save=False)
+
+    importacion.filas_leidas = importacion.total_filas = resumen['total_rows']
+    importacion.omitidos = resumen['error_count']
+    importacion.errores = [
+        f"Fila {e['fila']}: {e['error']}" for e in resumen['errors'][:MAXIMO_ERRORES_GUARDADOS]
+    ]
+    resumen['errors'] = resumen['errors'][:MAXIMO_ERRORES_GUARDADOS]
+    importacion.resultado = {k: v for k, v in resumen.items() if k != 'success'}
+    importacion.estado = 'PREVIA'
+    importacion.save()
+    return importacion
+
+
+def nombre_worker():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def ejecutar_importacion(importacion):
+    """Procesar una importación ya reclamada y registrar el resultado.
+
+    El avance se guarda tras cada bloque confirmado por el importador, por lo
+    que es visible de inmediato para el endpoint de consulta.
+    """
+    if importacion.usuario is None:
+        return _finalizar(importacion, 'ERROR', mensaje='El usuario que subió el archivo ya no existe')
+    if importacion.solo_validar:
+        return previsualizar(importacion)
+
+    importador = AbastecimientoExcelImporter(importacion.usuario)
+
+    def progreso(filas_leidas, total_filas):
+        importacion.total_filas = total_filas
+        ImportacionAbastecimiento.objects.filter(pk=importacion.pk).update(
+            filas_leidas=filas_leidas,
+            total_filas=total_filas,
+            creados=importador.inserted_count,
+            omitidos=importador.skip_count,
+            eliminados=importador.deleted_count,
+            updated_at=timezone.now(),
+        )
+
+    try:
+        if importacion.previa:
+            # Vista previa confirmada: importar las filas ya validadas
+            with importacion.previa.open('rb') as previa:
+                resultado = importador.process_preview(
+                    previa, importacion.reemplazar_existentes, progress=progreso, total_filas=importacion.total_filas,
+                )
+        else:
+            with importacion.archivo.open('rb') as archivo:
+                resultado = importador.process_excel(archivo, importacion.reemplazar_existentes, progress=progreso)
+    except Exception as e:
+        logger.exception('Importación %s falló', importacion.pk)
+        resultado = {'success': False, 'error': str(e)}
+
+    importacion.filas_leidas = importador.rows_read
+    importacion.creados = importador.inserted_count
+    importacion.omitidos = importador.skip_count
+    importacion.eliminados = importador.deleted_count
+    importacion.errores = importador.errors[:MAXIMO_ERRORES_GUARDADOS]
+    if not resultado['success']:
+        mensaje = resultado['error']
+        if 'pares_completos' in resultado:
+            # Pares ya confirmados antes del error: volver a importar el archivo los reemplaza
+            importacion.resultado = {
+                'pares_completos': resultado['pares_completos'],
+                'pares_incompletos': resultado['pares_incompletos'],
+            }
+            if resultado['pares_incompletos']:
+                mensaje += '. Quedaron cargados a medias: ' + ', '.join(resultado['pares_incompletos'])
+        return _finalizar(importacion, 'ERROR', mensaje=mensaje)
+    importacion.resultado = {
+        'insertados': resultado['inserted_count'],
+        'actualizados': resultado['updated_count'],
+        'sin_cambios': resultado['unchanged_count'],
+        'meses_procesados': resultado['meses_procesados'],
+        'contratos_procesados': resultado['contratos_procesados'],
+    }
+    return _finalizar(importacion, 'COMPLETADO')
+
+
+def _finalizar(importacion, estado, mensaje=''):
+    if importacion.previa:
+        importacion.previa.delete(save=False)
+    importacion.estado = estado
+    importacion.mensaje = mensaje
+    importacion.finalizado_at = timezone.now()
+    importacion.save()
+    return importacion
+
+
+def procesar_pendientes(worker=None, maximo=None):
+    """Procesar importaciones pendientes hasta vaciar la cola (o `maximo`). Retorna cuántas se procesaron."""
+    worker = worker or nombre_worker()
+    procesadas = 0
+    while maximo is None or procesadas < maximo:
+        importacion = ImportacionAbastecimiento.reclamar(worker)
+        if importacion is None:
+            break
+        with latido(importacion):
+            ejecutar_importacion(importacion)
+        procesadas += 1
+    return procesadas
+
+
+@contextmanager
+def latido(importacion, intervalo=None):
+    """Actualizar `latido_at` cada `intervalo` segundos desde un hilo mientras dura el bloque `with`.
+
+    El latido no depende del avance del importador: un bloque lento no hace
+    que `liberar_colgadas` entregue la importación a otro worker.
+    """
+    if intervalo is None:
+        intervalo = getattr(settings, 'IMPORTACION_LATIDO_SEGUNDOS', 30)
+    detener = threading.Event()
+
+    def latir():
+        try:
+            while not detener.wait(intervalo):
+                try:
+                    ImportacionAbastecimiento.latir(importacion.pk, importacion.worker)
+                except Exception:
+                    logger.exception('No se pudo registrar el latido de la importación %s', importacion.pk)
+        finally:
+            # El hilo abre su propia conexión: no dejarla abierta
+            connections.close_all()
+
+    hilo = threading.Thread(target=latir, name=f'latido-importacion-{importacion.pk}', daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        detener.set()
+        hilo.join()
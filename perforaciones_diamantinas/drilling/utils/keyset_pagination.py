@@ -0,0 +1,158 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+
+class KeysetPage:
+    """Página de una paginación por cursor (interfaz mínima compatible con `Page`)."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        # Total de registros si se pidió (exacto o estimado); None si no se cuenta
+        self.count = None
+        self.next_query = ''
+        self.previous_query = ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Paginación por cursor sobre un orden único, p. ej. ('-fecha', '-id').
+
+    En lugar de COUNT(*) + OFFSET, cada página filtra a partir de los valores
+    de orden del último (o primer) registro visto, de modo que la página 1 y
+    la página 5.000 cuestan lo mismo si hay un índice que cubra el orden. El
+    último campo debe desempatar (normalmente 'id').
+
+    Los cursores son opacos: base64 de los valores de orden y la dirección
+    ('n' siguiente, 'p' anterior). Un cursor inválido devuelve la primera página.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-fecha', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering)
+        self.campos = [campo.lstrip('-') for campo in self.ordering]
+
+    def get_page(self, cursor=None):
+        try:
+            valores, direccion = self._decodificar(cursor) if cursor else (None, 'n')
+        except (ValueError, TypeError, KeyError, ValidationError):
+            # to_python() lanza ValidationError con valores manipulados
+            valores, direccion = None, 'n'
+
+        atras = direccion == 'p'
+        orden = [self._invertir(campo) for campo in self.ordering] if atras else self.ordering
+        queryset = self.queryset.order_by(*orden)
+        if valores is not None:
+            queryset = queryset.filter(self._despues_de(orden, valores))
+        filas = list(queryset[:self.per_page + 1])
+        hay_mas = len(filas) > self.per_page
+        filas = filas[:self.per_page]
+        if atras:
+            filas.reverse()
+
+        if not filas:
+            return KeysetPage(filas)
+        primera, ultima = self._codificar(filas[0], 'p'), self._codificar(filas[-1], 'n')
+        if atras:
+            return KeysetPage(filas, next_cursor=ultima, previous_cursor=primera if hay_mas else None)
+        return KeysetPage(filas, next_cursor=ultima if hay_mas else None,
+                          previous_cursor=primera if valores is not None else None)
+
+    @staticmethod
+    def _invertir(campo):
+        return campo[1:] if campo.startswith('-') else f'-{campo}'
+
+    def _despues_de(self, orden, valores):
+        """Condición lexicográfica: filas posteriores a `valores` según `orden`."""
+        condicion = Q()
+        for i, campo in enumerate(orden):
+            nombre = campo.lstrip('-')
+            paso = Q(**{f'{nombre}__{"lt" if campo.startswith("-") else "gt"}': valores[i]})
+            for anterior, valor in zip(self.campos[:i], valores[:i]):
+                paso &= Q(**{anterior: valor})
+            condicion |= paso
+        return condicion
+
+    def _valor(self, obj, campo):
+        for parte in campo.split('__'):
+            obj = getattr(obj, parte)
+        return obj
+
+    def _codificar(self, obj, direccion):
+        valores = [self._valor(obj, campo) for campo in self.campos]
+        datos = json.dumps({'v': valores, 'd': direccion}, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+    def _decodificar(self, cursor):
+        relleno = '=' * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        valores = datos['v']
+        if len(valores) != len(self.campos) or datos['d'] not in ('n', 'p'):
+            raise ValueError('Cursor inválido')
+        modelo = self.queryset.model
+        convertidos = []
+        for campo, valor in zip(self.campos, valores):
+            convertidos.append(self._campo_modelo(modelo, campo).to_python(valor))
+        return convertidos, datos['d']
+
+    @staticmethod
+    def _campo_modelo(modelo, campo):
+        *relaciones, nombre = campo.split('__')
+        for relacion in relaciones:
+            modelo = modelo._meta.get_field(relacion).related_model
+        return modelo._meta.get_field(nombre)
+
+
+def contar_estimado(queryset):
+    """Cantidad aproximada de filas: estimación del planificador en PostgreSQL, COUNT(*) en otros motores."""
+    conexion = connections[queryset.db]
+    if conexion.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with conexion.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def paginar_keyset(request, queryset, per_page, ordering=('-fecha', '-id'), contar=None, parametro='cursor'):
+    """Página del cursor recibido en `request.GET[parametro]`.
+
+    `contar` agrega el total en `page.count`: 'exacto' (COUNT(*)), 'estimado'
+    (`contar_estimado`) o None para no contar. `next_query`/`previous_query`
+    son la query string de los enlaces, conservando los demás filtros.
+    """
+    page = KeysetPaginator(queryset, per_page, ordering).get_page(request.GET.get(parametro))
+    parametros = request.GET.copy()
+    parametros.pop('page', None)
+    for atributo, cursor in (('next_query', page.next_cursor), ('previous_query', page.previous_cursor)):
+        if cursor is not None:
+            parametros[parametro] = cursor
+            setattr(page, atributo, parametros.urlencode())
+    if contar == 'exacto':
+        page.count = queryset.count()
+    elif contar == 'estimado':
+        page.count = contar_estimado(queryset)
+    return page
@@ -0,0 +1,137 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from ..models import Contrato, ContratoActividad, TipoActividad, TipoAditivo, TipoComplemento, TipoTurno, UnidadMedida
+
+# Tablas de referencia: nombre -> (modelo, orden, relacionados)
+TABLAS = {
+    'tipos_turno': (TipoTurno, ('pk',), ()),
+    'tipos_actividad': (TipoActividad, ('pk',), ()),
+    'tipos_complemento': (TipoComplemento, ('pk',), ()),
+    'tipos_aditivo': (TipoAditivo, ('pk',), ('unidad_medida_default',)),
+    'unidades_medida': (UnidadMedida, ('pk',), ()),
+}
+# Tablas que guardan instancias relacionadas de otra (select_related)
+DEPENDIENTES = {'unidades_medida': ('tipos_aditivo',)}
+PREFIJO = 'refdata'
+
+
+def _cache():
+    return caches[getattr(settings, 'REFERENCE_DATA_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'REFERENCE_DATA_TIMEOUT', 3600)
+
+
+def version(nombre):
+    """Versión vigente de `nombre` (una tabla de TABLAS u otro dato cacheado).
+
+    Si la clave de versión no existe (primer uso o desalojo) se inicializa con
+    la hora en milisegundos, no con 1, para no reutilizar entradas de datos de
+    una versión anterior que sigan en la caché.
+    """
+    cache = _cache()
+    clave = f'{PREFIJO}:version:{nombre}'
+    valor = cache.get(clave)
+    if valor is None:
+        cache.add(clave, int(time.time() * 1000), None)
+        valor = cache.get(clave)
+    return valor
+
+
+def invalidar(nombre):
+    """Descartar la versión cacheada de `nombre` (las entradas viejas expiran solas)."""
+    cache = _cache()
+    clave = f'{PREFIJO}:version:{nombre}'
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.set(clave, int(time.time() * 1000), None)
+
+
+def cargar(clave, construir):
+    """Valor cacheado en `clave`; si falta se calcula con `construir()` y se guarda."""
+    cache = _cache()
+    datos = cache.get(clave)
+    if datos is None:
+        datos = construir()
+        cache.set(clave, datos, _timeout())
+    return datos
+
+
+def tabla(nombre):
+    """Lista de instancias de la tabla de referencia `nombre` (ver TABLAS)."""
+    modelo, orden, relacionados = TABLAS[nombre]
+
+    def construir():
+        return list(modelo.objects.select_related(*relacionados).order_by(*orden))
+
+    return cargar(f'{PREFIJO}:{nombre}:v{version(nombre)}', construir)
+
+
+def actividades_contrato(contrato):
+    """Actividades asignadas a `contrato` (instancia o pk) vía `contratos_actividades`."""
+    contrato_id = getattr(contrato, 'pk', contrato)
+    if contrato_id is None:
+        return []
+
+    def construir():
+        return list(TipoActividad.objects.filter(contratos=contrato_id).order_by('pk'))
+
+    # Depende de la versión de la tabla y de la de asignaciones
+    version_actual = f"{version('tipos_actividad')}.{version('contratos_actividades')}"
+    return cargar(f'{PREFIJO}:contratos_actividades:{contrato_id}:v{version_actual}', construir)
+
+
+def invalidar_al_confirmar(*nombres):
+    """Invalidar `nombres` ahora y otra vez al confirmar la transacción en curso.
+
+    La segunda vez cubre lecturas hechas dentro de la misma transacción, que
+    pudieron cachear filas que otros workers aún no veían.
+    """
+    def invalidar_todos():
+        for nombre in nombres:
+            invalidar(nombre)
+
+    invalidar_todos()
+    transaction.on_commit(invalidar_todos)
+
+
+def invalidar_modelos(*modelos):
+    """Invalidar las tablas de `modelos` (y sus dependientes) tras escrituras sin señales.
+
+    bulk_create, bulk_update y QuerySet.update() no emiten post_save: quien
+    los use sobre tablas de referencia debe llamar a esta función.
+    """
+    nombres = set()
+    for nombre, (modelo, _, _) in TABLAS.items():
+        if modelo in modelos:
+            nombres.update((nombre, *DEPENDIENTES.get(nombre, ())))
+    if nombres:
+        invalidar_al_confirmar(*sorted(nombres))
+
+
+def _receptor(nombre):
+    def invalidar_tabla(sender, **kwargs):
+        invalidar_al_confirmar(nombre, *DEPENDIENTES.get(nombre, ()))
+    return invalidar_tabla
+
+
+def conectar_senales():
+    """Invalidar la caché al guardar o borrar filas de referencia (llamado desde DrillingConfig.ready)."""
+    modelos = [(modelo, nombre) for nombre, (modelo, _, _) in TABLAS.items()]
+    modelos.append((ContratoActividad, 'contratos_actividades'))
+    for modelo, nombre in modelos:
+        receptor = _receptor(nombre)
+        post_save.connect(receptor, sender=modelo, weak=False, dispatch_uid=f'{PREFIJO}:save:{nombre}')
+        post_delete.connect(receptor, sender=modelo, weak=False, dispatch_uid=f'{PREFIJO}:delete:{nombre}')
+    # add()/set()/remove() sobre Contrato.actividades no emiten post_save del modelo intermedio
+    m2m_changed.connect(
+        _receptor('contratos_actividades'), sender=Contrato.actividades.through, weak=False,
+        dispatch_uid=f'{PREFIJO}:m2m:contratos_actividades',
+    )
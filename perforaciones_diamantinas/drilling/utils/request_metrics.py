@@ -0,0 +1,169 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# Medición del request en curso (contextvars: aislada por hilo y por tarea async)
+_medicion_actual = contextvars.ContextVar('medicion_request', default=None)
+_plantillas_instrumentadas = False
+
+
+class Medicion:
+    """Consultas, tiempo de BD, de plantillas y total de un request (segundos)."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo_db = 0.0
+        self.tiempo_plantillas = 0.0
+        self.tiempo_total = 0.0
+        self._profundidad_plantilla = 0
+
+    def server_timing(self):
+        """Valor del encabezado Server-Timing (duraciones en ms)."""
+        return (
+            f'db;dur={self.tiempo_db * 1000:.1f};desc="{self.consultas} consultas", '
+            f'tpl;dur={self.tiempo_plantillas * 1000:.1f}, '
+            f'total;dur={self.tiempo_total * 1000:.1f}'
+        )
+
+
+def _contar_consulta(execute, sql, params, many, context):
+    medicion = _medicion_actual.get()
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if medicion is not None:
+            medicion.consultas += 1
+            medicion.tiempo_db += time.perf_counter() - inicio
+
+
+@contextmanager
+def medir_request():
+    """Medir el bloque: consultas de todas las conexiones, plantillas y tiempo total."""
+    medicion = Medicion()
+    token = _medicion_actual.set(medicion)
+    inicio = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for conexion in connections.all():
+                stack.enter_context(conexion.execute_wrapper(_contar_consulta))
+            yield medicion
+    finally:
+        medicion.tiempo_total = time.perf_counter() - inicio
+        _medicion_actual.reset(token)
+
+
+def instrumentar_plantillas():
+    """Medir el render de plantillas Django envolviendo `Template.render` (una sola vez por proceso).
+
+    Solo se suma la plantilla más externa: {% include %} y {% extends %}
+    renderizan plantillas anidadas dentro de la misma llamada.
+    """
+    global _plantillas_instrumentadas
+    if _plantillas_instrumentadas:
+        return
+    from django.template.base import Template
+
+    render_original = Template.render
+
+    def render(self, context):
+        medicion = _medicion_actual.get()
+        if medicion is None:
+            return render_original(self, context)
+        medicion._profundidad_plantilla += 1
+        inicio = time.perf_counter()
+        try:
+            return render_original(self, context)
+        finally:
+            medicion._profundidad_plantilla -= 1
+            if medicion._profundidad_plantilla == 0:
+                medicion.tiempo_plantillas += time.perf_counter() - inicio
+
+    Template.render = render
+    _plantillas_instrumentadas = True
+
+
+def presupuesto_consultas(vista):
+    """Máximo de consultas esperado para `vista` (nombre de URL) según QUERY_BUDGETS."""
+    presupuestos = getattr(settings, 'QUERY_BUDGETS', {})
+    return presupuestos.get(vista, getattr(settings, 'QUERY_BUDGET_DEFAULT', 50))
+
+
+class EstadisticasVista:
+    def __init__(self, muestras):
+        self.requests = 0
+        self.consultas = 0
+        self.max_consultas = 0
+        self.tiempo_db = 0.0
+        self.tiempo_plantillas = 0.0
+        self.tiempo_total = 0.0
+        self.sobre_presupuesto = 0
+        self.tiempos = deque(maxlen=muestras)
+
+    def agregar(self, medicion, excedido):
+        self.requests += 1
+        self.consultas += medicion.consultas
+        self.max_consultas = max(self.max_consultas, medicion.consultas)
+        self.tiempo_db += medicion.tiempo_db
+        self.tiempo_plantillas += medicion.tiempo_plantillas
+        self.tiempo_total += medicion.tiempo_total
+        self.sobre_presupuesto += excedido
+        self.tiempos.append(medicion.tiempo_total)
+
+    def resumen(self, vista):
+        n = self.requests
+        tiempos = sorted(self.tiempos)
+        return {
+            'vista': vista,
+            'requests': n,
+            'consultas_promedio': round(self.consultas / n, 1),
+            'consultas_max': self.max_consultas,
+            'presupuesto': presupuesto_consultas(vista),
+            'sobre_presupuesto': self.sobre_presupuesto,
+            'db_ms_promedio': round(self.tiempo_db * 1000 / n, 1),
+            'plantillas_ms_promedio': round(self.tiempo_plantillas * 1000 / n, 1),
+            'total_ms_promedio': round(self.tiempo_total * 1000 / n, 1),
+            'total_ms_p95': round(tiempos[min(int(len(tiempos) * 0.95), len(tiempos) - 1)] * 1000, 1),
+        }
+
+
+class RequestMetrics:
+    """Estadísticas acumuladas por nombre de URL en memoria del proceso.
+
+    Cada proceso del servidor (p. ej. cada worker de gunicorn) lleva sus
+    propias cifras desde que arrancó; el p95 se calcula sobre las últimas
+    `muestras` duraciones de cada vista.
+    """
+
+    def __init__(self, muestras=500):
+        self.muestras = muestras
+        self._vistas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, vista, medicion):
+        """Acumular `medicion`. Retorna True si la vista superó su presupuesto de consultas."""
+        excedido = medicion.consultas > presupuesto_consultas(vista)
+        with self._lock:
+            estadisticas = self._vistas.get(vista)
+            if estadisticas is None:
+                estadisticas = self._vistas[vista] = EstadisticasVista(self.muestras)
+            estadisticas.agregar(medicion, excedido)
+        return excedido
+
+    def resumen(self):
+        """Una fila por vista, ordenadas por tiempo total de BD (las más costosas primero)."""
+        with self._lock:
+            filas = [(e.tiempo_db, e.resumen(vista)) for vista, e in self._vistas.items()]
+        return [fila for _, fila in sorted(filas, key=lambda f: f[0], reverse=True)]
+
+    def reiniciar(self):
+        with self._lock:
+            self._vistas.clear()
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.utils import timezone
+
+
+class SessionStore(DBSessionStore):
+    """Sesiones en BD que no reescriben `django_session` en cada request.
+
+    Con SESSION_SAVE_EVERY_REQUEST el middleware guarda la sesión en cada
+    respuesta para deslizar la expiración. Aquí, si los datos no cambiaron,
+    la fila solo se reescribe cuando se guardó hace más de
+    SESSION_REFRESH_MARGIN segundos, así hay a lo sumo una escritura por
+    margen.
+
+    `expire_date` de la fila es siempre la del último request que la
+    escribió más SESSION_COOKIE_AGE, y al cargar la sesión Django descarta
+    las vencidas: el servidor nunca acepta una sesión más de
+    SESSION_COOKIE_AGE después del último request (puede vencer hasta
+    SESSION_REFRESH_MARGIN antes, si los últimos requests no escribieron).
+    La cookie se reenvía en cada respuesta con Max-Age = SESSION_COOKIE_AGE.
+    """
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._expira_bd = None
+
+    @staticmethod
+    def _margen():
+        return timedelta(seconds=getattr(settings, 'SESSION_REFRESH_MARGIN', 600))
+
+    def _get_session_from_db(self):
+        s = super()._get_session_from_db()
+        self._expira_bd = s.expire_date if s else None
+        return s
+
+    def save(self, must_create=False):
+        if (
+            not must_create
+            and not self.modified
+            and self.session_key is not None
+            and self._expira_bd is not None
+            and self.get('_session_expiry') is None
+            and self._expira_bd - timezone.now() > timedelta(seconds=self.get_expiry_age()) - self._margen()
+        ):
+            # Sin cambios y la fila se escribió hace menos de un margen
+            return
+        super().save(must_create)
+        self._expira_bd = self.get_expiry_date()
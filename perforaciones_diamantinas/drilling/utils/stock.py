@@ -0,0 +1,233 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import Abastecimiento, ConsumoStock, StockBalance
+
+
+def abastecimientos_con_stock(queryset=None):
+    """Anotar `consumido` y `disponible` en un queryset de Abastecimiento.
+
+    El consumo se agrega en la misma consulta (LEFT JOIN + GROUP BY), sin una
+    query adicional por línea de abastecimiento. Es la fuente de verdad con la
+    que se reconstruyen y verifican los saldos de StockBalance.
+    """
+    if queryset is None:
+        queryset = Abastecimiento.objects.all()
+    cero = models.Value(Decimal('0'), output_field=models.DecimalField(max_digits=10, decimal_places=2))
+    return queryset.annotate(
+        consumido=Coalesce(models.Sum('consumostock__cantidad_consumida'), cero),
+    ).annotate(
+        disponible=models.ExpressionWrapper(
+            models.F('cantidad') - models.F('consumido'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+def reconstruir_balances(queryset=None, batch_size=1000):
+    """Regenerar StockBalance desde el historial de consumos.
+
+    Recalcula las líneas de `queryset` (todas por defecto) con una consulta
+    agrupada y actualiza sus saldos. Todo ocurre en una transacción que
+    primero crea los saldos faltantes y bloquea los de las líneas (FOR UPDATE,
+    en orden de pk como `reservar_stock`), así un consumo registrado en
+    paralelo espera o ya está en el historial al calcular. Retorna la
+    cantidad de saldos escritos.
+    """
+    if queryset is None:
+        queryset = Abastecimiento.objects.all()
+    with transaction.atomic():
+        _crear_faltantes(queryset.filter(balance__isnull=True), batch_size=batch_size)
+        list(
+            StockBalance.objects.select_for_update().filter(abastecimiento__in=queryset)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        balances = [
+            StockBalance(**StockBalance._valores(a, a.consumido))
+            for a in abastecimientos_con_stock(queryset).iterator()
+        ]
+        StockBalance.objects.bulk_update(
+            balances, ['contrato', 'precio_unitario', 'cantidad_consumida', 'cantidad_disponible', 'valor_disponible'],
+            batch_size=batch_size,
+        )
+    return len(balances)
+
+
+def _crear_faltantes(abastecimientos, batch_size=None):
+    """Crear desde el historial el saldo de `abastecimientos` que aún no lo tengan.
+
+    INSERT ... ON CONFLICT DO NOTHING: si otra transacción crea el mismo saldo
+    en paralelo se conserva el suyo en lugar de fallar con IntegrityError.
+    """
+    balances = [
+        StockBalance(**StockBalance._valores(a, a.consumido))
+        for a in abastecimientos_con_stock(abastecimientos)
+    ]
+    StockBalance.objects.bulk_create(balances, batch_size=batch_size, ignore_conflicts=True)
+
+
+def verificar_balances(queryset=None):
+    """Comparar los saldos guardados con el historial de consumos.
+
+    Retorna una lista de (abastecimiento_id, esperado, registrado) con las
+    líneas cuyo disponible no coincide; `registrado` es None si falta el saldo.
+    """
+    if queryset is None:
+        queryset = Abastecimiento.objects.all()
+    registrados = dict(
+        StockBalance.objects.filter(abastecimiento__in=queryset).values_list(
+            'abastecimiento_id', 'cantidad_disponible'
+        )
+    )
+    diferencias = []
+    for pk, disponible in abastecimientos_con_stock(queryset).values_list('pk', 'disponible').iterator():
+        registrado = registrados.get(pk)
+        if registrado is None or registrado != disponible:
+            diferencias.append((pk, disponible, registrado))
+    return diferencias
+
+
+def balance_de(abastecimiento):
+    """Saldo de una línea; lo crea desde el historial si todavía no existe."""
+    try:
+        return StockBalance.objects.get(pk=abastecimiento.pk)
+    except StockBalance.DoesNotExist:
+        StockBalance.sincronizar(abastecimiento)
+        return StockBalance.objects.get(pk=abastecimiento.pk)
+
+
+def reservar_stock(consumos):
+    """Registrar un lote de consumos descontando el stock de forma atómica.
+
+    `consumos` son instancias de ConsumoStock sin guardar (p. ej. todos los
+    consumos de un turno). Dentro de una única transacción se bloquean con
+    SELECT ... FOR UPDATE los saldos involucrados (en orden de pk, para no
+    generar deadlocks entre lotes), se verifica que alcance el stock para el
+    total pedido por línea y recién entonces se insertan los consumos y se
+    descuentan los saldos. Dos registros concurrentes sobre la misma línea
+    quedan serializados por el bloqueo, por lo que el stock nunca queda
+    negativo.
+
+    Lanza ValidationError si alguna cantidad no es positiva o si falta stock;
+    en ese caso no se guarda ningún consumo. Retorna los consumos creados.
+    """
+    consumos = list(consumos)
+    if not consumos:
+        return []
+
+    solicitado = {}
+    for consumo in consumos:
+        if consumo.cantidad_consumida is None or consumo.cantidad_consumida <= 0:
+            raise ValidationError('La cantidad consumida debe ser mayor a cero')
+        solicitado[consumo.abastecimiento_id] = (
+            solicitado.get(consumo.abastecimiento_id, Decimal('0')) + consumo.cantidad_consumida
+        )
+
+    with transaction.atomic():
+        balances = _bloquear_balances(solicitado)
+        _verificar_disponible(balances, solicitado)
+
+        for consumo in consumos:
+            consumo.calcular_metros()
+        creados = ConsumoStock.objects.bulk_create(consumos)
+
+        # Los saldos están bloqueados: se calculan en Python y se escriben juntos
+        ahora = timezone.now()
+        for abastecimiento_id, cantidad in solicitado.items():
+            balance = balances[abastecimiento_id]
+            balance.cantidad_consumida += cantidad
+            balance.cantidad_disponible -= cantidad
+            balance.valor_disponible = (balance.cantidad_disponible * balance.precio_unitario).quantize(Decimal('0.01'))
+            balance.updated_at = ahora
+        StockBalance.objects.bulk_update(
+            balances.values(), ['cantidad_consumida', 'cantidad_disponible', 'valor_disponible', 'updated_at'],
+        )
+    return creados
+
+
+def actualizar_consumo(consumo):
+    """Guardar la edición de un consumo ya registrado verificando el stock.
+
+    Como `reservar_stock`, pero para cambios de cantidad o de línea: bloquea
+    el consumo y los saldos de la línea anterior y la nueva, verifica que
+    alcance el stock para lo que se agrega (la diferencia, o la cantidad
+    completa si cambió de línea) y recién entonces guarda; `ConsumoStock.save`
+    aplica la diferencia a los saldos ya bloqueados.
+
+    Lanza ValidationError si la cantidad no es positiva o si falta stock; en
+    ese caso el consumo no se modifica. Retorna el consumo.
+    """
+    if consumo.cantidad_consumida is None or consumo.cantidad_consumida <= 0:
+        raise ValidationError('La cantidad consumida debe ser mayor a cero')
+
+    with transaction.atomic():
+        anterior_id, anterior_cantidad = ConsumoStock.objects.select_for_update().filter(
+            pk=consumo.pk
+        ).values_list('abastecimiento_id', 'cantidad_consumida').get()
+        solicitado = {anterior_id: -anterior_cantidad}
+        solicitado[consumo.abastecimiento_id] = (
+            solicitado.get(consumo.abastecimiento_id, Decimal('0')) + consumo.cantidad_consumida
+        )
+        balances = _bloquear_balances(solicitado)
+        _verificar_disponible(balances, {pk: cantidad for pk, cantidad in solicitado.items() if cantidad > 0})
+        consumo.save()
+    return consumo
+
+
+def _verificar_disponible(balances, solicitado):
+    """Lanzar ValidationError si algún saldo bloqueado no cubre lo `solicitado` por línea."""
+    faltantes = []
+    for abastecimiento_id, cantidad in solicitado.items():
+        balance = balances.get(abastecimiento_id)
+        disponible = balance.cantidad_disponible if balance else Decimal('0')
+        if cantidad > disponible:
+            faltantes.append((abastecimiento_id, disponible))
+    if faltantes:
+        raise ValidationError([
+            ValidationError(
+                'Stock insuficiente. Disponible: %(disponible)s',
+                code='stock_insuficiente',
+                params={'abastecimiento': pk, 'disponible': disponible},
+            )
+            for pk, disponible in faltantes
+        ])
+
+
+def _bloquear_balances(abastecimiento_ids):
+    """Bloquear (FOR UPDATE) los saldos de las líneas, creando los que falten."""
+    ids = sorted(abastecimiento_ids)
+    bloqueados = StockBalance.objects.select_for_update().filter(pk__in=ids).order_by('pk')
+    balances = {b.pk: b for b in bloqueados}
+    faltantes = [pk for pk in ids if pk not in balances]
+    if faltantes:
+        _crear_faltantes(Abastecimiento.objects.filter(pk__in=faltantes))
+        balances.update(
+            (b.pk, b) for b in StockBalance.objects.select_for_update().filter(pk__in=faltantes).order_by('pk')
+        )
+    return balances
+
+
+def stock_critico(contrato, umbral=None, limite=None):
+    """Líneas de abastecimiento del contrato con stock disponible <= `umbral`.
+
+    Lee los saldos materializados por el índice (contrato, cantidad_disponible)
+    y devuelve las `limite` más críticas (menor disponible primero), con el
+    disponible anotado como `disponible`.
+    Por defecto usa STOCK_CRITICO_UMBRAL y STOCK_CRITICO_LIMITE de settings.
+    """
+    if umbral is None:
+        umbral = getattr(settings, 'STOCK_CRITICO_UMBRAL', 5)
+    if limite is None:
+        limite = getattr(settings, 'STOCK_CRITICO_LIMITE', 10)
+    queryset = Abastecimiento.objects.filter(
+        balance__contrato=contrato,
+        balance__cantidad_disponible__lte=umbral,
+    ).select_related('unidad_medida').annotate(
+        disponible=models.F('balance__cantidad_disponible'),
+    )
+    return list(queryset.order_by('disponible', 'descripcion')[:limite])
@@ -0,0 +1,331 @@
+import random
+import time as reloj
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import models, transaction
+
+from ..models import (
+    Abastecimiento, Cliente, ConsumoStock, Contrato, HorometroMovimiento, Maquina, Sondaje, TipoActividad,
+    TipoAditivo, TipoComplemento, TipoTurno, Trabajador, Turno, TurnoActividad, TurnoAditivo, TurnoAvance,
+    TurnoComplemento, TurnoCorrida, TurnoMaquina, TurnoSondaje, TurnoTrabajador, UnidadMedida,
+)
+from . import form_options, reference_cache
+from .stock import reconstruir_balances
+
+MESES = [
+    'ENERO', 'FEBRERO', 'MARZO', 'ABRIL', 'MAYO', 'JUNIO',
+    'JULIO', 'AGOSTO', 'SETIEMBRE', 'OCTUBRE', 'NOVIEMBRE', 'DICIEMBRE',
+]
+LITOLOGIAS = ['Andesita', 'Diorita', 'Granodiorita', 'Brecha hidrotermal', 'Tufo', 'Cuarcita', 'Pórfido']
+HORA_INICIO = [time(7), time(19), time(3)]
+
+
+def _d(valor):
+    return Decimal(str(round(valor, 2)))
+
+
+class GeneradorDatosSinteticos:
+    """Generación reproducible de contratos con años de turnos para pruebas de carga.
+
+    Todo se deriva de `random.Random(seed)` y de la fecha `hasta`, así que la
+    misma combinación produce exactamente los mismos datos. Los turnos se
+    simulan por máquina y día (un turno por tipo de turno) y se insertan en
+    bloques de `dias_por_bloque` días, cada uno en su transacción y con
+    bulk_create en lotes de `batch_size` filas.
+
+    Cada turno recibe sus filas hijas habituales: sondaje y avance, cuadrilla,
+    actividades que cubren la duración del turno, corridas con la profundidad
+    del sondaje, estado de máquina y horómetro, aditivos, a veces un
+    complemento y consumos de stock de las líneas de abastecimiento ya
+    recibidas en el contrato (sin dejar saldos negativos).
+    """
+
+    def __init__(self, seed=42, contratos=2, maquinas=4, trabajadores=40, dias=365, turnos_por_dia=2,
+                 abastecimientos_por_mes=30, prefijo='SINT', hasta=None, batch_size=5000, dias_por_bloque=30,
+                 log=None):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.n_contratos = contratos
+        self.n_maquinas = maquinas
+        self.n_trabajadores = trabajadores
+        self.dias = dias
+        self.turnos_por_dia = turnos_por_dia
+        self.abastecimientos_por_mes = abastecimientos_por_mes
+        self.prefijo = prefijo
+        self.hasta = hasta or date.today()
+        self.desde = self.hasta - timedelta(days=dias - 1)
+        self.batch_size = batch_size
+        self.dias_por_bloque = dias_por_bloque
+        self.log = log or (lambda mensaje: None)
+        self.conteos = {}
+
+    def generar(self):
+        """Crear todo el conjunto de datos. Retorna {nombre de modelo: filas creadas}."""
+        nombre_base = f'{self.prefijo} {self.seed}-'
+        if Contrato.objects.filter(nombre_contrato__startswith=nombre_base).exists():
+            raise ValueError(f"Ya existen contratos '{nombre_base}*': use otro seed o prefijo")
+
+        inicio = reloj.perf_counter()
+        self._catalogos()
+        with transaction.atomic():
+            contratos = self._contratos(nombre_base)
+        self.log(f'{len(contratos)} contratos con máquinas, trabajadores y abastecimientos')
+
+        dia = self.desde
+        while dia <= self.hasta:
+            fin = min(dia + timedelta(days=self.dias_por_bloque - 1), self.hasta)
+            with transaction.atomic():
+                self._bloque_turnos(contratos, dia, fin)
+            self.log(f'Turnos hasta {fin}: {self.conteos.get("Turno", 0)} ({reloj.perf_counter() - inicio:.0f} s)')
+            dia = fin + timedelta(days=1)
+
+        with transaction.atomic():
+            self._cerrar(contratos)
+        return self.conteos
+
+    def _crear(self, modelo, objetos):
+        creados = modelo.objects.bulk_create(objetos, batch_size=self.batch_size)
+        self.conteos[modelo.__name__] = self.conteos.get(modelo.__name__, 0) + len(creados)
+        return creados
+
+    def _catalogos(self):
+        """Tablas de referencia mínimas si la BD está vacía (load_initial_data crea las completas)."""
+        creadas = []
+        if not TipoTurno.objects.exists():
+            creadas.append(TipoTurno)
+            TipoTurno.objects.bulk_create([TipoTurno(nombre='Día'), TipoTurno(nombre='Noche')])
+        if not TipoActividad.objects.exists():
+            creadas.append(TipoActividad)
+            TipoActividad.objects.bulk_create([
+                TipoActividad(nombre='Perforación', tipo_actividad='OPERATIVO'),
+                TipoActividad(nombre='Cambio de broca', tipo_actividad='OPERATIVO'),
+                TipoActividad(nombre='Mantenimiento preventivo', tipo_actividad='INOPERATIVO'),
+                TipoActividad(nombre='Stand by cliente', tipo_actividad='STAND_BY_CLIENTE'),
+            ])
+        if not UnidadMedida.objects.exists():
+            creadas.append(UnidadMedida)
+            UnidadMedida.objects.bulk_create([
+                UnidadMedida(nombre='Kilogramos', simbolo='kg'), UnidadMedida(nombre='Unidades', simbolo='und'),
+            ])
+        unidad = UnidadMedida.objects.order_by('pk').first()
+        if not TipoComplemento.objects.exists():
+            creadas.append(TipoComplemento)
+            TipoComplemento.objects.bulk_create([
+                TipoComplemento(nombre='Broca Diamantada HQ', categoria='BROCA'),
+                TipoComplemento(nombre='Reaming Shell HQ', categoria='REAMING_SHELL'),
+            ])
+        if not TipoAditivo.objects.exists():
+            creadas.append(TipoAditivo)
+            TipoAditivo.objects.bulk_create([
+                TipoAditivo(nombre='Bentonita', categoria='BENTONITA', unidad_medida_default=unidad),
+                TipoAditivo(nombre='Polímero PAC', categoria='POLIMEROS', unidad_medida_default=unidad),
+            ])
+
+        # bulk_create no emite post_save: invalidar las tablas cacheadas a mano
+        reference_cache.invalidar_modelos(*creadas)
+
+        # Orden por pk para que la misma semilla elija siempre los mismos registros
+        self.tipos_turno = list(TipoTurno.objects.order_by('pk')[:self.turnos_por_dia])
+        self.actividades = list(TipoActividad.objects.order_by('pk'))
+        self.unidades = list(UnidadMedida.objects.order_by('pk'))
+        self.complementos = list(TipoComplemento.objects.order_by('pk'))
+        self.aditivos = list(TipoAditivo.objects.order_by('pk'))
+
+    def _contratos(self, nombre_base):
+        cliente = Cliente.objects.create(nombre=f'{self.prefijo} Cliente {self.seed}')
+        contratos = self._crear(Contrato, [
+            Contrato(cliente=cliente, nombre_contrato=f'{nombre_base}{i + 1:02d}', duracion_turno=12)
+            for i in range(self.n_contratos)
+        ])
+        maquinas = self._crear(Maquina, [
+            Maquina(contrato=c, nombre=f'{c.nombre_contrato} PERF-{i + 1:02d}', tipo=self.rng.choice(['LF-90', 'CS-14']))
+            for c in contratos for i in range(self.n_maquinas)
+        ])
+        trabajadores = self._crear(Trabajador, [
+            Trabajador(
+                contrato=c, nombres=f'Trabajador {i + 1:04d}', apellidos=c.nombre_contrato,
+                cargo='PERFORISTA DDH' if i % 3 == 0 else 'AYUDANTE',
+                dni=f'{self.prefijo[:4]}{self.seed}-{ci}-{i}', fecha_ingreso=self.desde,
+            )
+            for ci, c in enumerate(contratos) for i in range(self.n_trabajadores)
+        ])
+        aperturas = self._crear(HorometroMovimiento, [
+            HorometroMovimiento(
+                maquina=m, fecha=self.desde, horas=_d(self.rng.uniform(1000, 20000)), tipo='APERTURA',
+            ) for m in maquinas
+        ])
+        horometros = {a.maquina_id: a.horas for a in aperturas}
+
+        self.estado = {}
+        for c in contratos:
+            propias = [t for t in trabajadores if t.contrato_id == c.pk]
+            self.estado[c.pk] = {
+                'maquinas': {
+                    m.pk: {'maquina': m, 'sondaje': None, 'profundidad': 0.0, 'horometro': horometros[m.pk]}
+                    for m in maquinas if m.contrato_id == c.pk
+                },
+                'perforistas': [t for t in propias if t.cargo == 'PERFORISTA DDH'],
+                'ayudantes': [t for t in propias if t.cargo == 'AYUDANTE'],
+                'sondajes': 0,
+                'stock': self._abastecimientos(c),
+            }
+        self.sondajes_finalizados = []
+        return contratos
+
+    def _abastecimientos(self, contrato):
+        """Líneas de abastecimiento de cada mes del período. Retorna [abastecimiento, fecha, disponible]."""
+        lineas = []
+        mes = self.desde.replace(day=1)
+        while mes <= self.hasta:
+            for i in range(self.abastecimientos_por_mes):
+                familia = self.rng.choice([f for f, _ in Abastecimiento.FAMILIA_CHOICES])
+                cantidad = _d(self.rng.randint(20, 200))
+                precio = _d(self.rng.uniform(5, 500))
+                lineas.append(Abastecimiento(
+                    mes=MESES[mes.month - 1], fecha=mes, contrato=contrato,
+                    codigo_producto=f'P{self.rng.randint(1, 500):04d}', descripcion=f'{familia.title()} {i + 1:03d}',
+                    familia=familia, unidad_medida=self.rng.choice(self.unidades), cantidad=cantidad,
+                    precio_unitario=precio, total=cantidad * precio,
+                    tipo_complemento=self.rng.choice(self.complementos) if familia == 'PRODUCTOS_DIAMANTADOS' else None,
+                    tipo_aditivo=self.rng.choice(self.aditivos) if familia == 'ADITIVOS_PERFORACION' else None,
+                    numero_guia=f'G-{mes:%Y%m}-{i + 1:03d}',
+                ))
+            mes = (mes + timedelta(days=32)).replace(day=1)
+        creados = self._crear(Abastecimiento, lineas)
+        return [[a, a.fecha, a.cantidad] for a in creados]
+
+    def _bloque_turnos(self, contratos, desde, hasta):
+        filas = {modelo: [] for modelo in (
+            Sondaje, Turno, TurnoSondaje, TurnoAvance, TurnoMaquina, TurnoTrabajador, TurnoActividad,
+            TurnoCorrida, TurnoAditivo, TurnoComplemento, HorometroMovimiento, ConsumoStock,
+        )}
+        dia = desde
+        while dia <= hasta:
+            for contrato in contratos:
+                estado = self.estado[contrato.pk]
+                for maquina_estado in estado['maquinas'].values():
+                    for indice, tipo_turno in enumerate(self.tipos_turno):
+                        # Días de mantenimiento o sin frente disponible
+                        if self.rng.random() < 0.08:
+                            continue
+                        self._turno(contrato, estado, maquina_estado, dia, indice, tipo_turno, filas)
+            dia += timedelta(days=1)
+
+        # Padres primero: bulk_create asigna los pk que usan las filas hijas
+        for modelo, objetos in filas.items():
+            self._crear(modelo, objetos)
+
+    def _turno(self, contrato, estado, maquina_estado, dia, indice, tipo_turno, filas):
+        rng = self.rng
+        sondaje = maquina_estado['sondaje']
+        if sondaje is None:
+            estado['sondajes'] += 1
+            sondaje = Sondaje(
+                contrato=contrato, nombre_sondaje=f'DDH-{contrato.pk}-{estado["sondajes"]:04d}', fecha_inicio=dia,
+                profundidad=_d(rng.uniform(250, 1200)), inclinacion=_d(rng.uniform(-90, -45)),
+                cota_collar=_d(rng.uniform(3500, 4800)),
+            )
+            filas[Sondaje].append(sondaje)
+            maquina_estado.update(sondaje=sondaje, profundidad=0.0)
+
+        dias_atras = (self.hasta - dia).days
+        turno = Turno(
+            contrato=contrato, maquina=maquina_estado['maquina'], tipo_turno=tipo_turno, fecha=dia,
+            estado='APROBADO' if dias_atras > 7 else ('COMPLETADO' if dias_atras > 1 else 'BORRADOR'),
+        )
+        filas[Turno].append(turno)
+
+        # Corridas hasta completar el avance del turno o la profundidad del sondaje
+        desde = maquina_estado['profundidad']
+        profundidad = float(sondaje.profundidad)
+        corridas = []
+        for numero in range(1, rng.randint(3, 8) + 1):
+            if desde >= profundidad:
+                break
+            hasta = min(desde + rng.uniform(1.5, 3.0), profundidad)
+            recuperado = (hasta - desde) * rng.uniform(0.85, 1.0)
+            corridas.append(TurnoCorrida(
+                turno=turno, corrida_numero=numero, desde=_d(desde), hasta=_d(hasta), total_calc=_d(hasta) - _d(desde),
+                longitud_testigo=_d(recuperado), pct_recuperacion=_d(recuperado / (hasta - desde) * 100),
+                pct_retorno_agua=_d(rng.uniform(40, 100)), litologia=rng.choice(LITOLOGIAS),
+            ))
+            desde = hasta
+        metros = _d(desde) - _d(maquina_estado['profundidad'])
+        filas[TurnoCorrida].extend(corridas)
+        filas[TurnoSondaje].append(TurnoSondaje(turno=turno, sondaje=sondaje, metros_turno=metros))
+        filas[TurnoAvance].append(TurnoAvance(turno=turno, metros_perforados=metros))
+        if corridas and rng.random() < 0.3:
+            filas[TurnoComplemento].append(TurnoComplemento(
+                turno=turno, sondaje=sondaje, tipo_complemento=rng.choice(self.complementos),
+                codigo_serie=f'SN-{rng.randint(10000, 99999)}', metros_inicio=corridas[0].desde,
+                metros_fin=corridas[-1].hasta, metros_turno_calc=corridas[-1].hasta - corridas[0].desde,
+            ))
+        if desde >= profundidad:
+            sondaje.estado = 'FINALIZADO'
+            sondaje.fecha_fin = dia
+            self.sondajes_finalizados.append(sondaje)
+            maquina_estado['sondaje'] = None
+        else:
+            maquina_estado['profundidad'] = desde
+
+        # Cuadrilla: un perforista y dos ayudantes del contrato
+        cuadrilla = rng.sample(estado['perforistas'], 1) + rng.sample(estado['ayudantes'], 2)
+        filas[TurnoTrabajador].extend(
+            TurnoTrabajador(turno=turno, trabajador=t, funcion='PERFORISTA' if i == 0 else 'AYUDANTE')
+            for i, t in enumerate(cuadrilla)
+        )
+
+        # Actividades consecutivas que suman la duración del turno
+        inicio = datetime.combine(dia, HORA_INICIO[indice % len(HORA_INICIO)])
+        horas = contrato.duracion_turno
+        cortes = sorted(rng.sample(range(1, horas), rng.randint(1, 3)))
+        for desde_h, hasta_h in zip([0] + cortes, cortes + [horas]):
+            filas[TurnoActividad].append(TurnoActividad(
+                turno=turno, actividad=rng.choice(self.actividades),
+                hora_inicio=(inicio + timedelta(hours=desde_h)).time(),
+                hora_fin=(inicio + timedelta(hours=hasta_h)).time(), tiempo_calc=_d(hasta_h - desde_h),
+            ))
+
+        horas_maquina = _d(rng.uniform(horas - 2, horas))
+        horometro = maquina_estado['horometro']
+        maquina_estado['horometro'] = horometro + horas_maquina
+        filas[TurnoMaquina].append(TurnoMaquina(
+            turno=turno, hora_inicio=inicio.time(), hora_fin=(inicio + timedelta(hours=horas)).time(),
+            horometro_inicio=horometro, horometro_fin=horometro + horas_maquina, horas_trabajadas_calc=horas_maquina,
+            estado_bomba=rng.choice(['OPERATIVO'] * 8 + ['DEFICIENTE']),
+            estado_unidad=rng.choice(['OPERATIVO'] * 8 + ['DEFICIENTE']),
+            estado_rotacion=rng.choice(['OPERATIVO'] * 9 + ['INOPERATIVO']),
+        ))
+        filas[HorometroMovimiento].append(HorometroMovimiento(
+            maquina=maquina_estado['maquina'], turno=turno, fecha=dia, horas=horas_maquina,
+        ))
+
+        for tipo in rng.sample(self.aditivos, min(len(self.aditivos), rng.randint(1, 3))):
+            filas[TurnoAditivo].append(TurnoAditivo(
+                turno=turno, sondaje=sondaje, tipo_aditivo=tipo, cantidad_usada=_d(rng.uniform(1, 25)),
+                unidad_medida_id=tipo.unidad_medida_default_id,
+            ))
+
+        # Consumos de líneas ya recibidas con saldo suficiente
+        recibidas = [linea for linea in estado['stock'] if linea[1] <= dia and linea[2] >= 1]
+        for linea in rng.sample(recibidas, min(len(recibidas), rng.randint(0, 2))):
+            cantidad = min(linea[2], _d(rng.randint(1, 3)))
+            linea[2] -= cantidad
+            filas[ConsumoStock].append(ConsumoStock(
+                turno=turno, abastecimiento=linea[0], cantidad_consumida=cantidad,
+                estado_final=rng.choice(['OPTIMO', 'BUENO', 'REGULAR', 'DESGASTADO']),
+            ))
+        estado['stock'] = [linea for linea in estado['stock'] if linea[2] >= 1]
+
+    def _cerrar(self, contratos):
+        """Estados finales de sondajes, horómetros de máquina y saldos de stock."""
+        Sondaje.objects.bulk_update(self.sondajes_finalizados, ['estado', 'fecha_fin'], batch_size=self.batch_size)
+        # Sondajes, máquinas y trabajadores se escribieron en bloque, sin las señales de form_options
+        form_options.invalidar_contratos(c.pk for c in contratos)
+        Maquina.objects.filter(contrato__in=contratos).update(horometro=models.Subquery(
+            HorometroMovimiento.objects.filter(maquina=models.OuterRef('pk')).values('maquina').annotate(
+                total=models.Sum('horas')
+            ).values('total')[:1]
+        ))
+        reconstruir_balances(Abastecimiento.objects.filter(contrato__in=contratos), batch_size=self.batch_size)
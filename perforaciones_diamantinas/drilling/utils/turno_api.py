@@ -0,0 +1,341 @@
+from django import forms
+from django.core.exceptions import ValidationError
+
+from ..models import Maquina, Sondaje, Trabajador, TurnoMaquina, TurnoTrabajador, horas_entre
+from . import reference_cache
+from .turno_persistence import TurnoPersistence
+
+
+class DatosInvalidos(Exception):
+    """Documento rechazado; `errores` sigue la forma del documento.
+
+    {'campo': [{'message', 'code'}], 'lista': {'0': {'campo': [...]}}, '__all__': [...]}
+    """
+
+    def __init__(self, errores):
+        super().__init__('Datos de turno inválidos')
+        self.errores = errores
+
+
+# ----------------------------------------------------------------------
+# Esquema: un Form por objeto del documento (los Form validan dicts JSON
+# igual que un POST y reportan errores por campo)
+# ----------------------------------------------------------------------
+
+def _decimal(max_digits=8, **kwargs):
+    return forms.DecimalField(max_digits=max_digits, decimal_places=2, **kwargs)
+
+
+class TurnoEsquema(forms.Form):
+    fecha = forms.DateField(input_formats=['%Y-%m-%d'])
+    maquina_id = forms.IntegerField()
+    tipo_turno_id = forms.IntegerField()
+
+
+class SondajeEsquema(forms.Form):
+    sondaje_id = forms.IntegerField()
+    metros = _decimal(min_value=0, required=False)
+
+
+class MaquinaEstadoEsquema(forms.Form):
+    hora_inicio = forms.TimeField(required=False)
+    hora_fin = forms.TimeField(required=False)
+    horometro_inicio = _decimal(max_digits=10, min_value=0, required=False)
+    horometro_fin = _decimal(max_digits=10, min_value=0, required=False)
+    estado_bomba = forms.ChoiceField(choices=TurnoMaquina.ESTADO_CHOICES, required=False)
+    estado_unidad = forms.ChoiceField(choices=TurnoMaquina.ESTADO_CHOICES, required=False)
+    estado_rotacion = forms.ChoiceField(choices=TurnoMaquina.ESTADO_CHOICES, required=False)
+
+    def clean(self):
+        datos = super().clean()
+        inicio, fin = datos.get('horometro_inicio'), datos.get('horometro_fin')
+        if inicio is not None and fin is not None and fin < inicio:
+            self.add_error('horometro_fin', 'El horómetro final no puede ser menor que el inicial.')
+        return datos
+
+
+class TrabajadorEsquema(forms.Form):
+    # DNI, como en el formulario web
+    trabajador_id = forms.CharField(max_length=20)
+    funcion = forms.ChoiceField(choices=TurnoTrabajador.FUNCION_CHOICES)
+    observaciones = forms.CharField(required=False)
+
+
+class ActividadEsquema(forms.Form):
+    actividad_id = forms.IntegerField()
+    hora_inicio = forms.TimeField()
+    hora_fin = forms.TimeField()
+    observaciones = forms.CharField(required=False)
+
+
+class CorridaEsquema(forms.Form):
+    corrida_numero = forms.IntegerField(min_value=1)
+    desde = _decimal(min_value=0)
+    hasta = _decimal(min_value=0)
+    longitud_testigo = _decimal(min_value=0)
+    pct_recuperacion = _decimal(max_digits=5, min_value=0, max_value=100)
+    pct_retorno_agua = _decimal(max_digits=5, min_value=0, max_value=100)
+    litologia = forms.CharField(required=False)
+
+    def clean(self):
+        datos = super().clean()
+        if datos.get('desde') is not None and datos.get('hasta') is not None and datos['hasta'] < datos['desde']:
+            self.add_error('hasta', 'La profundidad final no puede ser menor que la inicial.')
+        return datos
+
+
+class ComplementoEsquema(forms.Form):
+    tipo_complemento_id = forms.IntegerField()
+    sondaje_id = forms.IntegerField(required=False)
+    codigo_serie = forms.CharField(max_length=100)
+    metros_inicio = _decimal(min_value=0)
+    metros_fin = _decimal(min_value=0)
+
+
+class AditivoEsquema(forms.Form):
+    tipo_aditivo_id = forms.IntegerField()
+    sondaje_id = forms.IntegerField(required=False)
+    cantidad_usada = _decimal(min_value=0)
+    unidad_medida_id = forms.IntegerField()
+
+
+LISTAS = {
+    'sondajes': SondajeEsquema,
+    'trabajadores': TrabajadorEsquema,
+    'actividades': ActividadEsquema,
+    'corridas': CorridaEsquema,
+    'complementos': ComplementoEsquema,
+    'aditivos': AditivoEsquema,
+}
+
+
+def _error(mensaje, code='invalid'):
+    return [{'message': mensaje, 'code': code}]
+
+
+def _validar_objeto(esquema, valor):
+    """(datos limpios, errores) de un objeto JSON según `esquema`."""
+    if not isinstance(valor, dict):
+        return None, {'__all__': _error('Se esperaba un objeto.')}
+    form = esquema(data=valor)
+    if form.is_valid():
+        return form.cleaned_data, None
+    return None, form.errors.get_json_data()
+
+
+def validar_documento(documento):
+    """Validar la forma del documento. Retorna los datos limpios o lanza DatosInvalidos."""
+    if not isinstance(documento, dict):
+        raise DatosInvalidos({'__all__': _error('El cuerpo debe ser un objeto JSON.')})
+
+    errores = {}
+    datos, error = _validar_objeto(TurnoEsquema, documento)
+    if error:
+        errores.update(error)
+    datos = datos or {}
+
+    for nombre, esquema in LISTAS.items():
+        valores = documento.get(nombre) or []
+        if not isinstance(valores, list):
+            errores[nombre] = _error('Se esperaba una lista.')
+            continue
+        limpios, errores_lista = [], {}
+        for i, valor in enumerate(valores):
+            limpio, error = _validar_objeto(esquema, valor)
+            if error:
+                errores_lista[str(i)] = error
+            else:
+                limpios.append(limpio)
+        if errores_lista:
+            errores[nombre] = errores_lista
+        datos[nombre] = limpios
+
+    if not documento.get('sondajes') and 'sondajes' not in errores:
+        errores['sondajes'] = _error('Debe indicar al menos un sondaje.', 'required')
+
+    datos['maquina_estado'] = None
+    if documento.get('maquina_estado') is not None:
+        limpio, error = _validar_objeto(MaquinaEstadoEsquema, documento['maquina_estado'])
+        if error:
+            errores['maquina_estado'] = error
+        datos['maquina_estado'] = limpio
+
+    for nombre, clave in (('sondajes', 'sondaje_id'), ('trabajadores', 'trabajador_id'), ('corridas', 'corrida_numero')):
+        vistos = [fila[clave] for fila in datos.get(nombre, [])]
+        if nombre not in errores and len(vistos) != len(set(vistos)):
+            errores[nombre] = _error(f'{clave} repetido.', 'unique')
+
+    if errores:
+        raise DatosInvalidos(errores)
+    return datos
+
+
+# ----------------------------------------------------------------------
+# Guardado
+# ----------------------------------------------------------------------
+
+def guardar_turno(documento, usuario, turno=None):
+    """Crear (turno=None) o reemplazar `turno` con el documento JSON. Retorna el turno.
+
+    Valida forma, pertenencia al contrato y referencias (tablas de referencia
+    desde la caché, sin consultas) y guarda con TurnoPersistence. Lanza
+    DatosInvalidos con errores por campo.
+    """
+    datos = validar_documento(documento)
+    errores = {}
+
+    # Sondajes: todos existentes, de un mismo contrato accesible por el usuario
+    ids = [fila['sondaje_id'] for fila in datos['sondajes']]
+    sondajes_map = Sondaje.objects.select_related('contrato').in_bulk(ids)
+    faltantes = [i for i in ids if i not in sondajes_map]
+    sondajes = [sondajes_map[i] for i in ids if i in sondajes_map]
+    contratos = {s.contrato_id for s in sondajes}
+    if faltantes:
+        errores['sondajes'] = _error(f"Sondaje inexistente: {', '.join(map(str, faltantes))}", 'invalid_choice')
+    elif len(contratos) > 1:
+        errores['sondajes'] = _error('Los sondajes pertenecen a contratos diferentes.')
+    elif not usuario.can_manage_all_contracts() and contratos != {usuario.contrato_id}:
+        errores['sondajes'] = _error('No tiene permisos para registrar turnos en este contrato.', 'permission')
+    if turno is not None and not errores and contratos != {turno.contrato_id}:
+        errores['sondajes'] = _error('Los sondajes no pertenecen al contrato del turno.')
+    if errores:
+        raise DatosInvalidos(errores)
+    contrato = sondajes[0].contrato
+
+    maquina = Maquina.objects.filter(pk=datos['maquina_id'], contrato=contrato).first()
+    if maquina is None:
+        errores['maquina_id'] = _error('La máquina no existe en el contrato.', 'invalid_choice')
+    tipos_turno = {t.pk: t for t in reference_cache.tabla('tipos_turno')}
+    if datos['tipo_turno_id'] not in tipos_turno:
+        errores['tipo_turno_id'] = _error('Tipo de turno inexistente.', 'invalid_choice')
+
+    dnis = {fila['trabajador_id'] for fila in datos['trabajadores']}
+    if dnis:
+        existentes = set(Trabajador.objects.filter(dni__in=dnis, contrato=contrato).values_list('dni', flat=True))
+        _referencias(errores, datos['trabajadores'], 'trabajadores', 'trabajador_id', existentes,
+                     'Trabajador inexistente en el contrato.')
+    _referencias(errores, datos['actividades'], 'actividades', 'actividad_id',
+                 {a.pk for a in reference_cache.tabla('tipos_actividad')}, 'Actividad inexistente.')
+    _referencias(errores, datos['complementos'], 'complementos', 'tipo_complemento_id',
+                 {c.pk for c in reference_cache.tabla('tipos_complemento')}, 'Tipo de complemento inexistente.')
+    _referencias(errores, datos['aditivos'], 'aditivos', 'tipo_aditivo_id',
+                 {a.pk for a in reference_cache.tabla('tipos_aditivo')}, 'Tipo de aditivo inexistente.')
+    _referencias(errores, datos['aditivos'], 'aditivos', 'unidad_medida_id',
+                 {u.pk for u in reference_cache.tabla('unidades_medida')}, 'Unidad de medida inexistente.')
+    for nombre in ('complementos', 'aditivos'):
+        _referencias(errores, [f for f in datos[nombre] if f['sondaje_id']], nombre, 'sondaje_id',
+                     set(ids), 'El sondaje no está entre los sondajes del turno.')
+
+    # Mismas horas mínimas que el formulario web
+    duracion = float(contrato.duracion_turno or 0)
+    total_horas = float(sum(horas_entre(a['hora_inicio'], a['hora_fin']) for a in datos['actividades']))
+    if duracion > 0 and total_horas < duracion and 'actividades' not in errores:
+        errores['actividades'] = _error(
+            f'Faltan horas al turno: se han registrado {total_horas:.2f}h, se requieren {duracion:.2f}h.', 'incomplete'
+        )
+    if errores:
+        raise DatosInvalidos(errores)
+
+    metrajes = [fila['metros'] for fila in datos['sondajes']]
+    try:
+        return TurnoPersistence(contrato, duracion).guardar(
+            turno=turno,
+            maquina=maquina,
+            tipo_turno=tipos_turno[datos['tipo_turno_id']],
+            fecha=datos['fecha'],
+            sondajes=sondajes,
+            metrajes=metrajes,
+            maquina_estado=datos['maquina_estado'],
+            trabajadores=datos['trabajadores'],
+            complementos=datos['complementos'],
+            aditivos=datos['aditivos'],
+            actividades=datos['actividades'],
+            corridas=datos['corridas'],
+        )
+    except ValidationError as e:
+        if hasattr(e, 'error_dict'):
+            raise DatosInvalidos({campo: [{'message': m, 'code': 'invalid'} for m in mensajes]
+                                  for campo, mensajes in e.message_dict.items()})
+        raise DatosInvalidos({'__all__': [{'message': m, 'code': 'invalid'} for m in e.messages]})
+
+
+def _referencias(errores, filas, nombre, clave, validos, mensaje):
+    for i, fila in enumerate(filas):
+        if fila[clave] not in validos:
+            errores.setdefault(nombre, {}).setdefault(str(i), {})[clave] = _error(mensaje, 'invalid_choice')
+
+
+# ----------------------------------------------------------------------
+# Serialización
+# ----------------------------------------------------------------------
+
+def turnos_con_detalle(queryset):
+    """`queryset` con todo lo que usa `serializar_turno` (consultas constantes por página)."""
+    return queryset.select_related('maquina_estado', 'avance').prefetch_related(
+        'turno_sondajes', 'trabajadores_turno__trabajador', 'actividades', 'corridas', 'complementos', 'aditivos',
+    )
+
+
+def _numero(valor):
+    return float(valor) if valor is not None else None
+
+
+def _hora(valor):
+    return valor.strftime('%H:%M') if valor else None
+
+
+def serializar_turno(turno):
+    """Documento JSON de un turno, con la misma forma que acepta `guardar_turno`."""
+    # Relaciones uno a uno opcionales: getattr con valor por defecto cubre RelatedObjectDoesNotExist
+    maquina_estado = getattr(turno, 'maquina_estado', None)
+    avance = getattr(turno, 'avance', None)
+    return {
+        'id': turno.pk,
+        'contrato_id': turno.contrato_id,
+        'estado': turno.estado,
+        'fecha': turno.fecha.isoformat(),
+        'maquina_id': turno.maquina_id,
+        'tipo_turno_id': turno.tipo_turno_id,
+        'metros_perforados': _numero(avance.metros_perforados) if avance else 0.0,
+        'sondajes': [
+            {'sondaje_id': ts.sondaje_id, 'metros': _numero(ts.metros_turno)}
+            for ts in sorted(turno.turno_sondajes.all(), key=lambda ts: ts.pk)
+        ],
+        'maquina_estado': {
+            'hora_inicio': _hora(maquina_estado.hora_inicio),
+            'hora_fin': _hora(maquina_estado.hora_fin),
+            'horometro_inicio': _numero(maquina_estado.horometro_inicio),
+            'horometro_fin': _numero(maquina_estado.horometro_fin),
+            'horas_trabajadas': _numero(maquina_estado.horas_trabajadas_calc),
+            'estado_bomba': maquina_estado.estado_bomba,
+            'estado_unidad': maquina_estado.estado_unidad,
+            'estado_rotacion': maquina_estado.estado_rotacion,
+        } if maquina_estado else None,
+        'trabajadores': [
+            {'trabajador_id': tt.trabajador.dni, 'funcion': tt.funcion, 'observaciones': tt.observaciones}
+            for tt in sorted(turno.trabajadores_turno.all(), key=lambda tt: tt.pk)
+        ],
+        'actividades': [
+            {'actividad_id': a.actividad_id, 'hora_inicio': _hora(a.hora_inicio), 'hora_fin': _hora(a.hora_fin),
+             'tiempo': _numero(a.tiempo_calc), 'observaciones': a.observaciones}
+            for a in sorted(turno.actividades.all(), key=lambda a: a.pk)
+        ],
+        'corridas': [
+            {'corrida_numero': c.corrida_numero, 'desde': _numero(c.desde), 'hasta': _numero(c.hasta),
+             'total': _numero(c.total_calc), 'longitud_testigo': _numero(c.longitud_testigo),
+             'pct_recuperacion': _numero(c.pct_recuperacion), 'pct_retorno_agua': _numero(c.pct_retorno_agua),
+             'litologia': c.litologia}
+            for c in sorted(turno.corridas.all(), key=lambda c: c.corrida_numero)
+        ],
+        'complementos': [
+            {'tipo_complemento_id': c.tipo_complemento_id, 'sondaje_id': c.sondaje_id, 'codigo_serie': c.codigo_serie,
+             'metros_inicio': _numero(c.metros_inicio), 'metros_fin': _numero(c.metros_fin),
+             'metros_turno': _numero(c.metros_turno_calc)}
+            for c in sorted(turno.complementos.all(), key=lambda c: c.pk)
+        ],
+        'aditivos': [
+            {'tipo_aditivo_id': a.tipo_aditivo_id, 'sondaje_id': a.sondaje_id,
+             'cantidad_usada': _numero(a.cantidad_usada), 'unidad_medida_id': a.unidad_medida_id}
+            for a in sorted(turno.aditivos.all(), key=lambda a: a.pk)
+        ],
+    }
@@ -0,0 +1,346 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+from ..models import (
+    HorometroMovimiento, Sondaje, TipoActividad, TipoAditivo, TipoComplemento, Trabajador, Turno,
+    TurnoActividad, TurnoAditivo, TurnoAvance, TurnoComplemento, TurnoCorrida,
+    TurnoMaquina, TurnoSondaje, TurnoTrabajador, UnidadMedida,
+)
+
+
+def _decimal(value, default='0'):
+    if value in (None, ''):
+        return Decimal(default)
+    return Decimal(str(value))
+
+
+def _normalizar(field, value):
+    """Llevar `value` a la forma en que queda guardado en BD para poder compararlo."""
+    if value is None:
+        return None
+    value = field.to_python(value)
+    if isinstance(field, models.DecimalField):
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+    return value
+
+
+# Campos comparados/actualizados por tabla hija en modo edición, y clave
+# natural usada para emparejar filas (None = emparejar por contenido y orden)
+CAMPOS_HIJOS = {
+    TurnoSondaje: (['metros_turno'], 'sondaje_id'),
+    TurnoMaquina: ([
+        'hora_inicio', 'hora_fin', 'horometro_inicio', 'horometro_fin', 'horas_trabajadas_calc',
+        'estado_bomba', 'estado_unidad', 'estado_rotacion',
+    ], 'turno_id'),
+    TurnoTrabajador: (['funcion', 'observaciones'], 'trabajador_id'),
+    TurnoComplemento: ([
+        'sondaje_id', 'tipo_complemento_id', 'codigo_serie', 'metros_inicio', 'metros_fin', 'metros_turno_calc',
+    ], None),
+    TurnoAditivo: (['sondaje_id', 'tipo_aditivo_id', 'cantidad_usada', 'unidad_medida_id'], None),
+    TurnoActividad: (['actividad_id', 'hora_inicio', 'hora_fin', 'tiempo_calc', 'observaciones'], None),
+    TurnoCorrida: ([
+        'desde', 'hasta', 'total_calc', 'longitud_testigo', 'pct_recuperacion', 'pct_retorno_agua', 'litologia',
+    ], 'corrida_numero'),
+    TurnoAvance: (['metros_perforados'], 'turno_id'),
+}
+
+
+class TurnoPersistence:
+    """Guarda un turno completo (cabecera + tablas hijas) en una transacción.
+
+    Todas las claves foráneas se resuelven con una query por modelo y los
+    campos calculados (`tiempo_calc`, `total_calc`, `metros_turno_calc`,
+    `horas_trabajadas_calc`) se obtienen en Python, de modo que cada tabla hija
+    se escribe con operaciones bulk. El número de queries es constante sin
+    importar cuántos trabajadores, actividades o corridas tenga el turno.
+
+    Al editar, las filas enviadas se comparan con las guardadas y solo se
+    emiten los INSERT, UPDATE y DELETE necesarios (uno bulk por tabla); el
+    resumen queda en `self.cambios` como {modelo: (insertadas, actualizadas, eliminadas)}.
+
+    Los datos hijos llegan como listas de dicts con el formato que ya produce
+    `crear_turno_completo` al parsear el POST.
+    """
+
+    def __init__(self, contrato, duracion_esperada=0):
+        self.contrato = contrato
+        self.duracion_esperada = float(duracion_esperada or 0)
+        self.cambios = {}
+
+    def guardar(self, *, maquina, tipo_turno, fecha, sondajes, turno=None, metrajes=None,
+                maquina_estado=None, trabajadores=(), complementos=(), aditivos=(),
+                actividades=(), corridas=(), metros_perforados=None):
+        """Crear (turno=None) o actualizar `turno` con los datos enviados. Retorna el turno."""
+        sondajes = list(sondajes)
+        trabajadores_map = self._resolver_trabajadores(trabajadores)
+        self._validar_referencias(sondajes, complementos, aditivos, actividades)
+
+        hijos = self._construir_hijos(
+            sondajes, metrajes or [], maquina_estado, trabajadores, trabajadores_map,
+            complementos, aditivos, actividades, corridas, metros_perforados,
+        )
+        total_horas = sum(float(obj.tiempo_calc) for obj in hijos[TurnoActividad])
+
+        with transaction.atomic():
+            maquina_anterior_id = turno.maquina_id if turno is not None else None
+            fecha_anterior = turno.fecha if turno is not None else None
+            if turno is None:
+                turno = Turno(contrato=self.contrato)
+
+            turno.contrato = self.contrato
+            turno.maquina = maquina
+            turno.tipo_turno = tipo_turno
+            turno.fecha = fecha
+            if self.duracion_esperada > 0 and total_horas >= self.duracion_esperada:
+                turno.estado = 'COMPLETADO'
+            es_nuevo = turno.pk is None
+            turno.save()
+
+            horas_anteriores = Decimal('0')
+            for model, nuevos in hijos.items():
+                for obj in nuevos:
+                    obj.turno = turno
+                existentes = [] if es_nuevo else list(model.objects.filter(turno=turno).order_by('pk'))
+                if model is TurnoMaquina and existentes:
+                    horas_anteriores = existentes[0].horas_trabajadas_calc or Decimal('0')
+                self.cambios[model] = self._sincronizar(model, existentes, nuevos)
+
+            tm = hijos[TurnoMaquina][0] if hijos[TurnoMaquina] else None
+            horas_nuevas = tm.horas_trabajadas_calc if tm is not None else Decimal('0')
+            HorometroMovimiento.registrar(self._movimientos_horometro(
+                turno, maquina_anterior_id, fecha_anterior, horas_anteriores, horas_nuevas
+            ))
+
+        return turno
+
+    # ------------------------------------------------------------------
+    # Resolución y validación de referencias (una query por modelo)
+    # ------------------------------------------------------------------
+
+    def _resolver_trabajadores(self, trabajadores):
+        # La plantilla envía el dni como identificador del trabajador
+        dnis = {str(t['trabajador_id']) for t in trabajadores}
+        if not dnis:
+            return {}
+        return Trabajador.objects.in_bulk(dnis, field_name='dni')
+
+    def _validar_referencias(self, sondajes, complementos, aditivos, actividades):
+        contratos_sondaje = {s.id: s.contrato_id for s in sondajes}
+        extra_ids = {
+            row['sondaje_id'] for row in list(complementos) + list(aditivos)
+            if row.get('sondaje_id') and row['sondaje_id'] not in contratos_sondaje
+        }
+        if extra_ids:
+            contratos_sondaje.update(
+                Sondaje.objects.filter(id__in=extra_ids).values_list('id', 'contrato_id')
+            )
+
+        for row in list(complementos) + list(aditivos):
+            sondaje_id = row.get('sondaje_id')
+            if not sondaje_id:
+                continue
+            if sondaje_id not in contratos_sondaje:
+                raise ValidationError(f'Sondaje {sondaje_id} no existe')
+            if contratos_sondaje[sondaje_id] != self.contrato.id:
+                raise ValidationError('El sondaje no pertenece al contrato del turno.')
+
+        self._validar_existentes(TipoComplemento, {c['tipo_complemento_id'] for c in complementos}, 'Tipo de complemento')
+        self._validar_existentes(TipoAditivo, {a['tipo_aditivo_id'] for a in aditivos}, 'Tipo de aditivo')
+        self._validar_existentes(UnidadMedida, {a['unidad_medida_id'] for a in aditivos}, 'Unidad de medida')
+        self._validar_existentes(TipoActividad, {a['actividad_id'] for a in actividades}, 'Actividad')
+
+    def _validar_existentes(self, model, ids, etiqueta):
+        if not ids:
+            return
+        existentes = set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+        faltantes = sorted(ids - existentes)
+        if faltantes:
+            raise ValidationError(f"{etiqueta} inexistente: {', '.join(str(i) for i in faltantes)}")
+
+    # ------------------------------------------------------------------
+    # Construcción de filas hijas (sin turno asignado todavía)
+    # ------------------------------------------------------------------
+
+    def _construir_hijos(self, sondajes, metrajes, maquina_estado, trabajadores, trabajadores_map,
+                         complementos, aditivos, actividades, corridas, metros_perforados):
+        hijos = {}
+
+        # TurnoSondaje con su metraje (lista paralela a `sondajes`)
+        hijos[TurnoSondaje] = []
+        total_sondajes = Decimal('0')
+        for i, sondaje in enumerate(sondajes):
+            try:
+                metros = _decimal(metrajes[i]) if i < len(metrajes) else Decimal('0')
+            except Exception:
+                metros = Decimal('0')
+            total_sondajes += metros
+            hijos[TurnoSondaje].append(TurnoSondaje(sondaje=sondaje, metros_turno=metros))
+
+        hijos[TurnoMaquina] = []
+        if maquina_estado:
+            tm = TurnoMaquina(
+                hora_inicio=maquina_estado.get('hora_inicio'),
+                hora_fin=maquina_estado.get('hora_fin'),
+                horometro_inicio=maquina_estado.get('horometro_inicio'),
+                horometro_fin=maquina_estado.get('horometro_fin'),
+                estado_bomba=maquina_estado.get('estado_bomba') or 'OPERATIVO',
+                estado_unidad=maquina_estado.get('estado_unidad') or 'OPERATIVO',
+                estado_rotacion=maquina_estado.get('estado_rotacion') or 'OPERATIVO',
+            )
+            tm.calcular_horas()
+            hijos[TurnoMaquina].append(tm)
+
+        hijos[TurnoTrabajador] = [
+            TurnoTrabajador(
+                trabajador=trabajadores_map[str(t['trabajador_id'])],
+                funcion=t['funcion'],
+                observaciones=t.get('observaciones', ''),
+            )
+            # Omitir trabajadores inexistentes (no bloquear la transacción)
+            for t in trabajadores if str(t['trabajador_id']) in trabajadores_map
+        ]
+
+        hijos[TurnoComplemento] = []
+        for c in complementos:
+            obj = TurnoComplemento(
+                tipo_complemento_id=c['tipo_complemento_id'],
+                codigo_serie=c.get('codigo_serie', ''),
+                metros_inicio=c['metros_inicio'],
+                metros_fin=c['metros_fin'],
+                sondaje_id=c.get('sondaje_id'),
+            )
+            obj.clean_fields(exclude=['turno', 'sondaje', 'tipo_complemento'])
+            obj.calcular_metros()
+            hijos[TurnoComplemento].append(obj)
+
+        hijos[TurnoAditivo] = []
+        for a in aditivos:
+            obj = TurnoAditivo(
+                tipo_aditivo_id=a['tipo_aditivo_id'],
+                cantidad_usada=a['cantidad_usada'],
+                unidad_medida_id=a['unidad_medida_id'],
+                sondaje_id=a.get('sondaje_id'),
+            )
+            obj.clean_fields(exclude=['turno', 'sondaje', 'tipo_aditivo', 'unidad_medida'])
+            hijos[TurnoAditivo].append(obj)
+
+        hijos[TurnoActividad] = []
+        for act in actividades:
+            obj = TurnoActividad(
+                actividad_id=act['actividad_id'],
+                hora_inicio=act.get('hora_inicio'),
+                hora_fin=act.get('hora_fin'),
+                observaciones=act.get('observaciones', ''),
+            )
+            obj.calcular_tiempo()
+            hijos[TurnoActividad].append(obj)
+
+        hijos[TurnoCorrida] = []
+        for cr in corridas:
+            obj = TurnoCorrida(
+                corrida_numero=cr['corrida_numero'],
+                desde=_decimal(cr['desde']),
+                hasta=_decimal(cr['hasta']),
+                longitud_testigo=_decimal(cr['longitud_testigo']),
+                pct_recuperacion=_decimal(cr['pct_recuperacion']),
+                pct_retorno_agua=_decimal(cr['pct_retorno_agua']),
+                litologia=cr.get('litologia', ''),
+            )
+            obj.calcular_total()
+            hijos[TurnoCorrida].append(obj)
+
+        # Avance: preferimos la suma de metrajes por sondaje; como fallback
+        # el valor total recibido (metros_perforados)
+        total_metros = total_sondajes if total_sondajes > 0 else _decimal(metros_perforados)
+        hijos[TurnoAvance] = [TurnoAvance(metros_perforados=total_metros)] if total_metros > 0 else []
+
+        # Dejar los valores tal como quedarán en BD para que la comparación
+        # con las filas existentes no detecte cambios inexistentes
+        for model, objs in hijos.items():
+            campos, _ = CAMPOS_HIJOS[model]
+            fields = [model._meta.get_field(c) for c in campos]
+            for obj in objs:
+                for field in fields:
+                    setattr(obj, field.attname, _normalizar(field, getattr(obj, field.attname)))
+        return hijos
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def _sincronizar(self, model, existentes, nuevos):
+        """Aplicar la diferencia entre `existentes` (BD) y `nuevos` (enviados).
+
+        Con clave natural las filas se emparejan por ella. Sin clave, primero se
+        conservan las filas idénticas y las restantes se emparejan por orden.
+        Emite a lo sumo un DELETE, un UPDATE bulk y un INSERT bulk.
+        """
+        campos, clave = CAMPOS_HIJOS[model]
+        attnames = [model._meta.get_field(c).attname for c in campos]
+
+        def valores(obj):
+            return tuple(getattr(obj, a) for a in attnames)
+
+        pares = []
+        insertar = []
+        if clave:
+            por_clave = {getattr(obj, clave): obj for obj in existentes}
+            for obj in nuevos:
+                actual = por_clave.pop(getattr(obj, clave), None)
+                if actual is None:
+                    insertar.append(obj)
+                else:
+                    pares.append((actual, obj))
+            sobrantes = list(por_clave.values())
+        else:
+            por_valores = {}
+            for obj in existentes:
+                por_valores.setdefault(valores(obj), []).append(obj)
+            pendientes = []
+            for obj in nuevos:
+                iguales = por_valores.get(valores(obj))
+                if iguales:
+                    iguales.pop(0)
+                else:
+                    pendientes.append(obj)
+            restantes = sorted((o for grupo in por_valores.values() for o in grupo), key=lambda o: o.pk)
+            pares = list(zip(restantes, pendientes))
+            insertar = pendientes[len(pares):]
+            sobrantes = restantes[len(pares):]
+
+        actualizar = []
+        for actual, obj in pares:
+            if valores(actual) != valores(obj):
+                for a in attnames:
+                    setattr(actual, a, getattr(obj, a))
+                actualizar.append(actual)
+
+        if sobrantes:
+            model.objects.filter(pk__in=[obj.pk for obj in sobrantes]).delete()
+        if actualizar:
+            model.objects.bulk_update(actualizar, attnames)
+        if insertar:
+            model.objects.bulk_create(insertar)
+        return len(insertar), len(actualizar), len(sobrantes)
+
+    def _movimientos_horometro(self, turno, maquina_anterior_id, fecha_anterior, horas_anteriores, horas_nuevas):
+        """Movimientos del libro de horómetro que corresponden a este guardado.
+
+        Si la máquina y la fecha no cambiaron se registra solo la diferencia de
+        horas; si cambiaron, se revierte el registro anterior y se registra el nuevo.
+        """
+        if maquina_anterior_id is None or (maquina_anterior_id == turno.maquina_id and fecha_anterior == turno.fecha):
+            return [HorometroMovimiento(
+                maquina_id=turno.maquina_id, turno=turno, fecha=turno.fecha,
+                horas=horas_nuevas - horas_anteriores,
+            )]
+        return [
+            HorometroMovimiento(
+                maquina_id=maquina_anterior_id, turno=turno, fecha=fecha_anterior, horas=-horas_anteriores,
+            ),
+            HorometroMovimiento(
+                maquina_id=turno.maquina_id, turno=turno, fecha=turno.fecha, horas=horas_nuevas,
+            ),
+        ]
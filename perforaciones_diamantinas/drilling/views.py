@@ -6,15 +6,26 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView, TemplateView
 from django.db import transaction, models
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.conf import settings
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.core.paginator import Paginator
+from django.utils.dateparse import parse_date
 from .models import *
-from .mixins import AdminOrContractFilterMixin, SystemAdminRequiredMixin
+from .mixins import AdminOrContractFilterMixin, KeysetPaginationMixin, SystemAdminRequiredMixin
 from .forms import *
-from .utils.excel_importer import AbastecimientoExcelImporter
+from .utils.chunked_reader import FORMATOS as FORMATOS_IMPORTACION
+from .utils.import_queue import encolar_importacion, ejecutar_importacion
+from .utils.keyset_pagination import KeysetPaginator, paginar_keyset
+from .utils import form_options, reference_cache
+from .utils.request_metrics import request_metrics
+from .utils.turno_api import DatosInvalidos, guardar_turno, serializar_turno, turnos_con_detalle
+from .utils.turno_persistence import TurnoPersistence
+from .utils.stock import actualizar_consumo, balance_de, reservar_stock, stock_critico as obtener_stock_critico
 
 from datetime import datetime, time, timedelta
 import json
@@ -80,46 +91,24 @@ def dashboard(request):
     
     # Métricas del dashboard
     sondajes_activos = Sondaje.objects.filter(contrato=contract, estado='ACTIVO').count()
-    turnos_hoy = Turno.objects.filter(sondajes__contrato=contract, fecha=hoy).count()
+    turnos_hoy = Turno.objects.for_contract(contract).filter(fecha=hoy).count()
     
-    metros_perforados_mes = TurnoAvance.objects.filter(
-        turno__sondajes__contrato=contract,
-        turno__fecha__month=hoy.month,
-        turno__fecha__year=hoy.year
+    inicio_mes = hoy.replace(day=1)
+    metros_perforados_mes = TurnoAvance.objects.for_contract(contract).filter(
+        turno__fecha__gte=inicio_mes,
+        turno__fecha__lt=(inicio_mes + timedelta(days=32)).replace(day=1),
     ).aggregate(total=models.Sum('metros_perforados'))['total'] or 0
     
     maquinas_operativas = Maquina.objects.filter(contrato=contract, estado='OPERATIVO').count()
     
     # Últimos turnos
-    # Ajustado para M2M: filtrar por sondajes__contrato y prefetch sondajes
-    ultimos_turnos = Turno.objects.filter(
-        sondajes__contrato=contract
-    ).select_related('maquina', 'tipo_turno').prefetch_related('sondajes').order_by('-fecha').distinct()[:5]
+    ultimos_turnos = Turno.objects.for_contract(contract).select_related(
+        'maquina', 'tipo_turno'
+    ).prefetch_related('sondajes').order_by('-fecha', '-id')[:5]
     
-    # Stock crítico - CONSULTA CORREGIDA
+    # Stock crítico: una sola consulta agrupada sobre todas las líneas del contrato
     try:
-        stock_critico = []
-        abastecimientos = Abastecimiento.objects.filter(contrato=contract)
-        
-        for abastecimiento in abastecimientos[:10]:  # Limitar a 10 para performance
-            total_consumido = ConsumoStock.objects.filter(
-                abastecimiento=abastecimiento
-            ).aggregate(
-                total=models.Sum('cantidad_consumida')
-            )['total'] or 0
-            
-            disponible = abastecimiento.cantidad - total_consumido
-            
-            if disponible <= 5:  # Stock crítico
-                stock_critico.append({
-                    'descripcion': abastecimiento.descripcion,
-                    'disponible': disponible,
-                    'unidad_medida': abastecimiento.unidad_medida,
-                })
-        
-        # Ordenar por stock más crítico
-        stock_critico = sorted(stock_critico, key=lambda x: x['disponible'])[:10]
-        
+        stock_critico = obtener_stock_critico(contract)
     except Exception as e:
         print(f"Error en stock crítico: {e}")
         stock_critico = []
@@ -210,7 +199,8 @@ class MaquinaListView(AdminOrContractFilterMixin, ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = super().get_queryset().order_by('nombre')
+        # La plantilla muestra el contrato de cada máquina
+        queryset = super().get_queryset().select_related('contrato').order_by('nombre')
         
         estado = self.request.GET.get('estado')
         if estado:
@@ -233,18 +223,36 @@ class MaquinaCreateView(AdminOrContractFilterMixin, CreateView):
     def form_valid(self, form):
         if not self.request.user.can_manage_all_contracts():
             form.instance.contrato = self.request.user.contrato
+        with transaction.atomic():
+            response = super().form_valid(form)
+            # El horómetro inicial queda como saldo de apertura del libro
+            if self.object.horometro:
+                HorometroMovimiento.objects.create(
+                    maquina=self.object, fecha=timezone.localdate(),
+                    horas=self.object.horometro, tipo='APERTURA',
+                )
         messages.success(self.request, 'Máquina creada exitosamente')
-        return super().form_valid(form)
+        return response
 
 class MaquinaUpdateView(AdminOrContractFilterMixin, UpdateView):
     model = Maquina
-    form_class = MaquinaForm
+    form_class = MaquinaUpdateForm
     template_name = 'drilling/maquinas/form.html'
     success_url = reverse_lazy('maquina-list')
 
     def form_valid(self, form):
+        with transaction.atomic():
+            # Solo los campos del formulario: el saldo del horómetro lo mueven
+            # los incrementos F() del libro, nunca el valor leído en Python
+            self.object = form.save(commit=False)
+            self.object.save(update_fields=form._meta.fields)
+            ajuste = form.ajuste_horometro()
+            if ajuste:
+                HorometroMovimiento.registrar([HorometroMovimiento(
+                    maquina=self.object, fecha=timezone.localdate(), horas=ajuste, tipo='AJUSTE',
+                )])
         messages.success(self.request, 'Máquina actualizada exitosamente')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
 class MaquinaDeleteView(AdminOrContractFilterMixin, DeleteView):
     model = Maquina
@@ -321,6 +329,9 @@ class TipoActividadListView(AdminOrContractFilterMixin, ListView):
     context_object_name = 'actividades'
     paginate_by = 20
 
+    def get_queryset(self):
+        return reference_cache.tabla('tipos_actividad')
+
 class TipoActividadCreateView(AdminOrContractFilterMixin, CreateView):
     model = TipoActividad
     form_class = TipoActividadForm
@@ -385,6 +396,9 @@ class TipoTurnoListView(AdminOrContractFilterMixin, ListView):
     context_object_name = 'tipos_turno'
     paginate_by = 20
 
+    def get_queryset(self):
+        return reference_cache.tabla('tipos_turno')
+
 class TipoTurnoCreateView(AdminOrContractFilterMixin, CreateView):
     model = TipoTurno
     form_class = TipoTurnoForm
@@ -424,6 +438,9 @@ class TipoComplementoListView(AdminOrContractFilterMixin, ListView):
     context_object_name = 'complementos'
     paginate_by = 20
 
+    def get_queryset(self):
+        return reference_cache.tabla('tipos_complemento')
+
 class TipoComplementoCreateView(AdminOrContractFilterMixin, CreateView):
     model = TipoComplemento
     form_class = TipoComplementoForm
@@ -463,6 +480,9 @@ class TipoAditivoListView(AdminOrContractFilterMixin, ListView):
     context_object_name = 'aditivos'
     paginate_by = 20
 
+    def get_queryset(self):
+        return reference_cache.tabla('tipos_aditivo')
+
 class TipoAditivoCreateView(AdminOrContractFilterMixin, CreateView):
     model = TipoAditivo
     form_class = TipoAditivoForm
@@ -502,6 +522,9 @@ class UnidadMedidaListView(AdminOrContractFilterMixin, ListView):
     context_object_name = 'unidades'
     paginate_by = 20
 
+    def get_queryset(self):
+        return reference_cache.tabla('unidades_medida')
+
 class UnidadMedidaCreateView(AdminOrContractFilterMixin, CreateView):
     model = UnidadMedida
     form_class = UnidadMedidaForm
@@ -566,11 +589,11 @@ def crear_turno_completo(request, pk=None):
                 return redirect('crear-turno-completo')
 
             # Obtener objetos relacionados EN EL MISMO ORDEN en que fueron seleccionados
-            sondajes_list = []
             try:
-                for sid in sondaje_ids:
-                    sondajes_list.append(Sondaje.objects.get(id=int(sid)))
-            except (ValueError, Sondaje.DoesNotExist):
+                sondaje_ids_int = [int(sid) for sid in sondaje_ids]
+                sondajes_map = Sondaje.objects.select_related('contrato').in_bulk(sondaje_ids_int)
+                sondajes_list = [sondajes_map[sid] for sid in sondaje_ids_int]
+            except (ValueError, KeyError):
                 messages.error(request, 'Sondaje(s) seleccionado(s) inválido(s)')
                 return redirect('crear-turno-completo')
             # Para compatibilidad con el código existente que usa una única variable 'sondaje',
@@ -813,229 +836,46 @@ def crear_turno_completo(request, pk=None):
                 # Si falla la validación por cualquier razón, seguimos con el flujo
                 pass
 
-            # Ahora que todo está parseado/validado, crear o actualizar registros en una transacción
-            with transaction.atomic():
-                if pk:
-                    # Editar turno existente
-                    turno = get_object_or_404(Turno, pk=pk)
-                    turno.maquina = maquina
-                    turno.tipo_turno = tipo_turno
-                    turno.fecha = fecha
-                    turno.contrato = contrato_sondajes
-                    turno.save()
-                    # actualizar asociaciones many-to-many de sondajes
-                    try:
-                        # Usar un savepoint (atomic anidado) para que si falla la asignación
-                        # M2M no deje la transacción completa en estado roto.
-                        with transaction.atomic():
-                            turno.sondajes.set([s.id for s in sondajes_list])
-                    except Exception:
-                        # No bloquear el flujo por fallos en la asociación M2M; el savepoint
-                        # asegura que la transacción externa no quede marcada como rollback.
-                        pass
-
-                    # Eliminar relaciones existentes y recrear desde los datos enviados
-                    # También eliminar asociaciones TurnoSondaje para rehacer con metrajes
-                    TurnoSondaje.objects.filter(turno=turno).delete()
-                    TurnoMaquina.objects.filter(turno=turno).delete()
-                    TurnoTrabajador.objects.filter(turno=turno).delete()
-                    TurnoComplemento.objects.filter(turno=turno).delete()
-                    TurnoAditivo.objects.filter(turno=turno).delete()
-                    TurnoActividad.objects.filter(turno=turno).delete()
-                    TurnoCorrida.objects.filter(turno=turno).delete()
-                    TurnoAvance.objects.filter(turno=turno).delete()
-                else:
-                    # Crear el turno principal CON relación directa a contrato
-                    turno = Turno.objects.create(
-                        fecha=fecha,
-                        contrato=contrato_sondajes,
-                        maquina=maquina,
-                        tipo_turno=tipo_turno,
-                    )
-                    # asignar sondajes seleccionados
-                    try:
-                        # Mismo tratamiento en la rama de creación: usar savepoint para M2M
-                        with transaction.atomic():
-                            turno.sondajes.set([s.id for s in sondajes_list])
-                    except Exception:
-                        pass
-
-                # Guardar metrajes por sondaje si fueron enviados (usar metrajes_raw
-                # ya parseados arriba). Se espera una lista paralela 'sondajes_metraje'
-                # en el POST
-                from decimal import Decimal
-                try:
-                    # Asegurar que los pares (sondaje_id, metraje) respeten el orden de selección
-                    pairs = list(zip([int(s.id) for s in sondajes_list], metrajes_raw)) if metrajes_raw else []
-                    objs = []
-                    if pairs:
-                        for sid, m in pairs:
-                            try:
-                                metros_val = Decimal(str(m)) if m not in [None, ''] else Decimal('0')
-                            except Exception:
-                                metros_val = Decimal('0')
-                            objs.append(TurnoSondaje(turno=turno, sondaje_id=sid, metros_turno=metros_val))
-                        if objs:
-                            # bulk_create en su propio savepoint para aislar errores
-                            try:
-                                with transaction.atomic():
-                                    TurnoSondaje.objects.bulk_create(objs)
-                            except Exception:
-                                # No bloquear el flujo si falla la bulk_create; ya hay asociación M2M
-                                pass
-                    else:
-                        # Si no se enviaron metrajes, asegurarse de que existan filas TurnoSondaje
-                        # (la asignación M2M previa puede haber creado entradas con valores por defecto)
-                        pass
-                except Exception:
-                    # No bloquear el flujo si algo falla al preparar metrajes; la transacción global seguirá intacta
-                    pass
-
-                # Crear TurnoMaquina si corresponde
-                if hora_inicio_maq_parsed or hora_fin_maq_parsed or horometro_inicio_val is not None or horometro_fin_val is not None or request.POST.get('estado_bomba'):
-                    # Si estamos editando (pk) y existía un TurnoMaquina previo, restar sus horas del horometro
-                    if pk:
-                        prev_tm = TurnoMaquina.objects.filter(turno=turno).first()
-                        if prev_tm and prev_tm.horas_trabajadas_calc:
-                            try:
-                                maquina.horometro = maquina.horometro - prev_tm.horas_trabajadas_calc
-                                maquina.save(update_fields=['horometro'])
-                            except Exception:
-                                # No bloquear el flujo si falla la resta
-                                pass
-
-                    tm = TurnoMaquina.objects.create(
-                        turno=turno,
-                        hora_inicio=hora_inicio_maq_parsed,
-                        hora_fin=hora_fin_maq_parsed,
-                        horometro_inicio=horometro_inicio_val,
-                        horometro_fin=horometro_fin_val,
-                        estado_bomba=request.POST.get('estado_bomba', 'OPERATIVO'),
-                        estado_unidad=request.POST.get('estado_unidad', 'OPERATIVO'),
-                        estado_rotacion=request.POST.get('estado_rotacion', 'OPERATIVO')
-                    )
-
-                    # Después de crear TurnoMaquina, su save() habrá calculado horas_trabajadas_calc.
-                    # Sumar ese valor al horómetro de la máquina asociada.
-                    try:
-                        if tm.horas_trabajadas_calc:
-                            # usar Decimal para mantener precisión
-                            from decimal import Decimal
-                            incremento = Decimal(tm.horas_trabajadas_calc)
-                            # Actualizar horómetro en un savepoint para evitar marcar la transacción si falla
-                            try:
-                                with transaction.atomic():
-                                    maquina.horometro = (maquina.horometro or Decimal('0')) + incremento
-                                    maquina.save(update_fields=['horometro'])
-                            except Exception:
-                                # No bloquear el flujo si falla la suma al horómetro
-                                pass
-                    except Exception:
-                        # No bloquear el flujo si hay problemas con el cálculo
-                        pass
-
-                # Crear trabajadores: resolver por `dni` (la plantilla envía el dni como valor)
-                for t in trabajadores_parsed:
-                    try:
-                        trabajador_obj = Trabajador.objects.get(dni=str(t['trabajador_id']))
-                    except Trabajador.DoesNotExist:
-                        # Omitir si el trabajador no existe (no bloquear la transacción)
-                        continue
-                    TurnoTrabajador.objects.create(
-                        turno=turno,
-                        trabajador=trabajador_obj,
-                        funcion=t['funcion'],
-                        observaciones=t['observaciones']
-                    )
-
-                # Crear complementos
-                for c in complementos_parsed:
-                    TurnoComplemento.objects.create(
-                        turno=turno,
-                        tipo_complemento_id=c['tipo_complemento_id'],
-                        codigo_serie=c['codigo_serie'],
-                        metros_inicio=c['metros_inicio'],
-                        metros_fin=c['metros_fin'],
-                        sondaje_id=c.get('sondaje_id')
-                    )
-
-                # Crear aditivos
-                for a in aditivos_parsed:
-                    TurnoAditivo.objects.create(
-                        turno=turno,
-                        tipo_aditivo_id=a['tipo_aditivo_id'],
-                        cantidad_usada=a['cantidad_usada'],
-                        unidad_medida_id=a['unidad_medida_id'],
-                        sondaje_id=a.get('sondaje_id')
-                    )
-
-                # Crear actividades
-                for act in actividades_parsed:
-                    TurnoActividad.objects.create(
-                        turno=turno,
-                        actividad_id=act['actividad_id'],
-                        hora_inicio=act['hora_inicio'],
-                        hora_fin=act['hora_fin'],
-                        observaciones=act['observaciones']
-                    )
-
-                # Crear corridas
-                for cr in corridas_parsed:
-                    TurnoCorrida.objects.create(
-                        turno=turno,
-                        corrida_numero=cr['corrida_numero'],
-                        desde=cr['desde'],
-                        hasta=cr['hasta'],
-                        longitud_testigo=cr['longitud_testigo'],
-                        pct_recuperacion=cr['pct_recuperacion'],
-                        pct_retorno_agua=cr['pct_retorno_agua'],
-                        litologia=cr['litologia']
-                    )
-
-                # Crear avance: preferimos sumar los metrajes guardados en TurnoSondaje
-                # (si la bulk_create funcionó). Como fallback, usamos el valor sumado
-                # recibido en POST (metros_perforados_val) si existe.
-                try:
-                    from django.db.models import Sum
-                    total_db = TurnoSondaje.objects.filter(turno=turno).aggregate(total=Sum('metros_turno'))['total']
-                    total_db = float(total_db) if total_db is not None else 0.0
-                except Exception:
-                    total_db = 0.0
-
-                final_total_metros = total_db if total_db > 0 else (metros_perforados_val or 0)
-                try:
-                    if final_total_metros and float(final_total_metros) > 0:
-                        TurnoAvance.objects.create(
-                            turno=turno,
-                            metros_perforados=final_total_metros
-                        )
-                except Exception:
-                    # No bloquear el flujo si falla la creación del avance
-                    pass
+            # Ahora que todo está parseado/validado, crear o actualizar registros en una
+            # transacción con un número constante de queries (ver TurnoPersistence)
+            if request.user.can_manage_all_contracts():
+                duracion_esperada = float(sondaje.contrato.duracion_turno or 0)
+            else:
+                duracion_esperada = float(getattr(request.user.contrato, 'duracion_turno', 0) or 0)
+
+            maquina_estado = None
+            if hora_inicio_maq_parsed or hora_fin_maq_parsed or horometro_inicio_val is not None or horometro_fin_val is not None or request.POST.get('estado_bomba'):
+                maquina_estado = {
+                    'hora_inicio': hora_inicio_maq_parsed,
+                    'hora_fin': hora_fin_maq_parsed,
+                    'horometro_inicio': horometro_inicio_val,
+                    'horometro_fin': horometro_fin_val,
+                    'estado_bomba': request.POST.get('estado_bomba', 'OPERATIVO'),
+                    'estado_unidad': request.POST.get('estado_unidad', 'OPERATIVO'),
+                    'estado_rotacion': request.POST.get('estado_rotacion', 'OPERATIVO'),
+                }
+
+            turno = get_object_or_404(Turno, pk=pk) if pk else None
+            turno = TurnoPersistence(contrato_sondajes, duracion_esperada).guardar(
+                turno=turno,
+                maquina=maquina,
+                tipo_turno=tipo_turno,
+                fecha=fecha,
+                sondajes=sondajes_list,
+                metrajes=metrajes_raw,
+                maquina_estado=maquina_estado,
+                trabajadores=trabajadores_parsed,
+                complementos=complementos_parsed,
+                aditivos=aditivos_parsed,
+                actividades=actividades_parsed,
+                corridas=corridas_parsed,
+                metros_perforados=metros_perforados_val,
+            )
 
             if pk:
                 messages.success(request, f'Turno #{turno.id} actualizado exitosamente para {sondaje.nombre_sondaje}')
             else:
                 messages.success(request, f'Turno #{turno.id} creado exitosamente para {sondaje.nombre_sondaje}')
-            # Después de crear/actualizar, verificar si las actividades suman la duración del turno
-            try:
-                # Sumar horas de actividades guardadas
-                total_horas = 0
-                for act_obj in TurnoActividad.objects.filter(turno=turno):
-                    if act_obj.tiempo_calc:
-                        total_horas += float(act_obj.tiempo_calc)
-                # Obtener duración esperada desde el contrato del sondaje
-                # Same logic as above: for non-admin users prefer their contrato.duracion_turno
-                if request.user.can_manage_all_contracts():
-                    duracion_esperada = float(sondaje.contrato.duracion_turno or 0)
-                else:
-                    duracion_esperada = float(getattr(request.user.contrato, 'duracion_turno', 0) or 0)
-                if total_horas >= duracion_esperada and duracion_esperada > 0:
-                    turno.estado = 'COMPLETADO'
-                    turno.save(update_fields=['estado'])
-            except Exception:
-                # No bloquear el flujo si falla esta comprobación
-                pass
             return redirect('listar-turnos')
             
         except Exception as e:
@@ -1115,12 +955,11 @@ def crear_turno_completo(request, pk=None):
         try:
             actividad_ids = [int(a['actividad_id']) for a in actividades if a.get('actividad_id')]
             if actividad_ids:
-                extra_qs = TipoActividad.objects.filter(id__in=actividad_ids)
-                existing_qs = context.get('tipos_actividad')
-                try:
-                    context['tipos_actividad'] = (existing_qs | extra_qs).distinct()
-                except Exception:
-                    context['tipos_actividad'] = extra_qs
+                presentes = {a.pk for a in form_options.actividades_disponibles(request.user)}
+                context['edit_tipos_actividad_extra_json'] = _json.dumps([
+                    {'id': a.pk, 'nombre': a.nombre} for a in reference_cache.tabla('tipos_actividad')
+                    if a.pk in actividad_ids and a.pk not in presentes
+                ])
         except Exception:
             pass
 
@@ -1196,44 +1035,13 @@ def convert_to_time(time_str):
         return None
 
 def get_context_data(request):
-    """Obtener datos de contexto para el formulario"""
-    contract = request.user.contrato
-    
-    if request.user.can_manage_all_contracts():
-        sondajes = Sondaje.objects.all()
-        maquinas = Maquina.objects.all()
-        trabajadores = Trabajador.objects.all()
-    else:
-        sondajes = Sondaje.objects.filter(contrato=contract)
-        maquinas = Maquina.objects.filter(contrato=contract)
-        trabajadores = Trabajador.objects.filter(contrato=contract)
-    
-    # Actividades disponibles: utilizamos la relación contrato.actividades
-    # (mapeada a la tabla legacy `contratos_actividades`) cuando el usuario
-    # está limitado a un contrato. Los administradores de sistema ven todas
-    # las actividades por defecto.
-    if request.user.can_manage_all_contracts():
-        tipos_actividad_qs = TipoActividad.objects.all()
-    else:
-        # request.user.contrato puede ser None; manejar ese caso
-        tipos_actividad_qs = TipoActividad.objects.none()
-        if contract:
-            try:
-                tipos_actividad_qs = contract.actividades.all()
-            except Exception:
-                # En caso de que la relación through no esté correctamente
-                # configurada en la BD, caer de forma segura a conjunto vacío
-                tipos_actividad_qs = TipoActividad.objects.none()
+    """Obtener datos de contexto para el formulario.
 
+    Las opciones de los <select> (sondajes, máquinas, trabajadores y tablas de
+    referencia) no se renderizan aquí: la plantilla las pide a
+    `api_turno_opciones`, que responde un JSON cacheado por contrato con ETag.
+    """
     return {
-        'sondajes': sondajes.filter(estado='ACTIVO'),
-        'maquinas': maquinas.filter(estado='OPERATIVO'),
-        'trabajadores': trabajadores.filter(is_active=True),
-        'tipos_turno': TipoTurno.objects.all(),
-        'tipos_actividad': tipos_actividad_qs,
-        'tipos_complemento': TipoComplemento.objects.all(),
-        'tipos_aditivo': TipoAditivo.objects.all(),
-        'unidades_medida': UnidadMedida.objects.all(),
         'today': timezone.now().date(),
     }
 
@@ -1271,12 +1079,10 @@ def api_create_actividad(request):
 @login_required
 def listar_turnos(request):
     # Filtrar turnos por permisos del usuario
+    base_turnos = Turno.objects.for_user(request.user)
     if request.user.can_manage_all_contracts():
-        base_turnos = Turno.objects.all()
         sondajes_filtro = Sondaje.objects.all()
     else:
-        # Use the M2M relation 'sondajes' instead of the old FK
-        base_turnos = Turno.objects.filter(sondajes__contrato=request.user.contrato)
         sondajes_filtro = Sondaje.objects.filter(contrato=request.user.contrato)
     
     # Aplicar filtros de búsqueda
@@ -1307,46 +1113,25 @@ def listar_turnos(request):
         'trabajadores_turno__trabajador',
     ).order_by('-fecha', '-id')
     
-    # Agregar otros prefetch según los nombres reales de tus modelos
-    try:
-        # TurnoAvance declara related_name='avance' en el modelo, es OneToOne -> usar select_related
-        turnos = turnos.select_related('avance')
-        # Anotar avance_metros desde TurnoAvance para evitar errores cuando no exista la relación
-        from django.db.models import OuterRef, Subquery, DecimalField
-        avance_sq = TurnoAvance.objects.filter(turno=OuterRef('pk')).values('metros_perforados')[:1]
-        turnos = turnos.annotate(avance_metros=Subquery(avance_sq, output_field=DecimalField()))
-    except Exception:
-        # Si el nombre difiere en tu modelo, ignorar y continuar
-        pass
-    
-    # Estadísticas
-    total_turnos = turnos.count()
+    # TurnoAvance es OneToOne (related_name='avance'): el JOIN de select_related
+    # ya trae los metros, sin subconsulta por fila
+    turnos = turnos.select_related('avance').annotate(avance_metros=models.F('avance__metros_perforados'))
     
-    # Metros con nombre correcto del modelo
-    metros_total = 0
-    try:
-        # Ajustar según el nombre real de tu modelo de avance
-        from django.db.models import Sum
-        metros_result = TurnoAvance.objects.filter(
-            turno__in=turnos
-        ).aggregate(total=Sum('metros_perforados'))
-        metros_total = metros_result['total'] or 0
-    except:
-        metros_total = 0
-    
-    # Turnos mes actual
-    from django.utils import timezone
-    hoy = timezone.now().date()
-    turnos_mes = turnos.filter(fecha__month=hoy.month, fecha__year=hoy.year).count()
-    
-    # Promedio
+    # Estadísticas en una sola consulta (avance es OneToOne: el JOIN no duplica turnos)
+    from django.db.models import Count, Q, Sum
+    inicio_mes = timezone.now().date().replace(day=1)
+    estadisticas = turnos_query.aggregate(
+        total=Count('id'),
+        metros=Sum('avance__metros_perforados'),
+        mes=Count('id', filter=Q(fecha__gte=inicio_mes, fecha__lt=(inicio_mes + timedelta(days=32)).replace(day=1))),
+    )
+    total_turnos = estadisticas['total']
+    metros_total = estadisticas['metros'] or 0
+    turnos_mes = estadisticas['mes']
     promedio_avance = metros_total / total_turnos if total_turnos > 0 else 0
     
-    # Paginación
-    from django.core.paginator import Paginator
-    paginator = Paginator(turnos, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Paginación por cursor sobre (fecha, id): sin OFFSET en páginas profundas
+    page_obj = paginar_keyset(request, turnos, 20)
     
     context = {
         'turnos': page_obj,
@@ -1374,6 +1159,16 @@ class TurnoDeleteView(AdminOrContractFilterMixin, DeleteView):
     template_name = 'drilling/turno/confirm_delete.html'
     success_url = reverse_lazy('listar-turnos')
 
+    def form_valid(self, form):
+        with transaction.atomic():
+            # Revertir en el horómetro las horas que aportaba el turno eliminado
+            horas = TurnoMaquina.objects.filter(turno=self.object).values_list('horas_trabajadas_calc', flat=True).first()
+            if horas:
+                HorometroMovimiento.registrar([HorometroMovimiento(
+                    maquina_id=self.object.maquina_id, fecha=self.object.fecha, horas=-horas,
+                )])
+            return super().form_valid(form)
+
     def delete(self, request, *args, **kwargs):
         messages.success(request, 'Turno eliminado exitosamente')
         return super().delete(request, *args, **kwargs)
@@ -1401,16 +1196,17 @@ def aprobar_turno(request, pk):
 # ABASTECIMIENTO VIEWS - COMPLETO
 # ===============================
 
-class AbastecimientoListView(AdminOrContractFilterMixin, ListView):
+class AbastecimientoListView(AdminOrContractFilterMixin, KeysetPaginationMixin, ListView):
     model = Abastecimiento
     template_name = 'drilling/abastecimiento/list.html'
     context_object_name = 'abastecimientos'
     paginate_by = 50
     
     def get_queryset(self):
+        # El orden lo fija la paginación por cursor (keyset_ordering)
         queryset = super().get_queryset().select_related(
             'contrato', 'unidad_medida', 'tipo_complemento', 'tipo_aditivo'
-        ).order_by('-fecha', '-created_at')
+        )
         
         # Filtros adicionales
         familia = self.request.GET.get('familia')
@@ -1504,13 +1300,10 @@ class AbastecimientoDetailView(AdminOrContractFilterMixin, DetailView):
             abastecimiento=self.object
         ).select_related('turno').prefetch_related('turno__sondajes').order_by('-created_at')
         
-        # Calcular stock disponible
-        total_consumido = context['consumos'].aggregate(
-            total=models.Sum('cantidad_consumida')
-        )['total'] or 0
-        
-        context['stock_disponible'] = self.object.cantidad - total_consumido
-        context['total_consumido'] = total_consumido
+        # Stock disponible desde el saldo materializado
+        balance = balance_de(self.object)
+        context['stock_disponible'] = balance.cantidad_disponible
+        context['total_consumido'] = balance.cantidad_consumida
         
         return context
 
@@ -1535,7 +1328,17 @@ class AbastecimientoDeleteView(AdminOrContractFilterMixin, DeleteView):
 
 @login_required
 def importar_abastecimiento_excel(request):
-    """Vista para importar con borrado previo por mes operativo"""
+    """Vista para importar con borrado previo por mes operativo.
+
+    El archivo se encola (ImportacionAbastecimiento) y lo procesa el worker
+    `manage.py procesar_importaciones`; la página consulta el avance en
+    `api_importacion_estado`. Con IMPORTACION_EN_SEGUNDO_PLANO=False se
+    procesa dentro del request.
+
+    Con `vista_previa=on` el worker solo valida el archivo (sin escribir
+    datos) y deja el informe en la importación; `confirmar_importacion` la
+    encola después para importarla.
+    """
     
     if request.method == 'POST':
         if 'excel_file' not in request.FILES:
@@ -1546,85 +1349,181 @@ def importar_abastecimiento_excel(request):
         delete_existing = request.POST.get('delete_existing', 'on') == 'on'
         
         # Validar extensión
-        if not excel_file.name.endswith(('.xlsx', '.xls')):
-            messages.error(request, 'El archivo debe ser formato Excel (.xlsx o .xls)')
+        if not excel_file.name.lower().endswith(FORMATOS_IMPORTACION):
+            messages.error(request, 'El archivo debe ser formato Excel (.xlsx o .xls) o CSV')
             return redirect('importar-abastecimiento')
         
-        # Procesar archivo
-        importer = AbastecimientoExcelImporter(request.user)
-        result = importer.process_excel(excel_file, delete_existing)
-        
-        if result['success']:
-            mensaje_principal = f"Importación completada: {result['success_count']} registros creados"
-            
-            if result['deleted_count'] > 0:
-                mensaje_principal += f", {result['deleted_count']} registros anteriores eliminados"
-                
-            if result['skip_count'] > 0:
-                mensaje_principal += f", {result['skip_count']} registros omitidos"
-            
-            messages.success(request, mensaje_principal)
-            
-            # Mostrar información adicional
-            if result['meses_procesados']:
-                messages.info(
-                    request,
-                    f"Meses procesados: {', '.join(result['meses_procesados'])}"
-                )
-            
-            if result['contratos_procesados']:
-                messages.info(
-                    request,
-                    f"Contratos afectados: {', '.join(result['contratos_procesados'])}"
-                )
-            
-            # Mostrar errores si los hay
-            if result['errors']:
-                for error in result['errors'][:10]:  # Mostrar máximo 10 errores
-                    messages.warning(request, error)
-                    
-                if len(result['errors']) > 10:
-                    messages.warning(
-                        request,
-                        f"... y {len(result['errors']) - 10} errores más"
-                    )
-        else:
-            messages.error(request, f"Error en importación: {result['error']}")
-            
-        return redirect('abastecimiento-list')
+        solo_validar = request.POST.get('vista_previa') == 'on'
+        importacion = encolar_importacion(request.user, excel_file, delete_existing, solo_validar=solo_validar)
+        return _procesar_encolada(request, importacion)
     
     # GET - Mostrar formulario de importación
     context = {
         'is_system_admin': request.user.can_manage_all_contracts(),
-        'accessible_contracts': request.user.get_accessible_contracts()
+        'accessible_contracts': request.user.get_accessible_contracts(),
+        'importacion_id': request.GET.get('importacion'),
+        'importaciones_recientes': _importaciones_visibles(request.user)[:10],
     }
     
     return render(request, 'drilling/abastecimiento/importar.html', context)
 
+def _procesar_encolada(request, importacion):
+    """Respuesta para una importación recién encolada (o procesada en el request)."""
+    en_segundo_plano = getattr(settings, 'IMPORTACION_EN_SEGUNDO_PLANO', True)
+    if not en_segundo_plano:
+        ejecutar_importacion(importacion)
+        if importacion.solo_validar:
+            return _respuesta_vista_previa(request, importacion)
+    
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({
+            'id': importacion.pk,
+            'estado_url': reverse('api-importacion-estado', args=[importacion.pk]),
+            **importacion.progreso(),
+        }, status=202 if en_segundo_plano else 200)
+    
+    if en_segundo_plano:
+        tipo = 'Vista previa' if importacion.solo_validar else 'Importación'
+        messages.info(request, f'{tipo} #{importacion.pk} encolada: {importacion.nombre_archivo}')
+        return redirect(f"{reverse('importar-abastecimiento')}?importacion={importacion.pk}")
+    
+    _mensajes_importacion(request, importacion)
+    return redirect('abastecimiento-list')
+
+def _informe_vista_previa(importacion):
+    """Informe de una vista previa lista (PREVIA) para responder por JSON."""
+    return {
+        'id': importacion.pk,
+        'confirmar_url': reverse('confirmar-importacion', args=[importacion.pk]),
+        **importacion.resultado,
+    }
+
+def _respuesta_vista_previa(request, importacion):
+    """Informe de validación hecha en el request: JSON completo por AJAX, o mensajes y volver al formulario."""
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        if importacion.estado != 'PREVIA':
+            return JsonResponse({'id': importacion.pk, 'error': importacion.mensaje}, status=400)
+        return JsonResponse(_informe_vista_previa(importacion))
+    
+    if importacion.estado != 'PREVIA':
+        messages.error(request, f"Error en vista previa: {importacion.mensaje}")
+        return redirect('importar-abastecimiento')
+    
+    resumen = importacion.resultado
+    messages.info(
+        request,
+        f"Vista previa #{importacion.pk}: {resumen['valid_count']} filas válidas, "
+        f"{resumen['error_count']} con errores de {resumen['total_rows']}"
+    )
+    if resumen['registros_a_reemplazar']:
+        messages.warning(request, f"Se reemplazarán {resumen['registros_a_reemplazar']} registros existentes")
+    for error in importacion.errores[:10]:
+        messages.warning(request, error)
+    return redirect(f"{reverse('importar-abastecimiento')}?importacion={importacion.pk}")
+
+@login_required
+def confirmar_importacion(request, pk):
+    """Encolar una vista previa; el worker importa las filas ya validadas."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    importacion = get_object_or_404(_importaciones_visibles(request.user), pk=pk)
+    if not importacion.confirmar():
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'error': 'La vista previa ya fue confirmada o descartada'}, status=409)
+        messages.error(request, 'La vista previa ya fue confirmada o descartada')
+        return redirect('importar-abastecimiento')
+    return _procesar_encolada(request, importacion)
+
+def _importaciones_visibles(user):
+    importaciones = ImportacionAbastecimiento.objects.all()
+    if not user.can_manage_all_contracts():
+        importaciones = importaciones.filter(usuario=user)
+    return importaciones
+
+def _mensajes_importacion(request, importacion):
+    """Resumen de una importación terminada como mensajes de Django."""
+    if importacion.estado != 'COMPLETADO':
+        messages.error(request, f"Error en importación: {importacion.mensaje}")
+        return
+    
+    if importacion.reemplazar_existentes:
+        mensaje_principal = f"Importación completada: {importacion.creados} registros creados"
+    else:
+        mensaje_principal = (
+            f"Importación completada: {importacion.resultado.get('insertados', 0)} nuevos, "
+            f"{importacion.resultado.get('actualizados', 0)} actualizados, "
+            f"{importacion.resultado.get('sin_cambios', 0)} sin cambios"
+        )
+    
+    if importacion.eliminados > 0:
+        mensaje_principal += f", {importacion.eliminados} registros anteriores eliminados"
+        
+    if importacion.omitidos > 0:
+        mensaje_principal += f", {importacion.omitidos} registros omitidos"
+    
+    messages.success(request, mensaje_principal)
+    
+    # Mostrar información adicional
+    if importacion.resultado.get('meses_procesados'):
+        messages.info(
+            request,
+            f"Meses procesados: {', '.join(importacion.resultado['meses_procesados'])}"
+        )
+    
+    if importacion.resultado.get('contratos_procesados'):
+        messages.info(
+            request,
+            f"Contratos afectados: {', '.join(importacion.resultado['contratos_procesados'])}"
+        )
+    
+    # Mostrar errores si los hay
+    for error in importacion.errores[:10]:  # Mostrar máximo 10 errores
+        messages.warning(request, error)
+        
+    if importacion.omitidos > 10:
+        messages.warning(
+            request,
+            f"... y {importacion.omitidos - 10} errores más"
+        )
+
+@login_required
+def api_importacion_estado(request, pk):
+    """Avance de una importación encolada (para consultar periódicamente desde la página).
+
+    Cuando una vista previa queda lista (PREVIA) el informe está en `resultado`
+    y se agrega `confirmar_url`.
+    """
+    importacion = get_object_or_404(_importaciones_visibles(request.user), pk=pk)
+    datos = importacion.progreso()
+    if importacion.estado == 'PREVIA':
+        datos['confirmar_url'] = reverse('confirmar-importacion', args=[importacion.pk])
+    return JsonResponse(datos)
+
 # ===============================
 # CONSUMO STOCK VIEWS - COMPLETO
 # ===============================
 
-class ConsumoStockListView(AdminOrContractFilterMixin, ListView):
+class ConsumoStockListView(AdminOrContractFilterMixin, KeysetPaginationMixin, ListView):
     model = ConsumoStock
     template_name = 'drilling/consumo/list.html'
     context_object_name = 'consumos'
     paginate_by = 50
+    keyset_ordering = ('-created_at', '-id')
+    keyset_count = 'estimado'
     
     def get_queryset(self):
         # Adjust for Turno.sondajes (M2M). Keep select_related for FK fields.
         queryset = ConsumoStock.objects.select_related(
             'turno', 'abastecimiento', 'abastecimiento__unidad_medida'
-        ).prefetch_related('turno__sondajes__contrato').order_by('-created_at')
+        ).prefetch_related('turno__sondajes__contrato')
         
         # Filtrar por contrato si no es admin
-        if not self.request.user.can_manage_all_contracts():
-            queryset = queryset.filter(turno__sondajes__contrato=self.request.user.contrato)
+        queryset = queryset.for_user(self.request.user)
         
         # Filtros adicionales
         contrato_id = self.request.GET.get('contrato')
         if contrato_id and self.request.user.can_manage_all_contracts():
-            queryset = queryset.filter(turno__sondajes__contrato_id=contrato_id)
+            queryset = queryset.for_contract(contrato_id)
             
         sondaje_id = self.request.GET.get('sondaje')
         if sondaje_id:
@@ -1654,77 +1553,72 @@ class ConsumoStockListView(AdminOrContractFilterMixin, ListView):
         
         return context
 
-class ConsumoStockCreateView(AdminOrContractFilterMixin, CreateView):
-    model = ConsumoStock
-    form_class = ConsumoStockForm
-    template_name = 'drilling/consumo/form.html'
-    success_url = reverse_lazy('consumo-list')
-    
+class ConsumoStockFormMixin:
+    """Restringe los selects del formulario de consumo al contrato del usuario.
+
+    Los widgets solo renderizan la opción elegida (el resto llega por los
+    endpoints de autocompletado), así que estos querysets solo se usan para
+    validar el valor enviado.
+    """
+
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        
-        # Filtrar turnos por contrato (use sondajes M2M)
         accessible_contracts = self.request.user.get_accessible_contracts()
-        form.fields['turno'].queryset = Turno.objects.filter(
-            sondajes__contrato__in=accessible_contracts
-        ).prefetch_related('sondajes').order_by('-fecha')
+        form.fields['turno'].queryset = Turno.objects.for_contract(
+            accessible_contracts
+        ).prefetch_related('sondajes')
         
-        # Filtrar abastecimientos con stock disponible
+        # Solo líneas con saldo disponible (conservando la ya asignada al editar)
+        con_stock = models.Q(balance__cantidad_disponible__gt=0)
+        if self.object is not None:
+            con_stock |= models.Q(pk=self.object.abastecimiento_id)
         form.fields['abastecimiento'].queryset = Abastecimiento.objects.filter(
-            contrato__in=accessible_contracts
+            con_stock, contrato__in=accessible_contracts
         ).annotate(
-            stock_disponible=models.F('cantidad') - models.Subquery(
-                ConsumoStock.objects.filter(
-                    abastecimiento=models.OuterRef('pk')
-                ).aggregate(
-                    total_consumido=models.Sum('cantidad_consumida')
-                )['total_consumido'] or 0
-            )
-        ).filter(stock_disponible__gt=0).order_by('descripcion')
+            stock_disponible=models.F('balance__cantidad_disponible')
+        ).order_by('descripcion')
         
         return form
+
+class ConsumoStockCreateView(ConsumoStockFormMixin, AdminOrContractFilterMixin, CreateView):
+    model = ConsumoStock
+    form_class = ConsumoStockForm
+    template_name = 'drilling/consumo/form.html'
+    success_url = reverse_lazy('consumo-list')
     
     def form_valid(self, form):
-        # Validar que hay stock suficiente
-        abastecimiento = form.instance.abastecimiento
-        cantidad_solicitada = form.instance.cantidad_consumida
-        
-        stock_actual = abastecimiento.cantidad - (
-            ConsumoStock.objects.filter(
-                abastecimiento=abastecimiento
-            ).aggregate(
-                total=models.Sum('cantidad_consumida')
-            )['total'] or 0
-        )
-        
-        if cantidad_solicitada > stock_actual:
-            form.add_error(
-                'cantidad_consumida',
-                f'Stock insuficiente. Disponible: {stock_actual}'
-            )
+        # Verificar y descontar el stock en la misma transacción (saldo bloqueado)
+        try:
+            self.object, = reservar_stock([form.instance])
+        except ValidationError as e:
+            for mensaje in e.messages:
+                form.add_error('cantidad_consumida', mensaje)
             return self.form_invalid(form)
         
         messages.success(self.request, 'Consumo registrado exitosamente')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
-class ConsumoStockUpdateView(AdminOrContractFilterMixin, UpdateView):
+class ConsumoStockUpdateView(ConsumoStockFormMixin, AdminOrContractFilterMixin, UpdateView):
     model = ConsumoStock
     form_class = ConsumoStockForm
     template_name = 'drilling/consumo/form.html'
     success_url = reverse_lazy('consumo-list')
     
     def get_queryset(self):
-        queryset = super().get_queryset()
-        
         # Filtrar por contrato si no es admin
-        if not self.request.user.can_manage_all_contracts():
-            queryset = queryset.filter(turno__sondajes__contrato=self.request.user.contrato)
-        
-        return queryset
+        return super().get_queryset().for_user(self.request.user)
     
     def form_valid(self, form):
+        # Cambios de cantidad o de línea verificados contra los saldos bloqueados
+        try:
+            self.object = actualizar_consumo(form.instance)
+        except ValidationError as e:
+            for mensaje in e.messages:
+                form.add_error('cantidad_consumida', mensaje)
+            return self.form_invalid(form)
+
         messages.success(self.request, 'Consumo actualizado exitosamente')
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
 class ConsumoStockDeleteView(AdminOrContractFilterMixin, DeleteView):
     model = ConsumoStock
@@ -1732,13 +1626,8 @@ class ConsumoStockDeleteView(AdminOrContractFilterMixin, DeleteView):
     success_url = reverse_lazy('consumo-list')
     
     def get_queryset(self):
-        queryset = super().get_queryset()
-        
         # Filtrar por contrato si no es admin
-        if not self.request.user.can_manage_all_contracts():
-            queryset = queryset.filter(turno__sondajes__contrato=self.request.user.contrato)
-        
-        return queryset
+        return super().get_queryset().for_user(self.request.user)
     
     def delete(self, request, *args, **kwargs):
         messages.success(request, 'Consumo eliminado exitosamente')
@@ -1754,55 +1643,32 @@ class StockDisponibleView(AdminOrContractFilterMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Calcular stock disponible por producto
-        stock_query = '''
-            SELECT 
-                a.id,
-                a.descripcion,
-                a.familia,
-                a.serie,
-                um.simbolo as unidad,
-                SUM(a.cantidad) as abastecido,
-                COALESCE(SUM(c.cantidad_consumida), 0) as consumido,
-                SUM(a.cantidad) - COALESCE(SUM(c.cantidad_consumida), 0) as disponible,
-                a.precio_unitario,
-                (SUM(a.cantidad) - COALESCE(SUM(c.cantidad_consumida), 0)) * a.precio_unitario as valor_stock
-            FROM abastecimiento a
-            LEFT JOIN consumo_stock c ON a.id = c.abastecimiento_id
-            LEFT JOIN unidades_medida um ON a.unidad_medida_id = um.id
-            WHERE a.contrato_id = %s
-            GROUP BY a.id, a.descripcion, a.familia, a.serie, um.simbolo, a.precio_unitario
-            HAVING SUM(a.cantidad) - COALESCE(SUM(c.cantidad_consumida), 0) > 0
-            ORDER BY a.familia, a.descripcion
-        '''
-        
-        from django.db import connection
-        with connection.cursor() as cursor:
-            cursor.execute(stock_query, [self.request.user.contrato.id])
-            stock_data = cursor.fetchall()
+        # Stock disponible por producto desde los saldos materializados
+        balances = StockBalance.objects.filter(
+            contrato=self.request.user.contrato,
+            cantidad_disponible__gt=0,
+        ).select_related(
+            'abastecimiento', 'abastecimiento__unidad_medida'
+        ).order_by('abastecimiento__familia', 'abastecimiento__descripcion')
         
         # Organizar por familia
         stock_por_familia = {}
         total_valor = 0
         
-        for row in stock_data:
-            familia = row[2]
-            if familia not in stock_por_familia:
-                stock_por_familia[familia] = []
-            
-            stock_por_familia[familia].append({
-                'id': row[0],
-                'descripcion': row[1],
-                'serie': row[3],
-                'unidad': row[4],
-                'abastecido': row[5],
-                'consumido': row[6],
-                'disponible': row[7],
-                'precio_unitario': row[8],
-                'valor_stock': row[9] or 0
+        for balance in balances:
+            abastecimiento = balance.abastecimiento
+            stock_por_familia.setdefault(abastecimiento.familia, []).append({
+                'id': abastecimiento.id,
+                'descripcion': abastecimiento.descripcion,
+                'serie': abastecimiento.serie,
+                'unidad': abastecimiento.unidad_medida.simbolo,
+                'abastecido': abastecimiento.cantidad,
+                'consumido': balance.cantidad_consumida,
+                'disponible': balance.cantidad_disponible,
+                'precio_unitario': balance.precio_unitario,
+                'valor_stock': balance.valor_disponible,
             })
-            
-            total_valor += row[9] or 0
+            total_valor += balance.valor_disponible
         
         context['stock_por_familia'] = stock_por_familia
         context['total_valor_stock'] = total_valor
@@ -1813,6 +1679,89 @@ class StockDisponibleView(AdminOrContractFilterMixin, TemplateView):
 # API VIEWS
 # ===============================
 
+AUTOCOMPLETE_LIMITE = 20
+AUTOCOMPLETE_LIMITE_MAX = 50
+
+def _parametros_autocompletado(request):
+    """Término de búsqueda y límite (acotado) de un request de autocompletado."""
+    termino = request.GET.get('q', '').strip()
+    try:
+        limite = int(request.GET.get('limit', AUTOCOMPLETE_LIMITE))
+    except ValueError:
+        limite = AUTOCOMPLETE_LIMITE
+    return termino, max(1, min(limite, AUTOCOMPLETE_LIMITE_MAX))
+
+@login_required
+def api_turno_autocomplete(request):
+    """Buscar turnos del contrato por id, sondaje o máquina (GET ?q=&limit=).
+
+    Retorna {'results': [{'id', 'text'}], 'more': bool}, más recientes primero.
+    """
+    termino, limite = _parametros_autocompletado(request)
+    turnos = Turno.objects.for_contract(request.user.get_accessible_contracts())
+    if termino:
+        filtro = models.Q(maquina__nombre__icontains=termino) | models.Q(
+            pk__in=TurnoSondaje.objects.filter(
+                sondaje__nombre_sondaje__icontains=termino
+            ).values('turno_id')
+        )
+        if termino.isdigit():
+            filtro |= models.Q(pk=int(termino))
+        turnos = turnos.filter(filtro)
+    turnos = list(turnos.prefetch_related('sondajes').order_by('-fecha', '-id')[:limite + 1])
+    return JsonResponse({
+        'results': [{'id': t.pk, 'text': str(t)} for t in turnos[:limite]],
+        'more': len(turnos) > limite,
+    })
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=lambda request: form_options.etag(request.user))
+def api_turno_opciones(request):
+    """Opciones de los <select> del formulario de turno (GET).
+
+    Retorna {'sondajes', 'maquinas', 'trabajadores', 'tipos_turno',
+    'tipos_actividad', 'tipos_complemento', 'tipos_aditivo', 'unidades_medida'}
+    del contrato del usuario (de todos para administradores). El navegador
+    revalida con If-None-Match y recibe 304 sin consultar la BD mientras no
+    cambien esos datos.
+    """
+    _, datos = form_options.opciones(request.user)
+    return JsonResponse(datos)
+
+@login_required
+def api_abastecimiento_autocomplete(request):
+    """Buscar líneas de abastecimiento con stock por descripción, código o serie (GET ?q=&limit=).
+
+    Retorna {'results': [{'id', 'text', 'disponible', 'unidad'}], 'more': bool}.
+    """
+    termino, limite = _parametros_autocompletado(request)
+    balances = StockBalance.objects.filter(
+        contrato__in=request.user.get_accessible_contracts(),
+        cantidad_disponible__gt=0,
+    )
+    if termino:
+        balances = balances.filter(
+            models.Q(abastecimiento__descripcion__icontains=termino)
+            | models.Q(abastecimiento__codigo_producto__icontains=termino)
+            | models.Q(abastecimiento__serie__icontains=termino)
+        )
+    balances = list(balances.select_related(
+        'abastecimiento', 'abastecimiento__unidad_medida'
+    ).order_by('abastecimiento__descripcion', 'pk')[:limite + 1])
+    return JsonResponse({
+        'results': [
+            {
+                'id': b.pk,
+                'text': b.abastecimiento.descripcion,
+                'disponible': str(b.cantidad_disponible),
+                'unidad': b.abastecimiento.unidad_medida.simbolo,
+            }
+            for b in balances[:limite]
+        ],
+        'more': len(balances) > limite,
+    })
+
 @login_required
 def api_abastecimiento_detalle(request, pk):
     """API para obtener detalles de un abastecimiento"""
@@ -1822,14 +1771,7 @@ def api_abastecimiento_detalle(request, pk):
             pk=pk
         )
         
-        # Calcular stock disponible
-        total_consumido = ConsumoStock.objects.filter(
-            abastecimiento=abastecimiento
-        ).aggregate(
-            total=models.Sum('cantidad_consumida')
-        )['total'] or 0
-        
-        stock_disponible = abastecimiento.cantidad - total_consumido
+        stock_disponible = balance_de(abastecimiento).cantidad_disponible
         
         data = {
             'id': abastecimiento.id,
@@ -1848,4 +1790,120 @@ def api_abastecimiento_detalle(request, pk):
         return JsonResponse(data)
         
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=400)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=400)
+
+# ===============================
+# API JSON DE TURNOS (v1)
+# ===============================
+
+API_TURNOS_LIMITE = 20
+API_TURNOS_LIMITE_MAX = 100
+
+
+def _api_error(mensaje, status, code='invalid'):
+    return JsonResponse({'errors': {'__all__': [{'message': mensaje, 'code': code}]}}, status=status)
+
+
+def _api_documento(request):
+    """Cuerpo JSON del request o None si no es JSON válido."""
+    try:
+        return json.loads(request.body or b'null')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _api_guardar(request, turno=None):
+    if not request.user.can_supervise_operations():
+        return _api_error('Requiere permisos de Supervisor o superior.', 403, 'permission')
+    documento = _api_documento(request)
+    if documento is None:
+        return _api_error('El cuerpo debe ser un objeto JSON.', 400, 'parse_error')
+    creado = turno is None
+    try:
+        turno = guardar_turno(documento, request.user, turno=turno)
+    except DatosInvalidos as e:
+        return JsonResponse({'errors': e.errores}, status=400)
+    turno = turnos_con_detalle(Turno.objects.filter(pk=turno.pk)).get()
+    response = JsonResponse(serializar_turno(turno), status=201 if creado else 200)
+    if creado:
+        response['Location'] = reverse('api-v1-turno-detalle', kwargs={'pk': turno.pk})
+    return response
+
+
+def api_v1_turnos(request):
+    """Turnos como documentos JSON anidados.
+
+    GET: turnos accesibles, más recientes primero, paginados por cursor
+    (?fecha_desde=&fecha_hasta=&limit=&cursor=). Retorna {'results', 'next', 'previous'}.
+    POST: crea un turno a partir de un documento (misma forma que devuelve GET,
+    sin los campos calculados). Responde 201 con el documento o 400 con
+    {'errors': {...}} por campo. Autenticación por sesión; los POST requieren
+    el token CSRF en la cabecera X-CSRFToken.
+    """
+    if not request.user.is_authenticated:
+        return _api_error('No autenticado.', 401, 'not_authenticated')
+    if request.method == 'POST':
+        return _api_guardar(request)
+    if request.method != 'GET':
+        return _api_error('Método no permitido.', 405, 'method_not_allowed')
+
+    turnos = Turno.objects.for_user(request.user)
+    for parametro, lookup in (('fecha_desde', 'fecha__gte'), ('fecha_hasta', 'fecha__lte')):
+        try:
+            valor = parse_date(request.GET.get(parametro, ''))
+        except ValueError:
+            valor = None
+        if valor:
+            turnos = turnos.filter(**{lookup: valor})
+    try:
+        limite = int(request.GET.get('limit', API_TURNOS_LIMITE))
+    except ValueError:
+        limite = API_TURNOS_LIMITE
+    limite = max(1, min(limite, API_TURNOS_LIMITE_MAX))
+    page = KeysetPaginator(turnos_con_detalle(turnos), limite, ('-fecha', '-id')).get_page(request.GET.get('cursor'))
+    return JsonResponse({
+        'results': [serializar_turno(t) for t in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def api_v1_turno_detalle(request, pk):
+    """GET: documento del turno. PUT: lo reemplaza completo (mismas reglas que POST)."""
+    if not request.user.is_authenticated:
+        return _api_error('No autenticado.', 401, 'not_authenticated')
+    turno = turnos_con_detalle(Turno.objects.for_user(request.user)).filter(pk=pk).first()
+    if turno is None:
+        return _api_error('Turno no encontrado.', 404, 'not_found')
+    if request.method == 'PUT':
+        return _api_guardar(request, turno)
+    if request.method != 'GET':
+        return _api_error('Método no permitido.', 405, 'method_not_allowed')
+    return JsonResponse(serializar_turno(turno))
+
+# ===============================
+# MÉTRICAS DE REQUESTS
+# ===============================
+
+class MetricasRequestsView(SystemAdminRequiredMixin, TemplateView):
+    """Consultas y tiempos por vista medidos por RequestMetricsMiddleware (este proceso).
+
+    `?formato=json` devuelve las mismas filas; POST reinicia los contadores.
+    """
+    template_name = 'drilling/metricas/list.html'
+    
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('formato') == 'json':
+            return JsonResponse({'vistas': request_metrics.resumen()})
+        return super().get(request, *args, **kwargs)
+    
+    def post(self, request, *args, **kwargs):
+        request_metrics.reiniciar()
+        messages.success(request, 'Métricas reiniciadas')
+        return redirect('metricas-requests')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['vistas'] = request_metrics.resumen()
+        context['is_system_admin'] = True
+        return context
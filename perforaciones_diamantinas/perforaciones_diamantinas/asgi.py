@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'perforaciones_diamantinas.settings')
 
 application = get_asgi_application()
+
+# Flush de last_activity por tiempo y al salir: solo en el proceso del servidor
+from drilling.utils.activity_tracker import activity_tracker  # noqa: E402
+
+activity_tracker.iniciar()
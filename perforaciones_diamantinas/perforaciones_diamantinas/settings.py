@@ -38,6 +38,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero: mide también los demás middlewares (p. ej. el guardado de la sesión)
+    'drilling.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,20 +71,41 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'perforaciones_diamantinas.wsgi.application'
 
+DB_HOST = env('DB_HOST', default='ep-winter-bread-achugblw-pooler.sa-east-1.aws.neon.tech')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': env('DB_NAME', default='neondb'),
         'USER': env('DB_USER', default='neondb_owner'),
         'PASSWORD': env('DB_PASSWORD', default='npg_Athe0VmqL6cI'),
-        'HOST': env('DB_HOST', default='ep-winter-bread-achugblw-pooler.sa-east-1.aws.neon.tech'),
+        'HOST': DB_HOST,
         'PORT': env('DB_PORT', default='5432'),
+        # Conexiones persistentes: se evita un handshake TLS con el servidor remoto
+        # en cada request. Con health checks una conexión caída se detecta y se
+        # reabre al inicio del request en lugar de fallar a mitad.
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=300),
+        'CONN_HEALTH_CHECKS': env.bool('DB_CONN_HEALTH_CHECKS', default=True),
         'OPTIONS': {
             'sslmode': 'require',
+            'connect_timeout': env.int('DB_CONNECT_TIMEOUT', default=10),
+            # Keepalives TCP para que NAT/balanceadores no corten conexiones inactivas
+            'keepalives': 1,
+            'keepalives_idle': 60,
+            'keepalives_interval': 10,
+            'keepalives_count': 3,
         },
     }
 }
 
+# Pooler de Neon (host '-pooler', PgBouncer en modo transacción): cada transacción
+# puede ir a otra conexión del servidor, así que los cursores con nombre de
+# `.iterator()` no sobreviven entre consultas y deben desactivarse. El pooling
+# de conexiones queda a cargo de este pooler (no hay pool dentro del proceso).
+DB_POOLER = env.bool('DB_POOLER', default='-pooler' in DB_HOST)
+if DB_POOLER:
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',},
@@ -124,4 +147,67 @@ MESSAGE_TAGS = {
 
 SESSION_COOKIE_AGE = 8 * 60 * 60
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
-SESSION_SAVE_EVERY_REQUEST = True
\ No newline at end of file
+SESSION_SAVE_EVERY_REQUEST = True
+# Sesiones en BD sin UPDATE por request (drilling.utils.sessions): la fila se
+# renueva como máximo una vez cada SESSION_REFRESH_MARGIN segundos; la cookie
+# mantiene la expiración deslizante de SESSION_COOKIE_AGE y el servidor nunca
+# acepta una sesión más de SESSION_COOKIE_AGE después del último request.
+SESSION_ENGINE = 'drilling.utils.sessions'
+SESSION_REFRESH_MARGIN = env.int('SESSION_REFRESH_MARGIN', default=600)
+
+# Caché de Django. Por defecto en memoria del proceso (un solo worker); con
+# varios workers usar una compartida para que la invalidación llegue a todos,
+# p. ej. CACHE_URL=filecache:///var/tmp/aplicativo o dbcache://cache_aplicativo
+# (esta última requiere `manage.py createcachetable`). Con importaciones en
+# segundo plano la caché compartida es obligatoria: `procesar_importaciones`
+# corre en otro proceso y crea unidades y tipos que la web debe ver; el worker
+# no arranca si la caché de REFERENCE_DATA_CACHE es en memoria del proceso.
+CACHES = {'default': env.cache_url('CACHE_URL', default='locmemcache://')}
+
+# Tablas de referencia (tipos de turno, actividad, complemento, aditivo,
+# unidades y actividades por contrato) cacheadas por drilling.utils.reference_cache,
+# y opciones del formulario de turno por contrato (drilling.utils.form_options);
+# se invalidan por señales al guardar o borrar, el timeout es solo un tope.
+REFERENCE_DATA_CACHE = env('REFERENCE_DATA_CACHE', default='default')
+REFERENCE_DATA_TIMEOUT = env.int('REFERENCE_DATA_TIMEOUT', default=3600)
+
+# Registro de última actividad (drilling.utils.activity_tracker): como máximo
+# una escritura por usuario cada ACTIVITY_TRACKING_WINDOW segundos, agrupadas
+# en un único UPDATE cada ACTIVITY_FLUSH_INTERVAL segundos o ACTIVITY_FLUSH_BATCH usuarios.
+# El flush por tiempo corre en un hilo daemon aunque el worker no reciba más tráfico;
+# solo se activa en el proceso del servidor (wsgi.py/asgi.py), nunca en tests ni comandos.
+ACTIVITY_TRACKING_WINDOW = env.int('ACTIVITY_TRACKING_WINDOW', default=300)
+ACTIVITY_FLUSH_INTERVAL = env.int('ACTIVITY_FLUSH_INTERVAL', default=60)
+ACTIVITY_FLUSH_BATCH = env.int('ACTIVITY_FLUSH_BATCH', default=100)
+ACTIVITY_FLUSH_TIMER = env.bool('ACTIVITY_FLUSH_TIMER', default=True)
+
+# Panel de stock crítico del dashboard: líneas con disponible <= umbral (las N más críticas)
+STOCK_CRITICO_UMBRAL = env.int('STOCK_CRITICO_UMBRAL', default=5)
+STOCK_CRITICO_LIMITE = env.int('STOCK_CRITICO_LIMITE', default=10)
+
+# Importaciones de abastecimiento: se encolan y las procesa `manage.py procesar_importaciones`.
+# En False se procesan dentro del request (útil en desarrollo sin worker).
+IMPORTACION_EN_SEGUNDO_PLANO = env.bool('IMPORTACION_EN_SEGUNDO_PLANO', default=True)
+# Cada cuántos segundos el worker marca como vivas sus importaciones en proceso;
+# `procesar_importaciones --stale-minutes` debe ser bastante mayor.
+IMPORTACION_LATIDO_SEGUNDOS = env.int('IMPORTACION_LATIDO_SEGUNDOS', default=30)
+
+# Métricas por vista (drilling.middleware.RequestMetricsMiddleware): encabezado
+# Server-Timing, página /metricas/ para administradores y warning en el log
+# cuando una vista supera su presupuesto de consultas (por nombre de URL).
+# Server-Timing solo va a usuarios staff/administradores; en True, a todas las respuestas.
+REQUEST_METRICS_ENABLED = env.bool('REQUEST_METRICS_ENABLED', default=True)
+REQUEST_METRICS_SERVER_TIMING = env.bool('REQUEST_METRICS_SERVER_TIMING', default=False)
+QUERY_BUDGET_DEFAULT = env.int('QUERY_BUDGET_DEFAULT', default=50)
+QUERY_BUDGETS = {
+    'dashboard': 20,
+    'listar-turnos': 15,
+    # GET y POST comparten presupuesto: guardar un turno completo (manage.py bench) usa ~30
+    'crear-turno-completo': 32,
+    'editar-turno-completo': 32,
+    'api-turno-autocomplete': 5,
+    # Solo al reconstruir el paquete del contrato; con caché vigente responde 304 sin consultas propias
+    'api-turno-opciones': 12,
+    'api-abastecimiento-autocomplete': 5,
+    'api-importacion-estado': 5,
+}
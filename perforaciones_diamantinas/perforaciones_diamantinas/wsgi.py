@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'perforaciones_diamantinas.settings')
 
 application = get_wsgi_application()
+
+# Flush de last_activity por tiempo y al salir: solo en el proceso del servidor
+from drilling.utils.activity_tracker import activity_tracker  # noqa: E402
+
+activity_tracker.iniciar()